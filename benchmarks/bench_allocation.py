@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+"""
+Micro-benchmark of the Zone/Subnet allocator
+
+Prints the number of subnets and hosts allocated per second
+for IPv4 and IPv6 zones
+"""
+from __future__ import print_function, division
+import argparse
+import time
+
+from netgen.engine import IPv4Zone, IPv6Zone
+
+CASES = (
+    # (zone class, supernet, subnet prefixlen)
+    (IPv4Zone, '10.0.0.0/8', 24),
+    (IPv4Zone, '10.0.0.0/8', 30),
+    (IPv6Zone, '2001:db8::/32', 64),
+    (IPv6Zone, '2001:db8::/32', 56),
+)
+
+
+def bench_subnets(zone_class, network, prefixlen, count):
+    zone = zone_class('bench', network)
+    start = time.time()
+    for index in range(count):
+        zone.add_subnet('subnet{0}'.format(index), prefixlen)
+    return count / (time.time() - start)
+
+
+def bench_hosts(zone_class, network, prefixlen, count):
+    zone = zone_class('bench', network)
+    subnet = zone.add_subnet('subnet', prefixlen)
+    start = time.time()
+    for index in range(count):
+        subnet.add_host('host{0}'.format(index))
+    return count / (time.time() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--count', '-c', type=int, default=20000,
+                        help='subnets to allocate per case')
+    args = parser.parse_args()
+
+    for zone_class, network, prefixlen in CASES:
+        rate = bench_subnets(zone_class, network, prefixlen, args.count)
+        print('{0:<16} /{1:<4} {2:>12.0f} subnets/s'
+              .format(network, prefixlen, rate))
+    for zone_class, network, prefixlen in ((IPv4Zone, '10.0.0.0/8', 16),
+                                           (IPv6Zone, '2001:db8::/32', 64)):
+        rate = bench_hosts(zone_class, network, prefixlen, args.count)
+        print('{0:<16} /{1:<4} {2:>12.0f} hosts/s'
+              .format(network, prefixlen, rate))
+
+
+if __name__ == '__main__':
+    main()
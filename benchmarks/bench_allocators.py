@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+"""
+Benchmark of the subnet allocators
+
+Allocates the same random mix of subnet sizes with each allocator and
+prints the allocation rate and the packing efficiency, the allocated
+space divided by the space spanned from the start of the zone to the end
+of the last subnet
+"""
+from __future__ import print_function, division
+import argparse
+import random
+import time
+
+from netgen.allocators import allocators
+from netgen.engine import IPv4Zone, IPv6Zone
+from netgen.exception import NetworkFull
+
+CASES = (
+    # (zone class, supernet, subnet prefixlens)
+    (IPv4Zone, '10.0.0.0/8', (22, 24, 26, 28, 29, 30)),
+    (IPv4Zone, '10.0.0.0/8', (24, 30)),
+    (IPv6Zone, '2001:db8::/32', (48, 56, 60, 64)),
+)
+
+
+def bench(allocator, zone_class, network, prefixlens, count, seed):
+    rng = random.Random(seed)
+    sizes = [rng.choice(prefixlens) for _ in range(count)]
+    zone = zone_class('bench', network, allocator=allocator)
+    start = time.time()
+    try:
+        for index, prefixlen in enumerate(sizes):
+            # the sequential allocator needs explicit alignment
+            zone.add_subnet('subnet{0}'.format(index), prefixlen,
+                            align=prefixlen)
+    except NetworkFull:
+        pass
+    elapsed = time.time() - start
+    subnets = zone.subnets
+    used = sum(subnet.network.num_addresses for subnet in subnets)
+    end = max(int(subnet.network.broadcast_address) for subnet in subnets)
+    return len(subnets) / elapsed, used / (end - zone.start + 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--count', '-c', type=int, default=20000,
+                        help='subnets to allocate per case')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed of the subnet sizes')
+    args = parser.parse_args()
+
+    for zone_class, network, prefixlens in CASES:
+        for allocator in sorted(allocators):
+            rate, efficiency = bench(allocator, zone_class, network,
+                                     prefixlens, args.count, args.seed)
+            print('{0:<16} {1:<20} {2:<10} {3:>10.0f} subnets/s'
+                  ' {4:>7.2%} packed'
+                  .format(network, ','.join(map(str, prefixlens)),
+                          allocator, rate, efficiency))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+"""
+Memory benchmark of the host storage modes
+
+Allocates a plan of /24 subnets filled with hosts (a whole /8 by default)
+and reports the memory used by the model with regular and compact hosts
+"""
+from __future__ import print_function, division
+import argparse
+import time
+import tracemalloc
+
+from netgen.engine import IPv4Zone
+
+
+def build_plan(network, hosts_per_subnet, compact):
+    zone = IPv4Zone('bench', network, compact=compact)
+    subnet_count = zone.network.num_addresses // 256
+    for subnet_index in range(subnet_count):
+        subnet = zone.add_subnet('subnet{0}'.format(subnet_index), 24)
+        for host_index in range(hosts_per_subnet):
+            subnet.add_host('host{0}'.format(host_index))
+    return zone
+
+
+def measure(network, hosts_per_subnet, compact):
+    tracemalloc.start()
+    start = time.time()
+    zone = build_plan(network, hosts_per_subnet, compact)
+    elapsed = time.time() - start
+    used = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    hosts = sum(len(subnet.hosts) for subnet in zone.subnets)
+    return hosts, used, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--network', '-n', default='10.0.0.0/8',
+                        help='supernet of the plan (default: 10.0.0.0/8)')
+    parser.add_argument('--hosts', '-H', type=int, default=250,
+                        help='hosts per /24 subnet (default: 250)')
+    parser.add_argument('--mode', choices=('regular', 'compact', 'both'),
+                        default='both')
+    args = parser.parse_args()
+
+    modes = ('regular', 'compact') if args.mode == 'both' else (args.mode,)
+    for mode in modes:
+        hosts, used, elapsed = measure(args.network, args.hosts,
+                                       mode == 'compact')
+        print('{0:<8} {1} hosts: {2:.1f} MiB ({3:.1f} bytes/host) in {4:.1f}s'
+              .format(mode, hosts, used / 2 ** 20, used / hosts, elapsed))
+
+
+if __name__ == '__main__':
+    main()
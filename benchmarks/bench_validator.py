@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+"""
+Compares the voluptuous topology schema with the fast validator
+
+The topology is made of /24 subnets with 250 hosts each, one host
+out of ten having hostvars
+"""
+from __future__ import print_function, division
+import argparse
+import time
+
+from netgen.engine import NetworkGenerator
+
+
+def make_topology(host_count):
+    subnets = []
+    for subnet_index in range(host_count // 250 + 1):
+        hosts = []
+        for host_index in range(min(250, host_count - subnet_index * 250)):
+            name = 'host{0}-{1}'.format(subnet_index, host_index)
+            if host_index % 10 == 0:
+                hosts.append({'name': name,
+                              'vars': {'role': 'web', 'rack': host_index}})
+            else:
+                hosts.append(name)
+        subnets.append({'name': 'subnet{0}'.format(subnet_index),
+                        'size': 24, 'vlan': subnet_index, 'hosts': hosts})
+    return {'zone': 'bench', 'network': '10.0.0.0/8', 'vrf': 'bench',
+            'subnets': subnets}
+
+
+def bench(validate, data, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        validate(data)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--hosts', '-H', type=int, default=100000,
+                        help='number of hosts (default: 100000)')
+    parser.add_argument('--repeat', '-r', type=int, default=3)
+    args = parser.parse_args()
+
+    data = make_topology(args.hosts)
+    schema = bench(NetworkGenerator.topology_schema, data, args.repeat)
+    validator = bench(NetworkGenerator.topology_validator, data, args.repeat)
+    print('voluptuous schema: {0:.3f}s'.format(schema))
+    print('fast validator:    {0:.3f}s ({1:.1f}x)'
+          .format(validator, schema / validator))
+
+
+if __name__ == '__main__':
+    main()
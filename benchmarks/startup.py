@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+"""
+Times the startup of the netgen command line
+
+Each command is run in a new interpreter, the time of an empty
+interpreter is subtracted. The exit status is 1 when the median
+startup time of a command exceeds the budget, or when it imports
+one of the heavy modules it should not need.
+"""
+from __future__ import print_function, division
+import argparse
+import json
+import subprocess
+import sys
+import time
+
+clock = getattr(time, 'perf_counter', time.time)
+
+HEAVY_MODULES = ('pkg_resources', 'jinja2', 'yaml', 'voluptuous', 'colors',
+                 'netgen.engine')
+
+# code run by each measure, printing the heavy modules imported
+RUNNER = """\
+import json
+import sys
+sys.argv = {argv!r}
+from {module} import {function}
+try:
+    {function}()
+except SystemExit:
+    pass
+sys.stdout = sys.__stdout__
+print(json.dumps(sorted(set({heavy!r}) & set(sys.modules))))
+"""
+
+COMMANDS = (
+    ('netgen --help', 'netgen.__main__', 'main', ['--help']),
+    ('netgen (argument error)', 'netgen.__main__', 'main', ['--bad']),
+)
+
+
+def run(code):
+    start = clock()
+    output = subprocess.check_output([sys.executable, '-c', code],
+                                     stderr=subprocess.STDOUT)
+    return clock() - start, output
+
+
+def measure(code, repeat):
+    """
+    returns:
+        the median time and the output of the last run
+    """
+    times = []
+    for _ in range(repeat):
+        elapsed, output = run(code)
+        times.append(elapsed)
+    times.sort()
+    return times[len(times) // 2], output
+
+
+def runner_code(module, function, arguments):
+    return RUNNER.format(argv=['netgen'] + arguments, module=module,
+                         function=function, heavy=HEAVY_MODULES)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--repeat', '-r', type=int, default=10,
+                        help='runs of each command (default: 10)')
+    parser.add_argument('--budget', '-b', type=float, default=0.1,
+                        help=('maximum startup time in seconds, on top of'
+                              ' the interpreter startup (default: 0.1)'))
+    args = parser.parse_args()
+
+    interpreter, _ = measure('pass', args.repeat)
+    print('{0:<28} {1:>8.4f}s'.format('python', interpreter))
+    failures = []
+    for name, module, function, arguments in COMMANDS:
+        elapsed, output = measure(runner_code(module, function, arguments),
+                                  args.repeat)
+        elapsed -= interpreter
+        heavy = json.loads(output.decode('utf-8').splitlines()[-1])
+        flag = ''
+        if elapsed > args.budget:
+            flag = '  OVER BUDGET'
+        if heavy:
+            flag += '  imports {0}'.format(', '.join(heavy))
+        if flag:
+            failures.append(name)
+        print('{0:<28} {1:>+8.4f}s{2}'.format(name, elapsed, flag))
+    if failures:
+        sys.exit('{0} command(s) failed: {1}'
+                 .format(len(failures), ', '.join(failures)))
+
+
+if __name__ == '__main__':
+    main()
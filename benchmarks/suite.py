@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+"""
+Times each stage of the netgen pipeline on a synthetic data directory
+
+Results are saved as json with --output. When a baseline saved by
+a previous run is given with --baseline, stages slower than the
+baseline by more than the threshold are reported as regressions and
+the exit status is 1.
+"""
+from __future__ import print_function, division
+import argparse
+import json
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+import yaml
+from jinja2 import FileSystemLoader
+from six import StringIO
+
+from netgen.__main__ import data_paths, load_zones, select_networks
+from netgen.engine import (Topology, IPv4NetworkGenerator,
+                           IPv6NetworkGenerator, NetworkGenerator,
+                           YAMLLoader, templates_dir)
+from netgen.stats import Analyzer
+
+import synthetic
+
+RESULTS_VERSION = 1
+
+clock = getattr(time, 'perf_counter', time.time)
+
+OUTPUT_TEMPLATES = ('netgen', 'netgen-color', 'table', 'json', 'yaml', 'csv',
+                    'hosts', 'bind-forward', 'bind-reverse')
+
+NATIVE_TEMPLATES = ('json', 'yaml', 'csv', 'hosts')
+
+
+class IPv4Allocator(IPv4NetworkGenerator):
+    """
+    Generator skipping validation, to time the allocation alone
+    """
+
+    def validate(self, data):
+        return data
+
+
+class IPv6Allocator(IPv6NetworkGenerator):
+
+    def validate(self, data):
+        return data
+
+
+Allocators = {4: IPv4Allocator, 6: IPv6Allocator}
+
+
+class Timer(object):
+    """
+    Accumulates the best time of each stage over the networks
+    """
+
+    def __init__(self, repeat):
+        self.repeat = repeat
+        self.stages = {}
+
+    def run(self, stage, function, *args, **kwargs):
+        """
+        Runs function repeat times and records the best time
+
+        returns:
+            the result of the last run
+        """
+        best = None
+        for _ in range(self.repeat):
+            start = clock()
+            result = function(*args, **kwargs)
+            elapsed = clock() - start
+            best = elapsed if best is None else min(best, elapsed)
+        self.stages[stage] = self.stages.get(stage, 0.0) + best
+        return result
+
+
+def render(topology):
+    topology._rendered = None
+    return topology.rendered
+
+
+def parse(topology):
+    topology._data = None
+    return topology.data
+
+
+def stream(ngen, template, loader, native):
+    output = StringIO()
+    ngen.stream(template, loader, output, native=native)
+    return output.getvalue()
+
+
+def analyze(ipversion, data):
+    stdout = sys.stdout
+    sys.stdout = StringIO()
+    try:
+        Analyzer(ipversion, verbose=True).analyze(data)
+    finally:
+        sys.stdout = stdout
+
+
+def bench_network(timer, unit, topo_loader, output_loader):
+    zone, subzone, network, ipversion = unit
+    topology = Topology(zone, subzone['vrf'], network, subzone['topology'],
+                        loader=topo_loader, params=subzone.get('params', {}))
+    timer.run('topology.rendered', render, topology)
+    data = timer.run('topology.data', parse, topology)
+    timer.run('topology_schema', NetworkGenerator.topology_schema, data)
+    data = timer.run('topology_validator',
+                     NetworkGenerator.topology_validator, data)
+    ngen = timer.run('allocation', Allocators[ipversion], data)
+    outputs = {}
+    for template in OUTPUT_TEMPLATES:
+        outputs[template] = timer.run('stream.{0}'.format(template), stream,
+                                      ngen, template, output_loader, False)
+        if template in NATIVE_TEMPLATES:
+            timer.run('stream.{0}.native'.format(template), stream,
+                      ngen, template, output_loader, True)
+    timer.run('stats.Analyzer', analyze, ipversion,
+              yaml.load(outputs['yaml'], Loader=YAMLLoader))
+
+
+def run_suite(data_dir, repeat):
+    zones_file, topology_dir, output_dirs = data_paths(data_dir)
+    zones = load_zones(zones_file)
+    args = argparse.Namespace(zone=sorted(zones), vrf=None, network=None,
+                              in_network=None, topology=None,
+                              match_topology=None, ipv4=False, ipv6=False)
+    topo_loader = FileSystemLoader(topology_dir)
+    output_loader = FileSystemLoader(templates_dir)
+    timer = Timer(repeat)
+    for unit in select_networks(args, zones):
+        bench_network(timer, unit, topo_loader, output_loader)
+    return timer.stages
+
+
+def compare(stages, baseline, threshold, min_delta):
+    """
+    Prints the stages compared with a baseline
+
+    returns:
+        the list of regressed stages
+    """
+    regressions = []
+    print('{0:<28} {1:>10} {2:>10} {3:>8}'
+          .format('stage', 'baseline', 'current', 'ratio'))
+    for stage in sorted(stages):
+        current = stages[stage]
+        previous = baseline.get(stage)
+        if previous is None:
+            print('{0:<28} {1:>10} {2:>10.4f}'.format(stage, '-', current))
+            continue
+        ratio = current / previous if previous else float('inf')
+        flag = ''
+        if ratio > 1 + threshold and current - previous > min_delta:
+            flag = '  REGRESSION'
+            regressions.append(stage)
+        print('{0:<28} {1:>10.4f} {2:>10.4f} {3:>7.2f}x{4}'
+              .format(stage, previous, current, ratio, flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--data', '-d', metavar='DIR', default=None,
+                        help=('benchmark this data directory instead of'
+                              ' a synthetic one'))
+    synthetic.add_arguments(parser)
+    parser.add_argument('--repeat', '-r', type=int, default=3,
+                        help='runs of each stage, the best is kept'
+                             ' (default: 3)')
+    parser.add_argument('--output', '-o', metavar='FILE', default=None,
+                        help='save the results to this json file')
+    parser.add_argument('--baseline', '-b', metavar='FILE', default=None,
+                        help='compare with the results saved in this file')
+    parser.add_argument('--threshold', '-t', type=float, default=0.25,
+                        help=('relative slowdown reported as a regression'
+                              ' (default: 0.25)'))
+    parser.add_argument('--min-delta', type=float, default=0.005,
+                        help=('ignore slowdowns below this many seconds'
+                              ' (default: 0.005)'))
+    args = parser.parse_args()
+
+    meta = {'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'repeat': args.repeat}
+    directory = None
+    try:
+        if args.data is None:
+            directory = tempfile.mkdtemp(prefix='netgen-bench-')
+            synthetic.write_data_dir(directory, args.zones, args.supernets,
+                                     args.subnets, args.hosts,
+                                     synthetic.ipversions(args))
+            meta.update(zones=args.zones, supernets=args.supernets,
+                        subnets=args.subnets, hosts=args.hosts,
+                        ipversions=list(synthetic.ipversions(args)))
+            data_dir = directory
+        else:
+            data_dir = meta['data'] = args.data
+        stages = run_suite(data_dir, args.repeat)
+    finally:
+        if directory is not None:
+            shutil.rmtree(directory)
+
+    results = {'version': RESULTS_VERSION, 'meta': meta, 'stages': stages}
+    if args.output is not None:
+        with open(args.output, 'w') as output_fd:
+            json.dump(results, output_fd, indent=2, sort_keys=True)
+            output_fd.write('\n')
+
+    if args.baseline is None:
+        for stage in sorted(stages):
+            print('{0:<28} {1:>10.4f}s'.format(stage, stages[stage]))
+        return
+
+    with open(args.baseline) as baseline_fd:
+        baseline = json.load(baseline_fd)
+    if baseline.get('meta') != meta:
+        print('warning: baseline was run with different parameters',
+              file=sys.stderr)
+    regressions = compare(stages, baseline['stages'], args.threshold,
+                          args.min_delta)
+    if regressions:
+        sys.exit('{0} stage(s) regressed: {1}'
+                 .format(len(regressions), ', '.join(regressions)))
+
+
+if __name__ == '__main__':
+    main()
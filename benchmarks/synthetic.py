@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+"""
+Writes a synthetic data directory for benchmarks
+
+The directory has N zones of M supernets each, every supernet being
+divided by the topology template in K subnets of H hosts. Zones get
+IPv4 supernets, IPv6 supernets or both.
+"""
+from __future__ import print_function, division
+import argparse
+import os
+
+from ipaddress import IPv4Network, IPv6Network
+
+TOPOLOGY = """\
+{% set subnet_count = params.subnet_count %}
+{% set host_count = params.host_count %}
+zone: '{{ zone }}'
+network: '{{ network }}'
+vrf: '{{ vrf }}'
+subnets:
+{% for subnet_i in range(subnet_count) %}
+  - name: '{{ zone }}-subnet{{ subnet_i }}'
+    size: {{ ip46(params.prefixlen4, 64) }}
+    vlan: {{ subnet_i % 4000 + 1 }}
+    hosts:
+{% for host_i in range(host_count) %}
+      - '{{ zone }}-s{{ subnet_i }}-host{{ host_i }}'
+{% endfor %}
+{% endfor %}
+"""
+
+# pools the supernets are taken from
+POOLS = {4: IPv4Network(u'10.0.0.0/8'), 6: IPv6Network(u'2001:db8::/32')}
+
+
+def bits(count):
+    """
+    Returns the number of bits needed to number count items
+    """
+    return max(count - 1, 0).bit_length()
+
+
+def supernets(ipversion, count, prefixlen):
+    """
+    Returns count consecutive supernets of the pool
+    """
+    pool = POOLS[ipversion]
+    if bits(count) > prefixlen - pool.prefixlen:
+        raise ValueError('{0} /{1} supernets do not fit in {2}'
+                         .format(count, prefixlen, pool))
+    size = 1 << (pool.max_prefixlen - prefixlen)
+    start = int(pool.network_address)
+    return [str(pool.__class__((start + index * size, prefixlen)))
+            for index in range(count)]
+
+
+def write_data_dir(path, zones=1, supernets_per_zone=1, subnets=16,
+                   hosts=16, ipversions=(4, 6)):
+    """
+    Writes a synthetic data directory
+
+    returns:
+        the total number of (supernets, subnets, hosts)
+    """
+    prefixlen4 = 32 - bits(hosts + 2)
+    prefixlens = {4: prefixlen4 - bits(subnets), 6: 64 - bits(subnets)}
+    count = zones * supernets_per_zone
+    networks = dict((ipversion, supernets(ipversion, count,
+                                          prefixlens[ipversion]))
+                    for ipversion in ipversions)
+
+    topology_dir = os.path.join(path, 'topology')
+    if not os.path.isdir(topology_dir):
+        os.makedirs(topology_dir)
+    with open(os.path.join(topology_dir, 'synthetic.yaml'), 'w') as topo_fd:
+        topo_fd.write(TOPOLOGY)
+
+    with open(os.path.join(path, 'zones.yaml'), 'w') as zones_fd:
+        for zone_index in range(zones):
+            zones_fd.write('zone{0}:\n'.format(zone_index))
+            for ipversion in ipversions:
+                for index in range(supernets_per_zone):
+                    network = networks[ipversion][zone_index *
+                                                  supernets_per_zone + index]
+                    zones_fd.write(
+                        '  - network: \'{0}\'\n'
+                        '    topology: synthetic\n'
+                        '    vrf: vrf{1}\n'
+                        '    params: {{subnet_count: {2}, host_count: {3},'
+                        ' prefixlen4: {4}}}\n'
+                        .format(network, zone_index % 4, subnets, hosts,
+                                prefixlen4))
+
+    total = count * len(ipversions)
+    return total, total * subnets, total * subnets * hosts
+
+
+def add_arguments(parser):
+    parser.add_argument('--zones', '-N', type=int, default=2,
+                        help='number of zones (default: 2)')
+    parser.add_argument('--supernets', '-M', type=int, default=2,
+                        help='supernets per zone and ip version (default: 2)')
+    parser.add_argument('--subnets', '-K', type=int, default=64,
+                        help='subnets per supernet (default: 64)')
+    parser.add_argument('--hosts', '-H', type=int, default=100,
+                        help='hosts per subnet (default: 100)')
+    ipv_group = parser.add_mutually_exclusive_group()
+    ipv_group.add_argument('--ipv4', '-4', action='store_true', default=False,
+                           help='only generate ipv4 supernets')
+    ipv_group.add_argument('--ipv6', '-6', action='store_true', default=False,
+                           help='only generate ipv6 supernets')
+
+
+def ipversions(args):
+    if args.ipv4:
+        return (4,)
+    if args.ipv6:
+        return (6,)
+    return (4, 6)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('directory', help='the data directory to write')
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    totals = write_data_dir(args.directory, args.zones, args.supernets,
+                            args.subnets, args.hosts, ipversions(args))
+    print('{0}: {1} supernets, {2} subnets, {3} hosts'
+          .format(args.directory, *totals))
+
+
+if __name__ == '__main__':
+    main()
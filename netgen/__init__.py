@@ -1,2 +1,50 @@
-from .engine import *
-from .exception import *
+import sys
+
+# listed here so that "from netgen import *" does not need the engine
+# to know what it exports
+__all__ = [
+    # exception
+    'NetworkFull', 'ConfigError', 'UnalignedSubnet',
+    # engine
+    'set_template_cache', 'get_environment', 'is_bundled', 'default_loader',
+    'parse_topology_network', 'load_topology', 'Topology', 'PythonTopology',
+    'host_range_name', 'Host', 'IPv4Host', 'IPv6Host', 'HostView',
+    'HostTable', 'Subnet', 'IPv4Subnet', 'IPv6Subnet', 'Zone', 'IPv4Zone',
+    'IPv6Zone', 'NetworkGenerator', 'IPv4NetworkGenerator',
+    'IPv6NetworkGenerator',
+]
+
+if sys.version_info < (3, 7):
+    from .engine import *
+    from .exception import *
+else:
+    import importlib
+    import os
+
+    # the engine is imported on first access to one of its names, so that
+    # importing a submodule such as netgen.__main__ stays cheap
+
+    def _exporting_modules():
+        return [importlib.import_module('.exception', __name__),
+                importlib.import_module('.engine', __name__)]
+
+    def __getattr__(name):
+        # submodules are looked up here by "from netgen import ..."
+        # before being imported
+        if name.startswith('_') or os.path.isfile(
+                os.path.join(os.path.dirname(__file__), name + '.py')):
+            raise AttributeError(name)
+        for module in _exporting_modules():
+            if hasattr(module, name):
+                value = getattr(module, name)
+                globals()[name] = value
+                return value
+        raise AttributeError("module 'netgen' has no attribute '{0}'"
+                             .format(name))
+
+    def __dir__():
+        names = set(globals())
+        for module in _exporting_modules():
+            names.update(name for name in dir(module)
+                         if not name.startswith('_'))
+        return sorted(names)
@@ -1,26 +1,24 @@
 #!/usr/bin/env python
 from __future__ import print_function
 import argparse
+import hashlib
+import importlib
 import json
 import os
 import re
 import sys
 import traceback
-import yaml
-from six import u
-from voluptuous import Schema, MultipleInvalid, Optional, Required, Extra, Any
+from six import u, StringIO
 from ipaddress import IPv4Network, IPv6Network
-from jinja2 import FileSystemLoader
-from jinja2.exceptions import (TemplateNotFound, TemplateSyntaxError,
-                               TemplateRuntimeError)
-from pkg_resources import resource_filename
-try:
-    from yaml import CSafeLoader as YAMLLoader, CSafeDumper as YAMLDumper
-except ImportError:
-    from yaml import SafeLoader as YAMLLoader, SafeDumper as YAMLDumper
-
-from .engine import IPv4NetworkGenerator, IPv6NetworkGenerator, Topology
-from .exception import NetworkFull, ConfigError, UnalignedSubnet
+
+from . import timing
+
+# jinja2, yaml, voluptuous and the engine are imported by the functions
+# using them, so that --help, argument errors and the subcommands don't
+# pay for them
+
+templates_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'templates')
 
 def flatten(l):
     return [itm for y in l for itm in [y if type(y) in (list, tuple) else [y]]]
@@ -60,10 +58,19 @@ def regular_expression(pattern):
     except:
         raise ValueError(pattern)
 
-def parse_arguments(arguments):
+def output_spec(spec):
+    """
+    Parses a TEMPLATE[:FILE] output
 
-    default_template = 'netgen-color' if sys.stdout.isatty() else 'netgen'
+    returns:
+        a (template, path) tuple, path being None for stdout
+    """
+    template, separator, path = spec.partition(':')
+    if not template or (separator and not path):
+        raise ValueError(spec)
+    return (template, path or None)
 
+def argument_parser():
     parser = argparse.ArgumentParser(description='generate ip address plan')
     parser.add_argument('--data', '-d', metavar='DIR', type=str,
                         help='the data directory (default: .)')
@@ -72,9 +79,31 @@ def parse_arguments(arguments):
                         required=True, help='name of the zone to generate')
     parser.add_argument('--without-hosts', '-H', action='store_true',
                         default=False, help='hide hosts')
-    parser.add_argument('--output-template', '-o', metavar='TEMPLATE',
-                        type=str, default=default_template,
-                        help='output template to use for rendering')
+    parser.add_argument('--output-template', '-o',
+                        metavar='TEMPLATE[:FILE]', dest='outputs',
+                        type=output_spec, action='append', default=None,
+                        help=('output template to use for rendering, written'
+                              ' to FILE instead of stdout if given; can be'
+                              ' repeated to render several outputs from'
+                              ' a single allocation'))
+    parser.add_argument('--compact', action='store_true', default=False,
+                        help='use compact host storage (lower memory usage)')
+    parser.add_argument('--streaming', action='store_true', default=False,
+                        help=('parse topologies incrementally'
+                              ' (lower memory usage)'))
+    parser.add_argument('--strict-schema', action='store_true', default=False,
+                        help=('validate topologies with the voluptuous schema'
+                              ' instead of the fast validator'))
+    parser.add_argument('--jinja-output', action='store_true', default=False,
+                        help=('render json, yaml, csv and hosts outputs with'
+                              ' their jinja templates'))
+    parser.add_argument('--stats', action='store_true', default=False,
+                        help=('print the address space usage'
+                              ' instead of regular output'))
+    parser.add_argument('--write-plan', metavar='FILE', type=str,
+                        default=None,
+                        help=('write the allocated networks to this binary'
+                              ' plan file instead of regular output'))
     parser.add_argument('--dump-topology', action='store_true', default=False,
                         help=('dump the intermediate topology'
                               ' instead of regular output'))
@@ -82,14 +111,41 @@ def parse_arguments(arguments):
                         help='don\'t catch exceptions')
     parser.add_argument('--with-param', '-p', action='append', nargs=2,
                         default=[], help='override network params')
+    parser.add_argument('--result-cache', metavar='DIR', type=str,
+                        default=os.environ.get('NETGEN_RESULT_CACHE'),
+                        help=('reuse the output of unchanged networks'
+                              ' from this directory'))
+    parser.add_argument('--result-cache-size', metavar='MB', type=int,
+                        default=512,
+                        help='maximum size of the result cache (default: 512)')
+    parser.add_argument('--zones-cache', metavar='DIR', type=str,
+                        default=os.environ.get('NETGEN_ZONES_CACHE'),
+                        help=('store the parsed zone file in this directory'
+                              ' (default: $XDG_CACHE_HOME/netgen or'
+                              ' ~/.cache/netgen)'))
+    parser.add_argument('--no-zones-cache', action='store_true',
+                        default=False,
+                        help='always parse the zone file')
+    parser.add_argument('--jobs', '-j', metavar='N', type=int, default=1,
+                        help=('generate networks using N processes'
+                              ' (0: one per cpu, default: 1)'))
+    parser.add_argument('--template-cache', metavar='DIR', type=str,
+                        default=os.environ.get('NETGEN_TEMPLATE_CACHE'),
+                        help='store compiled templates in this directory')
+    parser.add_argument('--profile', action='store_true', default=False,
+                        help=('print the time spent in each stage'
+                              ' to stderr'))
+    parser.add_argument('--profile-output', metavar='FILE', type=str,
+                        default=None,
+                        help='write the stage timings to this json file')
 
     filters = parser.add_argument_group('filters')
 
     filters.add_argument('--vrf', '-v',  metavar='VRF', type=str, default=None,
                         action='append',
                         help='only output zones in this vrf (default: all)')
-    filters.add_argument('--network', '-n',  metavar='NETWORK', type=str,
-                        default=None, action='append',
+    filters.add_argument('--network', '-n',  metavar='NETWORK',
+                        default=None, action='append', type=auto_convert_network,
                         help='only output network using this address (default: all)')
     filters.add_argument('--in-network', '-N',  metavar='NETWORK',
                         default=None, action='append', type=auto_convert_network,
@@ -108,8 +164,38 @@ def parse_arguments(arguments):
     ipv_group.add_argument('--ipv6', '-6', action='store_true', default=False,
                            help='only output ipv6 entries')
 
+    return parser
+
+def parse_arguments(arguments):
+
+    default_template = 'netgen-color' if sys.stdout.isatty() else 'netgen'
+
+    parser = argument_parser()
     args = parser.parse_args(arguments)
 
+    if args.jobs < 0:
+        parser.error('argument --jobs/-j: must be positive')
+
+    if args.write_plan is not None and (args.stats or args.dump_topology):
+        parser.error('argument --write-plan: not allowed with --stats'
+                     ' or --dump-topology')
+
+    if args.outputs is None:
+        args.outputs = [(default_template, None)]
+    if len([path for template, path in args.outputs if path is None]) > 1:
+        parser.error('argument --output-template/-o: only one output can be'
+                     ' written to stdout')
+    paths = [path for template, path in args.outputs if path is not None]
+    if len(set(os.path.abspath(path) for path in paths)) != len(paths):
+        parser.error('argument --output-template/-o: duplicate output file')
+    if paths and (args.stats or args.dump_topology or
+                  args.write_plan is not None):
+        parser.error('argument --output-template/-o: output files not allowed'
+                     ' with --stats, --write-plan or --dump-topology')
+
+    if args.profile_output is not None:
+        args.profile = True
+
     params = {}
     for key, value in args.with_param:
         params.update({key: auto_convert_value(value)})
@@ -117,26 +203,82 @@ def parse_arguments(arguments):
 
     return args
 
+# Subcommands, dispatched on the first argument
+commands = {
+    'capacity': 'capacity',
+    'diff': 'diff',
+    'lookup': 'index',
+    'serve': 'server',
+}
+
 def main(arguments=None):
 
+    if arguments is None:
+        arguments = sys.argv[1:]
+    if arguments and arguments[0] in commands:
+        module = importlib.import_module('netgen.{0}'
+                                         .format(commands[arguments[0]]))
+        return module.main(arguments[1:])
+
     args = parse_arguments(arguments)
 
-    schema = Schema({
-        str: [{
-            Required('vrf'): str,
-            Required('topology'): str,
-            Required('network'): Any([lambda x: str(auto_convert_network(x))],
-                                     lambda x: str(auto_convert_network(x))),
-            Optional('params'): {Extra: object},
-        }]
-    })
+    data_dir = data_directory(args)
+    zones_file, topology_dir, output_dirs = data_paths(data_dir)
+    zones = load_zones(zones_file, debug=args.debug,
+                       cache_file=zones_cache_file(args, data_dir))
+
+    if args.template_cache is not None:
+        try:
+            if not os.path.isdir(args.template_cache):
+                os.makedirs(args.template_cache)
+        except OSError as exception:
+            sys.exit('io error: {0}'.format(exception))
+        from .engine import set_template_cache
+        set_template_cache(args.template_cache)
+
+    try:
+        cache = open_cache(args)
+    except OSError as exception:
+        sys.exit('io error: {0}'.format(exception))
 
-    # Check for required files and directories
+    generate(args, zones, topology_dir, output_dirs, sys.stdout, cache=cache)
 
+    if cache is not None:
+        cache.evict()
+
+
+def data_directory(args):
     if args.data is not None:
-        data_dir = args.data
-    else:
-        data_dir = os.environ.get('NETGEN_DATA_DIR', '.')
+        return args.data
+    return os.environ.get('NETGEN_DATA_DIR', '.')
+
+
+def zones_cache_file(args, data_dir):
+    """
+    Returns the path of the zones cache, or None if disabled
+
+    The cache is kept in a user cache directory, named after the data
+    directory, so that the data directory is not written to
+    """
+    if args.no_zones_cache:
+        return None
+    directory = args.zones_cache
+    if directory is None:
+        directory = os.path.join(
+            os.environ.get('XDG_CACHE_HOME') or
+            os.path.join(os.path.expanduser('~'), '.cache'), 'netgen')
+    name = hashlib.sha256(os.path.abspath(data_dir).encode('utf-8'))
+    return os.path.join(directory,
+                        'zones-{0}.cache'.format(name.hexdigest()[:16]))
+
+
+def data_paths(data_dir):
+    """
+    Checks for required files and directories
+
+    returns:
+        a (zones file, topology directory, output directories) tuple
+    """
     zones_file = '{0}/zones.yaml'.format(data_dir)
     topology_dir = '{0}/topology'.format(data_dir)
 
@@ -144,7 +286,7 @@ def main(arguments=None):
     local_output_dir = '{0}/output'.format(data_dir)
     if os.path.isdir(local_output_dir):
         output_dirs.append(local_output_dir)
-    output_dirs.append(resource_filename(__name__, 'templates'))
+    output_dirs.append(templates_dir)
 
     if not os.path.isfile(zones_file):
         sys.exit('file not found: {0}'.format(zones_file))
@@ -153,112 +295,462 @@ def main(arguments=None):
         if not os.path.isdir(directory):
             sys.exit('directory not found: {0}'.format(directory))
 
-    # Parsing Zone file
+    return zones_file, topology_dir, output_dirs
+
+
+def load_zones(zones_file, debug=False, cache_file=None):
+    """
+    Parses the zone file
+
+    args:
+        cache_file: keep the validated zones in this file,
+                    and reuse them while the zone file is unchanged
+    """
+    import yaml
+    from voluptuous import (Schema, MultipleInvalid, Optional, Required,
+                            Extra, Any)
+    from .cache import ParsedFileCache
+    from .engine import YAMLLoader
+
+    schema = Schema({
+        str: [{
+            Required('vrf'): str,
+            Required('topology'): str,
+            Required('network'): Any([lambda x: str(auto_convert_network(x))],
+                                     lambda x: str(auto_convert_network(x))),
+            Optional('params'): {Extra: object},
+        }]
+    })
+
+    def parse(data):
+        return schema(yaml.load(data, Loader=YAMLLoader))
 
     try:
-        with open(zones_file, 'r') as zones_fd:
-            zones = schema(yaml.load(zones_fd, Loader=YAMLLoader))
+        if cache_file is not None:
+            return ParsedFileCache(cache_file).load(zones_file, parse)
+        with open(zones_file, 'rb') as zones_fd:
+            return parse(zones_fd.read())
     except MultipleInvalid as exception:
-        if args.debug:
+        if debug:
             raise
         sys.exit('error parsing zone file: {0}'.format(exception))
     except Exception as exception:
-        if args.debug:
+        if debug:
             raise
         sys.exit('error: {0}'.format(exception))
 
-    for zone in args.zone:
-        if zone not in zones:
-            sys.exit('zone "{0}" does not exists'.format(zone))
-
-    topo_loader = FileSystemLoader(topology_dir)
-    output_loader = FileSystemLoader(output_dirs)
-
-    for zone in args.zone:
-        for subzone in zones[zone]:
-            for network in xflatten([subzone['network']]):
-                # only output networks in the specified vrf
-                if args.vrf and subzone['vrf'] not in args.vrf:
-                    continue
 
-                # check if exactly matching the network address
-                if args.network and network not in args.network:
+class OutputFiles(object):
+    """
+    Destinations of the outputs, in the order of args.outputs
+
+    The output without a path goes to output_file. The others are written
+    to temporary files, renamed to their path by commit(), so that a failed
+    run leaves the existing files untouched.
+    """
+
+    def __init__(self, outputs, output_file):
+        self.files = []
+        # files opened for the outputs with a path
+        self.opened = []
+        # (temporary path, path)
+        self.paths = []
+        try:
+            for template, path in outputs:
+                if path is None:
+                    self.files.append(output_file)
                     continue
+                directory, name = os.path.split(os.path.abspath(path))
+                temporary = os.path.join(directory, '.{0}.netgen-{1}'
+                                         .format(name, os.getpid()))
+                self.opened.append(open(temporary, 'w'))
+                self.paths.append((temporary, path))
+                self.files.append(self.opened[-1])
+        except (IOError, OSError):
+            self.discard()
+            raise
 
-                # continue if not a subnet of a selected network
-                if args.in_network:
-                    subzone_network = auto_convert_network(network)
-                    for wanted_network in args.in_network:
-                        if (type(wanted_network) == type(subzone_network)
-                            and subzone_network.subnet_of(wanted_network)):
-                            break
-                    else:
-                        continue
-
-                # only output networks using this topology
-                if args.topology and subzone['topology'] not in args.topology:
-                    continue
+    def close(self):
+        for output_file in self.opened:
+            output_file.close()
+
+    def commit(self):
+        from .cache import replace
+        self.close()
+        for temporary, path in self.paths:
+            replace(temporary, path)
+
+    def discard(self):
+        self.close()
+        for temporary, path in self.paths:
+            try:
+                os.remove(temporary)
+            except OSError:
+                pass
+
+
+def generate(args, zones, topology_dir, output_dirs, output_file,
+             cache=None, loaders=None):
+    """
+    Generates the selected networks
+
+    args:
+        loaders: optional (topology, output) loaders to reuse,
+                 only used when generating in this process
+    """
+    for zone in args.zone:
+        if zone not in zones:
+            sys.exit('zone "{0}" does not exists'.format(zone))
 
-                # continue if topology does not match patterns
-                if args.match_topology:
-                    for regexp in args.match_topology:
-                        if regexp.search(subzone['topology']):
-                            break
-                    else:
-                        continue
-
-                # only output networks of the requested IP version
-                topology_ip_version = auto_convert_network(network).version
-                if ((args.ipv4 is True and topology_ip_version != 4) or
-                    (args.ipv6 is True and topology_ip_version != 6)):
-                        continue
-
-                # Get the Right class for network generation
-                if topology_ip_version == 4:
-                    NetworkGenerator = IPv4NetworkGenerator
-                elif topology_ip_version == 6:
-                    NetworkGenerator = IPv6NetworkGenerator
-                else:
-                    raise AssertionError
-
-                params = subzone.get('params', {}).copy()
-                params.update(args.params)
-
-                try:
-                    topology = Topology(zone, subzone['vrf'],
-                                        network, subzone['topology'],
-                                        loader=topo_loader,
-                                        params=params)
-
-                    if args.dump_topology is True:
-                        print('# topology: {0}\n'.format(subzone['topology']))
-                        print(topology)
-                        continue
-
-                    ngen = NetworkGenerator(topology,
-                                            with_hosts=not args.without_hosts)
-
-                    ngen.stream(args.output_template,
-                                output_loader, sys.stdout,
-                                params=params)
-
-                except MultipleInvalid as exception:
-                    sys.exit('error parsing topology: {0}'.format(exception))
-                except TemplateNotFound as exception:
-                    sys.exit('template not found: {0}'.format(exception))
-                except (TemplateRuntimeError, TemplateSyntaxError) as exception:
-                    st = traceback.format_exc().splitlines()[-5:]
-                    sys.exit('error in template:\n{0}'.format('\n'.join(st)))
-                except NetworkFull as exception:
-                    sys.exit('network full: {0}'.format(exception))
-                except ConfigError as exception:
-                    sys.exit('config error: {0}'.format(exception))
-                except UnalignedSubnet as exception:
-                    sys.exit('unaligned subnet: {0}'.format(exception))
-                except IOError as exception:
-                    sys.exit('io error: {0}'.format(exception))
-                except KeyboardInterrupt:
-                    sys.exit(1)
+    units = list(select_networks(args, zones))
+
+    outputs = None
+    analyzer = None
+    plan = None
+    if args.stats:
+        from .stats import Analyzer, StatsCollector
+        analyzer = Analyzer(output_file=output_file)
+        output_files = [StatsCollector(analyzer)]
+    elif args.write_plan is not None:
+        from .plan import PlanCollector, PlanWriter
+        plan = PlanWriter()
+        output_files = [PlanCollector(plan)]
+    else:
+        try:
+            outputs = OutputFiles(args.outputs, output_file)
+        except (IOError, OSError) as exception:
+            sys.exit('io error: {0}'.format(exception))
+        output_files = outputs.files
+
+    profiler = None
+    if args.profile:
+        profiler = timing.Profiler()
+        timing.register(profiler)
+    try:
+        generate_units(args, units, topology_dir, output_dirs, output_files,
+                       cache=cache, loaders=loaders, profiler=profiler)
+    except BaseException:
+        if outputs is not None:
+            outputs.discard()
+        raise
+    finally:
+        if profiler is not None:
+            timing.unregister(profiler)
+            report_profile(args, profiler)
+
+    if outputs is not None:
+        try:
+            outputs.commit()
+        except (IOError, OSError) as exception:
+            outputs.discard()
+            sys.exit('io error: {0}'.format(exception))
+
+    if analyzer is not None:
+        analyzer.report()
+
+    if plan is not None:
+        try:
+            plan.save(args.write_plan)
+        except (IOError, OSError) as exception:
+            sys.exit('io error: {0}'.format(exception))
+
+
+def generate_units(args, units, topology_dir, output_dirs, output_files,
+                   cache=None, loaders=None, profiler=None):
+    """
+    Generates the networks, writing each output to its file in
+    output_files
+    """
+    from jinja2 import FileSystemLoader
+    if args.jobs == 1:
+        if loaders is not None:
+            topo_loader, output_loader = loaders
+        else:
+            topo_loader = FileSystemLoader(topology_dir)
+            output_loader = FileSystemLoader(output_dirs)
+        for unit in units:
+            if profiler is not None:
+                profiler.begin(*unit_key(unit))
+            try:
+                generate_network(args, topo_loader, output_loader,
+                                 unit, output_files, cache=cache)
+            except KeyboardInterrupt:
+                sys.exit(1)
+            except Exception as exception:
+                message = error_message(exception)
+                if message is None:
+                    raise
+                sys.exit(message)
+            finally:
+                if profiler is not None:
+                    profiler.end()
+        return
+
+    import multiprocessing
+    pool = multiprocessing.Pool(args.jobs or None,
+                                initializer=init_worker,
+                                initargs=(args, topology_dir, output_dirs))
+    try:
+        for unit, (outputs, message, timings) in zip(
+                units, pool.imap(run_worker, units)):
+            for output_file, output in zip(output_files, outputs):
+                output_file.write(output)
+            if profiler is not None:
+                profiler.merge(unit_key(unit), timings)
+            if message is not None:
+                sys.exit(message)
+    except KeyboardInterrupt:
+        sys.exit(1)
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def unit_key(unit):
+    """
+    Returns the (zone, network, topology) of a network, for profiling
+    """
+    zone, subzone, network, topology_ip_version = unit
+    return (zone, network, subzone['topology'])
+
+
+def report_profile(args, profiler):
+    profiler.report(sys.stderr)
+    if args.profile_output is not None:
+        try:
+            with open(args.profile_output, 'w') as profile_fd:
+                profiler.dump(profile_fd)
+        except IOError as exception:
+            print('io error: {0}'.format(exception), file=sys.stderr)
+
+
+def open_cache(args):
+    if args.result_cache is None:
+        return None
+    from .cache import ResultCache
+    return ResultCache(args.result_cache,
+                       max_size=args.result_cache_size * 2 ** 20)
+
+
+def select_networks(args, zones):
+    """
+    Applies the command-line filters to the zones
+
+    returns:
+        a generator of (zone, subzone, network, ipversion) tuples,
+        in output order
+    """
+    from .filters import NetworkFilter
+    return NetworkFilter.from_arguments(args).select(zones, args.zone)
+
+
+def generate_network(args, topo_loader, output_loader, unit, output_files,
+                     cache=None):
+    """
+    Streams the outputs of a network, from the result cache if possible
+
+    The network is allocated once if any of its outputs is not cached
+    """
+    if cache is not None:
+        keys = [result_key(args, topo_loader, output_loader, unit, template)
+                for template, path in args.outputs]
+        if None not in keys:
+            results = [cache.get(key) for key in keys]
+            if None in results:
+                buffers = [StringIO() for key in keys]
+                render_network(args, topo_loader, output_loader, unit,
+                               buffers)
+                results = [buffer.getvalue() for buffer in buffers]
+                for key, result in zip(keys, results):
+                    cache.put(key, result)
+            for output_file, result in zip(output_files, results):
+                output_file.write(result)
+            return
+    render_network(args, topo_loader, output_loader, unit, output_files)
+
+
+def network_params(args, subzone):
+    params = subzone.get('params', {}).copy()
+    params.update(args.params)
+    return params
+
+
+def result_key(args, topo_loader, output_loader, unit, template):
+    """
+    Computes the result cache key of an output of a network
+
+    returns:
+        the key, or None if the network output can't be cached
+    """
+    from .cache import (ResultCache, code_digest, template_digest,
+                        topology_digest)
+    from .engine import get_environment
+    zone, subzone, network, topology_ip_version = unit
+    env = get_environment('topology', topo_loader, topology_ip_version)
+    topo_digest = topology_digest(env, subzone['topology'])
+    if topo_digest is None:
+        return None
+    output_digest = None
+    if (not args.dump_topology and not args.stats and
+            args.write_plan is None):
+        env = get_environment('output', output_loader, topology_ip_version)
+        output_digest = template_digest(
+            env, '{0}.tpl'.format(template))
+        if output_digest is None:
+            return None
+    return ResultCache.key(code_digest(), zone, subzone['vrf'], network,
+                           topology_ip_version, subzone['topology'],
+                           topo_digest, template,
+                           output_digest, network_params(args, subzone),
+                           not args.without_hosts, args.dump_topology,
+                           not args.jinja_output, args.stats,
+                           args.write_plan is not None)
+
+
+def render_network(args, topo_loader, output_loader, unit, output_files):
+    """
+    Renders the topology of a network and streams its outputs, each to
+    its file in output_files
+    """
+    output_file = output_files[0]
+    zone, subzone, network, topology_ip_version = unit
+
+    params = network_params(args, subzone)
+
+    if args.dump_topology is True:
+        from .engine import load_topology
+        topology = load_topology(zone, subzone['vrf'],
+                                 network, subzone['topology'],
+                                 loader=topo_loader,
+                                 params=params)
+        print('# topology: {0}\n'.format(subzone['topology']),
+              file=output_file)
+        print(topology, file=output_file)
+        return
+
+    ngen = allocate_network(topo_loader, unit, params,
+                            with_hosts=not args.without_hosts,
+                            compact=args.compact,
+                            streaming=args.streaming,
+                            strict_schema=args.strict_schema,
+                            count_only=args.stats)
+
+    if args.stats:
+        from .stats import write_stats
+        write_stats(ngen.zones, topology_ip_version, output_file)
+        return
+
+    if args.write_plan is not None:
+        from .plan import write_network
+        write_network(ngen.zones, topology_ip_version, output_file)
+        return
+
+    ngen.stream_outputs([(template, output_file) for (template, path),
+                         output_file in zip(args.outputs, output_files)],
+                        output_loader, params=params,
+                        native=not args.jinja_output)
+
+
+def allocate_network(topo_loader, unit, params, **options):
+    """
+    Renders the topology of a network and allocates its subnets
+
+    args:
+        options: NetworkGenerator options
+    returns:
+        the NetworkGenerator
+    """
+    from .engine import (IPv4NetworkGenerator, IPv6NetworkGenerator,
+                         load_topology)
+    zone, subzone, network, topology_ip_version = unit
+
+    # Get the Right class for network generation
+    if topology_ip_version == 4:
+        NetworkGenerator = IPv4NetworkGenerator
+    elif topology_ip_version == 6:
+        NetworkGenerator = IPv6NetworkGenerator
+    else:
+        raise AssertionError
+
+    topology = load_topology(zone, subzone['vrf'],
+                             network, subzone['topology'],
+                             loader=topo_loader,
+                             params=params)
+
+    return NetworkGenerator(topology, **options)
+
+
+def error_message(exception):
+    """
+    Returns the error message for an exception raised by generate_network,
+    or None if the exception is unexpected
+
+    Must be called from the except block handling the exception
+    """
+    from jinja2.exceptions import (TemplateNotFound, TemplateSyntaxError,
+                                   TemplateRuntimeError)
+    from voluptuous import MultipleInvalid
+    from .exception import NetworkFull, ConfigError, UnalignedSubnet
+    if isinstance(exception, MultipleInvalid):
+        return 'error parsing topology: {0}'.format(exception)
+    if isinstance(exception, TemplateNotFound):
+        return 'template not found: {0}'.format(exception)
+    if isinstance(exception, (TemplateRuntimeError, TemplateSyntaxError)):
+        st = traceback.format_exc().splitlines()[-5:]
+        return 'error in template:\n{0}'.format('\n'.join(st))
+    if isinstance(exception, NetworkFull):
+        return 'network full: {0}'.format(exception)
+    if isinstance(exception, ConfigError):
+        return 'config error: {0}'.format(exception)
+    if isinstance(exception, UnalignedSubnet):
+        return 'unaligned subnet: {0}'.format(exception)
+    if isinstance(exception, IOError):
+        return 'io error: {0}'.format(exception)
+    return None
+
+
+# Worker processes state, used with --jobs
+
+_worker = {}
+
+def init_worker(args, topology_dir, output_dirs):
+    from jinja2 import FileSystemLoader
+    from .engine import set_template_cache
+    if args.template_cache is not None:
+        set_template_cache(args.template_cache)
+    _worker['args'] = args
+    _worker['topo_loader'] = FileSystemLoader(topology_dir)
+    _worker['output_loader'] = FileSystemLoader(output_dirs)
+    _worker['cache'] = open_cache(args)
+    _worker['profiler'] = None
+    if args.profile:
+        _worker['profiler'] = timing.Profiler()
+        timing.register(_worker['profiler'])
+
+def run_worker(unit):
+    """
+    Generates a network in a worker process
+
+    returns:
+        a (outputs, error message, timings) tuple
+    """
+    args = _worker['args']
+    outputs = [StringIO() for output in args.outputs]
+    message = None
+    profiler = _worker['profiler']
+    if profiler is not None:
+        profiler.begin(*unit_key(unit))
+    try:
+        generate_network(args, _worker['topo_loader'],
+                         _worker['output_loader'], unit, outputs,
+                         cache=_worker['cache'])
+    except Exception as exception:
+        message = error_message(exception)
+        if message is None:
+            raise
+    finally:
+        timings = profiler.end() if profiler is not None else None
+    return ([output.getvalue() for output in outputs], message, timings)
 
 if __name__ == '__main__':
     main()
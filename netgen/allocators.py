@@ -0,0 +1,198 @@
+"""
+Subnet allocation strategies of a Zone
+
+The strategy of a zone is chosen with the "allocator" key of its
+topology:
+
+    sequential: subnets are placed one after the other in template order,
+                each aligned on its size (the default)
+    buddy: each subnet takes the lowest free block of the smallest
+           sufficient size, splitting larger blocks in halves, so that
+           mixed prefix lengths are packed without alignment holes
+
+Both work on integer addresses and keep track of the free space.
+"""
+import heapq
+
+from .exception import NetworkFull, ConfigError, UnalignedSubnet
+
+
+def merge_intervals(intervals):
+    """
+    Merges contiguous (start, end) intervals
+
+    returns:
+        the merged intervals, sorted
+    """
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and merged[-1][1] + 1 >= start:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+class SequentialAllocator(object):
+    """
+    Allocates subnets in order from the current address of the zone
+
+    Space skipped by alignment or by "_" subnets is kept in a list of
+    free (start, end) intervals, in address order
+    """
+
+    name = 'sequential'
+
+    def __init__(self, zone):
+        self.zone = zone
+        self.free = []
+
+    def _add_free(self, start, end):
+        """
+        Records the free interval [start, end], merged with the previous
+        one if they are contiguous
+        """
+        if start > end:
+            return
+        if self.free and self.free[-1][1] + 1 == start:
+            self.free[-1] = (self.free[-1][0], end)
+        else:
+            self.free.append((start, end))
+
+    def align(self, prefixlen):
+        zone = self.zone
+        address = zone._next_subnet(prefixlen)
+        self._add_free(zone._cur_addr, min(address, zone.end + 1) - 1)
+        zone._cur_addr = address
+
+    def shadow(self, prefixlen):
+        """
+        Returns the address of a zero-sized subnet covering the next
+        subnets
+        """
+        return self.zone._cur_addr
+
+    def allocate(self, name, prefixlen):
+        zone = self.zone
+        address = zone._next_subnet(prefixlen)
+        size = 1 << (zone.net_max_prefixlen - prefixlen)
+
+        # checking is subnet fits
+        if address < zone.start or address + size - 1 > zone.end:
+            raise NetworkFull
+
+        # checking for unaligned subnets
+        if address > zone._cur_addr:
+            raise UnalignedSubnet('unaligned subnet "{0}" ({1}, '
+                                  'should be {2})'
+                                  .format(name,
+                                          zone.Network((address, prefixlen)),
+                                          zone.cur_addr))
+
+        # shifting current address
+        zone._cur_addr = address + size
+        return address
+
+    def skip(self, address, prefixlen):
+        """
+        Leaves the block of a "_" subnet free
+        """
+        size = 1 << (self.zone.net_max_prefixlen - prefixlen)
+        self._add_free(address, address + size - 1)
+
+    def free_space(self):
+        """
+        Returns the free (start, end) intervals, including the space left
+        after the last subnet
+        """
+        zone = self.zone
+        free = list(self.free)
+        if zone._cur_addr <= zone.end:
+            if free and free[-1][1] + 1 == zone._cur_addr:
+                free[-1] = (free[-1][0], zone.end)
+            else:
+                free.append((zone._cur_addr, zone.end))
+        return free
+
+
+class BuddyAllocator(object):
+    """
+    Allocates each subnet in the lowest free block of the smallest
+    sufficient size
+
+    Free blocks are kept in one heap of addresses per block order (log2 of
+    the block size), so a block is found in O(bits + log n). Larger blocks
+    are split in halves, the unused halves becoming free blocks.
+    """
+
+    name = 'buddy'
+
+    def __init__(self, zone):
+        self.zone = zone
+        self.bits = zone.net_max_prefixlen
+        # order -> heap of free block addresses
+        self.blocks = [[] for _ in range(self.bits + 1)]
+        self.blocks[self.bits - zone.prefixlen].append(zone.start)
+        # blocks of "_" subnets
+        self.skipped = []
+        self.pending_align = None
+
+    def align(self, prefixlen):
+        """
+        Aligns the next subnet on a prefixlen boundary
+        """
+        self.pending_align = prefixlen
+
+    def shadow(self, prefixlen):
+        raise ConfigError('zero-sized subnets are not supported by the'
+                          ' buddy allocator')
+
+    def take(self, order):
+        """
+        Removes the lowest free block of the smallest order >= order,
+        and splits it down to order
+
+        returns:
+            the block address, or None if no block is large enough
+        """
+        for larger in range(order, self.bits + 1):
+            if self.blocks[larger]:
+                break
+        else:
+            return None
+        address = heapq.heappop(self.blocks[larger])
+        while larger > order:
+            larger -= 1
+            heapq.heappush(self.blocks[larger], address + (1 << larger))
+        return address
+
+    def allocate(self, name, prefixlen):
+        order = self.bits - prefixlen
+        if self.pending_align is not None:
+            order = max(order, self.bits - self.pending_align)
+            self.pending_align = None
+        address = self.take(order)
+        if address is None:
+            raise NetworkFull
+        # give back the end of a block taken larger for alignment
+        size_order = self.bits - prefixlen
+        while order > size_order:
+            order -= 1
+            heapq.heappush(self.blocks[order], address + (1 << order))
+        return address
+
+    def skip(self, address, prefixlen):
+        size = 1 << (self.bits - prefixlen)
+        self.skipped.append((address, address + size - 1))
+
+    def free_space(self):
+        free = [(address, address + (1 << order) - 1)
+                for order, addresses in enumerate(self.blocks)
+                for address in addresses]
+        return merge_intervals(free + self.skipped)
+
+
+allocators = {
+    'sequential': SequentialAllocator,
+    'buddy': BuddyAllocator,
+}
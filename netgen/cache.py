@@ -0,0 +1,380 @@
+"""
+Content-addressed cache of generation results
+
+The output of a network is stored under a hash of everything it depends
+on, so an unchanged network can be replayed from disk instead of being
+rendered, validated and allocated again.
+
+ParsedFileCache keeps the parsed and validated contents of a single
+file, such as zones.yaml.
+"""
+import glob
+import hashlib
+import json
+import os
+import pickle
+import re
+import tempfile
+import time
+from collections import OrderedDict
+
+from jinja2 import meta
+from jinja2.exceptions import TemplateNotFound
+
+
+# netgen modules whose code affects the generated output
+code_files = ('engine.py', 'emitters.py', 'streaming.py', 'templateutils.py',
+              'allocators.py', 'providers.py')
+
+# code files -> digest
+_code_digests = {}
+_template_digests = {}
+
+replace = getattr(os, 'replace', os.rename)
+
+
+def code_digest(files=code_files):
+    """
+    Returns the digest of the netgen code generating the output
+
+    args:
+        files: the netgen modules to hash
+    """
+    cached = _code_digests.get(files)
+    if cached is None:
+        digest = hashlib.sha256()
+        directory = os.path.dirname(os.path.abspath(__file__))
+        for name in files:
+            with open(os.path.join(directory, name), 'rb') as code_fd:
+                digest.update(code_fd.read())
+        cached = _code_digests[files] = digest.hexdigest()
+    return cached
+
+
+def template_digest(env, name):
+    """
+    Returns the digest of a template and of all the templates
+    it includes, imports or extends
+
+    returns:
+        the hex digest, or None if the template uses dynamic references
+    """
+    key = (env, name)
+    cached = _template_digests.get(key)
+    if cached is not None and all(uptodate() for uptodate in cached[1]):
+        return cached[0]
+    checks = []
+    digest = _template_digest(env, name, set([name]), checks)
+    if digest is not None and None not in checks:
+        _template_digests[key] = (digest, checks)
+    return digest
+
+
+def topology_digest(env, name):
+    """
+    Returns the digest of a topology: its jinja template or the source of
+    its python provider
+
+    returns:
+        the hex digest, or None if it can't be computed
+    """
+    try:
+        return template_digest(env, '{0}.yaml'.format(name))
+    except TemplateNotFound:
+        from .providers import provider_digest
+        return provider_digest(env, name)
+
+
+def _template_digest(env, name, seen, checks):
+    source, filename, uptodate = env.loader.get_source(env, name)
+    checks.append(uptodate)
+    digest = hashlib.sha256(source.encode('utf-8'))
+    for reference in meta.find_referenced_templates(env.parse(source)):
+        if reference is None:
+            return None
+        if reference in seen:
+            continue
+        seen.add(reference)
+        try:
+            reference_digest = _template_digest(env, reference, seen, checks)
+        except TemplateNotFound:
+            return None
+        if reference_digest is None:
+            return None
+        digest.update(reference_digest.encode('ascii'))
+    return digest.hexdigest()
+
+
+class ResultCache(object):
+    """
+    Directory of cached results, safe for concurrent use by several
+    processes: entries are written atomically and missing entries are
+    treated as cache misses
+
+    Only directories created empty by a ResultCache hold the marker file,
+    entries are never evicted from other directories
+    """
+
+    temp_prefix = '.tmp-'
+    marker = '.netgen-result-cache'
+    subdir_re = re.compile(r'^[0-9a-f]{2}$')
+    entry_re = re.compile(r'^[0-9a-f]{64}$')
+
+    def __init__(self, directory, max_size=None):
+        """
+        args:
+            directory: the cache directory, created if needed
+            max_size: maximum size in bytes, enforced by evict()
+        """
+        self.directory = directory
+        self.max_size = max_size
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                if not os.path.isdir(directory):
+                    raise
+        if not os.listdir(directory):
+            with open(os.path.join(directory, self.marker), 'w'):
+                pass
+
+    @staticmethod
+    def key(*parts):
+        """
+        Computes a cache key from json-serializable parts
+        """
+        data = json.dumps(parts, sort_keys=True, default=str)
+        return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key):
+        """
+        Returns the cached result, or None
+        """
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as cache_fd:
+                data = cache_fd.read()
+        except (IOError, OSError):
+            return None
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return data.decode('utf-8')
+
+    def put(self, key, value):
+        """
+        Stores a result
+        """
+        path = self.path(key)
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                if not os.path.isdir(directory):
+                    raise
+        temp_fd, temp_path = tempfile.mkstemp(dir=directory,
+                                              prefix=self.temp_prefix)
+        try:
+            with os.fdopen(temp_fd, 'wb') as cache_fd:
+                cache_fd.write(value.encode('utf-8'))
+            replace(temp_path, path)
+        except Exception:
+            try:
+                os.unlink(temp_path)
+            except OSError:
+                pass
+            raise
+
+    def evict(self):
+        """
+        Removes the least recently used entries until the cache size
+        is below max_size, and stale temporary files
+        """
+        if not os.path.isfile(os.path.join(self.directory, self.marker)):
+            return
+        entries = []
+        total = 0
+        now = time.time()
+        for path in self.files():
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if os.path.basename(path).startswith(self.temp_prefix):
+                if now - stat.st_mtime > 3600:
+                    self._unlink(path)
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+        if self.max_size is None or total <= self.max_size:
+            return
+        entries.sort()
+        for mtime, size, path in entries:
+            if total <= self.max_size:
+                break
+            self._unlink(path)
+            total -= size
+
+    def files(self):
+        """
+        Yields the paths of the entries and temporary files
+        """
+        for subdir in glob.glob(os.path.join(self.directory, '??')):
+            prefix = os.path.basename(subdir)
+            if not self.subdir_re.match(prefix):
+                continue
+            try:
+                names = os.listdir(subdir)
+            except OSError:
+                continue
+            for name in names:
+                if ((self.entry_re.match(name) and name.startswith(prefix))
+                        or name.startswith(self.temp_prefix)):
+                    yield os.path.join(subdir, name)
+
+    @staticmethod
+    def _unlink(path):
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+
+class MemoryCache(object):
+    """
+    In-memory cache of results with the ResultCache interface,
+    for long-running processes
+    """
+
+    def __init__(self, max_size=None):
+        """
+        args:
+            max_size: maximum size in characters, enforced by evict()
+        """
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.size = 0
+
+    def get(self, key):
+        """
+        Returns the cached result, or None
+        """
+        value = self.entries.pop(key, None)
+        if value is not None:
+            self.entries[key] = value
+        return value
+
+    def put(self, key, value):
+        """
+        Stores a result
+        """
+        previous = self.entries.pop(key, None)
+        if previous is not None:
+            self.size -= len(previous)
+        self.entries[key] = value
+        self.size += len(value)
+
+    def evict(self):
+        """
+        Removes the least recently used entries until the cache size
+        is below max_size
+        """
+        if self.max_size is None:
+            return
+        while self.entries and self.size > self.max_size:
+            key, value = self.entries.popitem(last=False)
+            self.size -= len(value)
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class ParsedFileCache(object):
+    """
+    Cache of the value parsed from a file, stored as a pickle
+
+    The entry is reused while the mtime and size of the file are
+    unchanged, or when its content hash is unchanged, and only by the
+    netgen code that wrote it. The cache file is trusted like the source
+    file, it must not be writable by others.
+    """
+
+    version = 2
+
+    # netgen modules parsing and validating the file, the zones schema
+    # being in __main__
+    code_files = code_files + ('__main__.py',)
+
+    # files modified less than this many seconds before being cached are
+    # checked by content, as a later change could keep the same mtime
+    racy_delay = 2
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self, source, parse):
+        """
+        Returns the parsed contents of source, from the cache if possible
+
+        args:
+            parse: function returning the value from the file contents
+        """
+        stat = os.stat(source)
+        mtime = getattr(stat, 'st_mtime_ns', stat.st_mtime)
+        entry = self.read()
+        if entry is not None and entry[2:4] == (mtime, stat.st_size):
+            return entry[5]
+        with open(source, 'rb') as source_fd:
+            data = source_fd.read()
+        digest = hashlib.sha256(data).hexdigest()
+        if entry is not None and entry[4] == digest:
+            value = entry[5]
+        else:
+            value = parse(data)
+        if time.time() - stat.st_mtime < self.racy_delay:
+            mtime = None
+        self.write((self.version, code_digest(self.code_files), mtime,
+                    len(data), digest, value))
+        return value
+
+    def read(self):
+        try:
+            with open(self.path, 'rb') as cache_fd:
+                entry = pickle.load(cache_fd)
+        except Exception:
+            return None
+        if not isinstance(entry, tuple) or entry[:2] != (
+                self.version, code_digest(self.code_files)):
+            return None
+        return entry
+
+    def write(self, entry):
+        """
+        Stores an entry, errors are ignored as the cache is optional
+        """
+        directory = os.path.dirname(os.path.abspath(self.path))
+        try:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            temp_fd, temp_path = tempfile.mkstemp(dir=directory,
+                                                  prefix='.tmp-')
+        except OSError:
+            return
+        try:
+            with os.fdopen(temp_fd, 'wb') as cache_fd:
+                pickle.dump(entry, cache_fd, pickle.HIGHEST_PROTOCOL)
+            replace(temp_path, self.path)
+        except Exception:
+            try:
+                os.unlink(temp_path)
+            except OSError:
+                pass
@@ -0,0 +1,218 @@
+"""
+Free address space of the zones
+
+The zones are allocated without their hosts, and the free intervals
+kept by each Zone are summed per zone, vrf and ip version. The number
+of subnets of a prefix length that still fit is computed with integer
+arithmetic on the intervals.
+"""
+from __future__ import print_function
+import argparse
+import json
+import os
+import sys
+
+from .__main__ import (data_paths, load_zones, select_networks,
+                       allocate_network, error_message)
+from .plan import Networks
+from .stats import percent
+
+DEFAULT_PREFIXLENS = {
+    4: (16, 20, 22, 24, 26, 28, 30),
+    6: (32, 40, 48, 56, 64),
+}
+
+
+def cidr_blocks(start, end, bits):
+    """
+    Splits the interval [start, end] in aligned blocks
+
+    returns:
+        a list of (start, prefixlen) tuples
+    """
+    blocks = []
+    while start <= end:
+        size = start & -start if start else 1 << bits
+        while size > end - start + 1:
+            size >>= 1
+        blocks.append((start, bits - size.bit_length() + 1))
+        start += size
+    return blocks
+
+
+def fit_count(start, end, prefixlen, bits):
+    """
+    Returns the number of aligned subnets of prefixlen in [start, end]
+    """
+    size = 1 << (bits - prefixlen)
+    first = (start + size - 1) & ~(size - 1)
+    if first > end:
+        return 0
+    return (end + 1 - first) // size
+
+
+class Capacity(object):
+    """
+    Free space of the networks of a zone, in a vrf and ip version
+    """
+
+    def __init__(self, zone, vrf, ipversion):
+        self.zone = zone
+        self.vrf = vrf
+        self.ipversion = ipversion
+        self.bits = 32 if ipversion == 4 else 128
+        # (network, free intervals)
+        self.networks = []
+
+    def add_zone(self, zone):
+        self.networks.append((zone.network, zone.free_space()))
+
+    @property
+    def size(self):
+        return sum(network.num_addresses for network, free in self.networks)
+
+    @property
+    def free(self):
+        return sum(end - start + 1 for network, free in self.networks
+                   for start, end in free)
+
+    def prefixlens(self, prefixlens=None):
+        """
+        Returns the prefix lengths to report, longer than the networks
+        """
+        smallest = min(network.prefixlen for network, free in self.networks)
+        return [prefixlen
+                for prefixlen in (prefixlens or
+                                  DEFAULT_PREFIXLENS[self.ipversion])
+                if smallest <= prefixlen <= self.bits]
+
+    def fits(self, prefixlen, free=None):
+        """
+        Returns the number of subnets of prefixlen that still fit
+        """
+        if free is None:
+            free = [interval for network, free in self.networks
+                    for interval in free]
+        return sum(fit_count(start, end, prefixlen, self.bits)
+                   for start, end in free)
+
+    def gaps(self, free):
+        Network = Networks[self.ipversion]
+        return [str(Network(block)) for start, end in free
+                for block in cidr_blocks(start, end, self.bits)]
+
+    def report(self, prefixlens=None):
+        """
+        returns:
+            the capacity as a json-serializable dict
+        """
+        prefixlens = self.prefixlens(prefixlens)
+        return {
+            'zone': self.zone, 'vrf': self.vrf, 'ipv': self.ipversion,
+            'size': self.size, 'free': self.free,
+            'fits': dict(('/{0}'.format(prefixlen), self.fits(prefixlen))
+                         for prefixlen in prefixlens),
+            'networks': [{
+                'network': str(network),
+                'free': sum(end - start + 1 for start, end in free),
+                'fits': dict(('/{0}'.format(prefixlen),
+                              self.fits(prefixlen, free))
+                             for prefixlen in prefixlens),
+                'gaps': self.gaps(free),
+            } for network, free in self.networks],
+        }
+
+
+def zones_capacity(zones, topology_dir, zone_names, vrfs=None):
+    """
+    Allocates the subnets of the zones, without hosts
+
+    returns:
+        the list of Capacity objects, by zone, vrf and ip version
+    """
+    from jinja2 import FileSystemLoader
+    args = argparse.Namespace(zone=zone_names, vrf=vrfs, network=None,
+                              in_network=None, topology=None,
+                              match_topology=None, ipv4=False, ipv6=False)
+    loader = FileSystemLoader(topology_dir)
+    capacities = {}
+    order = []
+    for unit in select_networks(args, zones):
+        ngen = allocate_network(loader, unit, unit[1].get('params', {}),
+                                with_hosts=False)
+        for zone in ngen.zones:
+            key = (unit[0], u'{0}'.format(zone.vrf), unit[3])
+            if key not in capacities:
+                capacities[key] = Capacity(*key)
+                order.append(key)
+            capacities[key].add_zone(zone)
+    return [capacities[key] for key in order]
+
+
+def format_report(report, gaps=False):
+    lines = ['{zone} {vrf} ipv{ipv}: {free}/{size} addresses free'
+             ' ({0:.02f}%)'.format(percent(report['free'], report['size']),
+                                   **report)]
+    fits = ', '.join('{0}: {1}'.format(prefixlen, count) for prefixlen, count
+                     in sorted(report['fits'].items(),
+                               key=lambda item: int(item[0][1:])))
+    if fits:
+        lines.append('  fits: {0}'.format(fits))
+    for network in report['networks']:
+        lines.append('  {network}: {free} free'.format(**network))
+        if gaps and network['gaps']:
+            lines.extend('    {0}'.format(gap) for gap in network['gaps'])
+    return '\n'.join(lines)
+
+
+def parse_arguments(arguments):
+    parser = argparse.ArgumentParser(
+        prog='netgen capacity',
+        description='report the free address space of the zones')
+    parser.add_argument('--data', '-d', metavar='DIR', type=str,
+                        default=os.environ.get('NETGEN_DATA_DIR', '.'),
+                        help='the data directory (default: .)')
+    parser.add_argument('--zone', '-z', metavar='ZONE', type=str,
+                        action='append', default=None,
+                        help='only report this zone (default: all)')
+    parser.add_argument('--vrf', '-v', metavar='VRF', type=str,
+                        action='append', default=None,
+                        help='only report this vrf (default: all)')
+    parser.add_argument('--prefixlen', '-l', metavar='N', type=int,
+                        action='append', default=None,
+                        help=('count the subnets of this prefix length that'
+                              ' still fit (default: /16 to /30 and'
+                              ' /32 to /64)'))
+    parser.add_argument('--gaps', '-g', action='store_true', default=False,
+                        help='list the free blocks of each network')
+    parser.add_argument('--json', action='store_true', default=False,
+                        help='output the report as json, with the gaps')
+    parser.add_argument('--debug', action='store_true', default=False,
+                        help='don\'t catch exceptions')
+    return parser.parse_args(arguments)
+
+
+def main(arguments=None):
+    args = parse_arguments(arguments)
+    zones_file, topology_dir, output_dirs = data_paths(args.data)
+    zones = load_zones(zones_file, debug=args.debug)
+    for zone in args.zone or []:
+        if zone not in zones:
+            sys.exit('zone "{0}" does not exists'.format(zone))
+
+    try:
+        capacities = zones_capacity(zones, topology_dir,
+                                    args.zone or sorted(zones), args.vrf)
+    except Exception as exception:
+        message = error_message(exception)
+        if message is None or args.debug:
+            raise
+        sys.exit(message)
+
+    reports = [capacity.report(args.prefixlen) for capacity in capacities]
+    if args.json:
+        json.dump(reports, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+    else:
+        print('\n\n'.join(format_report(report, gaps=args.gaps)
+                          for report in reports))
@@ -0,0 +1,78 @@
+"""
+Thin client for netgen serve
+
+Takes the same arguments as netgen and prints the answer of the server.
+The server address is read from NETGEN_SERVER (host:port) or
+NETGEN_SOCKET (unix socket path), and defaults to the .netgen.sock
+socket of the data directory.
+"""
+from __future__ import print_function
+import json
+import os
+import socket
+import sys
+
+
+def server_address(arguments):
+    """
+    Returns the server address, a unix socket path or a (host, port) tuple
+    """
+    server = os.environ.get('NETGEN_SERVER')
+    if server:
+        host, _, port = server.rpartition(':')
+        return (host or '127.0.0.1', int(port))
+    data_dir = os.environ.get('NETGEN_DATA_DIR', '.')
+    for index, argument in enumerate(arguments):
+        if argument in ('--data', '-d') and index + 1 < len(arguments):
+            data_dir = arguments[index + 1]
+        elif argument.startswith('--data='):
+            data_dir = argument[len('--data='):]
+    return os.environ.get('NETGEN_SOCKET',
+                          os.path.join(data_dir, '.netgen.sock'))
+
+
+def request(arguments, address, tty=False):
+    """
+    Sends a command line to the server
+
+    returns:
+        a (status, output, error message) tuple
+    """
+    if isinstance(address, tuple):
+        client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    else:
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(address)
+        client.sendall(json.dumps({'arguments': list(arguments),
+                                   'tty': tty}).encode('utf-8') + b'\n')
+        chunks = []
+        while True:
+            chunk = client.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    finally:
+        client.close()
+    response = json.loads(b''.join(chunks).decode('utf-8'))
+    return response['status'], response['output'], response['error']
+
+
+def main(arguments=None):
+    if arguments is None:
+        arguments = sys.argv[1:]
+    address = server_address(arguments)
+    try:
+        status, output, error = request(arguments, address,
+                                        tty=sys.stdout.isatty())
+    except (socket.error, ValueError) as exception:
+        sys.exit('error contacting netgen server at {0}: {1}'
+                 .format(address, exception))
+    sys.stdout.write(output)
+    if error:
+        print(error.rstrip('\n'), file=sys.stderr)
+    sys.exit(status)
+
+
+if __name__ == '__main__':
+    main()
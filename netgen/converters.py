@@ -1,5 +1,14 @@
+"""
+Converters between the yaml and json plan formats
+
+Both converters stream their input: the items of top-level sequences
+(the zones of a plan) are converted one at a time, so memory use does
+not depend on the size of the plan. The yaml sequence is written as
+concatenated one-item dumps, which requires the block style.
+"""
 import argparse
 import sys
+from itertools import chain
 import yaml
 try:
     import simplejson as json
@@ -10,6 +19,84 @@ try:
 except ImportError:
     from yaml import SafeLoader as YAMLLoader, SafeDumper as YAMLDumper
 
+from .streaming import IterReader, iter_json_values, iter_yaml_documents
+
+
+def convert_yaml(input_file, output_file, lines=False):
+    """
+    Writes the documents of a yaml stream as json
+
+    A single document is written as one json value. Several documents
+    are written one per line.
+
+    args:
+        lines: write json lines, one line for each item of top-level
+               sequences and for each other document
+    """
+    write = output_file.write
+    documents = 0
+    for is_sequence, value in iter_yaml_documents(YAMLLoader(input_file)):
+        if lines:
+            for item in (value if is_sequence else [value]):
+                write(json.dumps(item))
+                write('\n')
+            continue
+        if documents:
+            write('\n')
+        documents += 1
+        if not is_sequence:
+            write(json.dumps(value))
+            continue
+        write('[')
+        for index, item in enumerate(value):
+            if index:
+                write(', ')
+            write(json.dumps(item))
+        write(']')
+    if not documents and not lines:
+        write(json.dumps(None))
+
+
+def convert_json(input_file, output_file, documents=False):
+    """
+    Writes a json array, or a stream of json values, as yaml
+
+    The items of an array and the values of a json lines stream are
+    written as a yaml sequence, a single other value as is.
+
+    args:
+        documents: write each item or value as a separate yaml document
+    """
+    head = input_file.read(65536)
+    is_array = head.lstrip()[:1] == '['
+    chunks = chain([head], iter(lambda: input_file.read(65536), ''))
+    values = iter_json_values(IterReader(chunks))
+
+    if documents:
+        for value in values:
+            yaml.dump(value, output_file, Dumper=YAMLDumper,
+                      default_flow_style=False, explicit_start=True)
+        return
+
+    missing = object()
+    first = next(values, missing)
+    if first is missing:
+        if is_array:
+            yaml.dump([], output_file, Dumper=YAMLDumper,
+                      default_flow_style=False)
+        return
+    if not is_array:
+        second = next(values, missing)
+        if second is missing:
+            yaml.dump(first, output_file, Dumper=YAMLDumper,
+                      default_flow_style=False)
+            return
+        values = chain([second], values)
+    for item in chain([first], values):
+        yaml.dump([item], output_file, Dumper=YAMLDumper,
+                  default_flow_style=False)
+
+
 def yaml2json():
     parser = argparse.ArgumentParser()
     parser.add_argument('input', nargs='?',
@@ -18,16 +105,22 @@ def yaml2json():
     parser.add_argument('output', nargs='?',
                         type=argparse.FileType('w'), default=sys.stdout,
                         help='the json output file name')
+    parser.add_argument('--lines', '-l', action='store_true', default=False,
+                        help=('write json lines, one line per item of'
+                              ' top-level sequences'))
     args = parser.parse_args()
-    json.dump(yaml.load(args.input, Loader=YAMLLoader), args.output)
+    convert_yaml(args.input, args.output, lines=args.lines)
 
 def json2yaml():
     parser = argparse.ArgumentParser()
     parser.add_argument('input', nargs='?',
                         type=argparse.FileType('r'), default=sys.stdin,
-                        help='the json input file name')
+                        help='the json or json lines input file name')
     parser.add_argument('output', nargs='?',
                         type=argparse.FileType('w'), default=sys.stdout,
                         help='the yaml output file name')
+    parser.add_argument('--documents', '-D', action='store_true',
+                        default=False,
+                        help='write each item as a separate yaml document')
     args = parser.parse_args()
-    yaml.dump(json.load(args.input), args.output, Dumper=YAMLDumper)
+    convert_json(args.input, args.output, documents=args.documents)
@@ -0,0 +1,502 @@
+"""
+Differences between two generations of an address plan
+
+Each side is a data directory, a plan file written by --write-plan, or
+git:REV for the data directory at a git revision. Subnets and hosts are
+first paired by name with a sorted merge, the pairs being unchanged or
+renumbered, hosts being named within their subnet. Hosts whose name is
+unique are then paired across subnets. The remaining ones are paired by
+address, as renamed, and the rest is added or removed.
+
+Runs of consecutive subnets of a zone renumbered by the same offset are
+reported as allocation shifts, usually caused by a subnet inserted,
+removed or resized before them.
+"""
+from __future__ import print_function
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+from collections import Counter
+from io import BytesIO
+from itertools import groupby
+
+from .__main__ import data_paths, load_zones, select_networks, allocate_network
+from .__main__ import error_message
+from .plan import (PlanFile, PlanWriter, network_records, ZONE, SUBNET, HOST,
+                   NONE, STATUSES, Addresses, Networks)
+
+KINDS = ('added', 'removed', 'renumbered', 'renamed', 'changed')
+
+
+class Subnet(object):
+    """
+    A subnet of a plan
+
+    Subnets and hosts are identified by their name in the network of their
+    zone, a zone holding one network per zones.yaml entry
+    """
+    __slots__ = ('zone', 'network', 'vrf', 'ipv', 'name', 'start',
+                 'prefixlen', 'vlan', 'status')
+
+    def __init__(self, zone, network, vrf, ipv, name, start, prefixlen, vlan,
+                 status):
+        self.zone = zone
+        self.network = network
+        self.vrf = vrf
+        self.ipv = ipv
+        self.name = name
+        self.start = start
+        self.prefixlen = prefixlen
+        self.vlan = vlan
+        self.status = status
+
+    def name_key(self):
+        return (self.vrf, self.ipv, self.zone, self.network, self.name)
+
+    # subnets are not paired across a parent
+    moved_key = None
+
+    def address_key(self):
+        return (self.vrf, self.ipv, self.start, self.prefixlen)
+
+    def same(self, other):
+        return (self.start, self.prefixlen) == (other.start, other.prefixlen)
+
+    def attributes(self):
+        return (self.vlan, self.status)
+
+    def describe(self):
+        return {'zone': self.zone, 'vrf': self.vrf, 'ipv': self.ipv,
+                'name': self.name, 'vlan': self.vlan, 'status': self.status,
+                'network': str(Networks[self.ipv]((self.start,
+                                                   self.prefixlen)))}
+
+
+class Host(object):
+    __slots__ = ('zone', 'network', 'vrf', 'ipv', 'subnet', 'name', 'start',
+                 'status')
+
+    def __init__(self, zone, network, vrf, ipv, subnet, name, start, status):
+        self.zone = zone
+        self.network = network
+        self.vrf = vrf
+        self.ipv = ipv
+        self.subnet = subnet
+        self.name = name
+        self.start = start
+        self.status = status
+
+    def name_key(self):
+        return (self.vrf, self.ipv, self.zone, self.network, self.subnet,
+                self.name)
+
+    def moved_key(self):
+        """
+        Key of a host moved to another subnet
+        """
+        return (self.vrf, self.ipv, self.zone, self.network, self.name)
+
+    def address_key(self):
+        return (self.vrf, self.ipv, self.start)
+
+    def same(self, other):
+        return self.start == other.start
+
+    def attributes(self):
+        return (self.subnet, self.status)
+
+    def describe(self):
+        return {'zone': self.zone, 'vrf': self.vrf, 'ipv': self.ipv,
+                'name': self.name, 'subnet': self.subnet,
+                'status': self.status,
+                'address': str(Addresses[self.ipv](self.start))}
+
+
+def plan_items(plan):
+    """
+    Reads the subnets and hosts of a plan
+
+    returns:
+        a (subnets, hosts) tuple of lists, subnets in plan order
+    """
+    strings = plan.string_table()
+    zones = [(strings[name], ((high << 64) | low, prefixlen),
+              strings[vrf_index] if vrf_index != NONE else u'', ipversion)
+             for name, vrf_index, ipversion, prefixlen, high, low, _, _
+             in plan.rows(ZONE)]
+    subnets = []
+    hosts = []
+    host_rows = plan.rows(HOST)
+    for (name, zone, prefixlen, status, _, vlan, _, high, low, _, count,
+         _) in plan.rows(SUBNET):
+        zone_name, network, vrf, ipversion = zones[zone]
+        subnet = Subnet(zone_name, network, vrf, ipversion, strings[name],
+                        (high << 64) | low, prefixlen,
+                        None if vlan < 0 else vlan, STATUSES[status])
+        subnets.append(subnet)
+        for _ in range(count):
+            host_name, host_status, _, host_high, host_low = next(host_rows)
+            hosts.append(Host(zone_name, network, vrf, ipversion, subnet.name,
+                              strings[host_name],
+                              (host_high << 64) | host_low,
+                              STATUSES[host_status]))
+    return subnets, hosts
+
+
+def sort_by(items, key):
+    """
+    returns:
+        the items sorted by key and their keys
+    """
+    keys = [key(item) for item in items]
+    order = sorted(range(len(items)), key=keys.__getitem__)
+    return [items[index] for index in order], [keys[index] for index in order]
+
+
+def merge(old, new, key):
+    """
+    Pairs the items of two lists having the same key, with a sorted merge
+
+    returns:
+        a generator of (old item, new item) tuples, with None for
+        unpaired items
+    """
+    old, old_keys = sort_by(old, key)
+    new, new_keys = sort_by(new, key)
+    old_index = new_index = 0
+    while old_index < len(old) and new_index < len(new):
+        old_key = old_keys[old_index]
+        new_key = new_keys[new_index]
+        if old_key == new_key:
+            yield old[old_index], new[new_index]
+            old_index += 1
+            new_index += 1
+        elif old_key < new_key:
+            yield old[old_index], None
+            old_index += 1
+        else:
+            yield None, new[new_index]
+            new_index += 1
+    for item in old[old_index:]:
+        yield item, None
+    for item in new[new_index:]:
+        yield None, item
+
+
+def split_unique(items, key):
+    """
+    returns:
+        the items whose key is unique and the others, as two lists
+    """
+    counter = Counter(key(item) for item in items)
+    unique = [item for item in items if counter[key(item)] == 1]
+    others = [item for item in items if counter[key(item)] != 1]
+    return unique, others
+
+
+def compare(old, new):
+    """
+    Compares two lists of Subnet or Host objects
+
+    returns:
+        a dict of KINDS to lists of items or of (old, new) tuples
+    """
+    changes = dict((kind, []) for kind in KINDS)
+
+    def classify(old_item, new_item):
+        if not old_item.same(new_item):
+            changes['renumbered'].append((old_item, new_item))
+        elif old_item.attributes() != new_item.attributes():
+            changes['changed'].append((old_item, new_item))
+
+    def pair_by_name(old, new, key):
+        old_left = []
+        new_left = []
+        for old_item, new_item in merge(old, new, key):
+            if old_item is None:
+                new_left.append(new_item)
+            elif new_item is None:
+                old_left.append(old_item)
+            else:
+                classify(old_item, new_item)
+        return old_left, new_left
+
+    old_left, new_left = pair_by_name(old, new,
+                                      lambda item: item.name_key())
+    if old_left and new_left and old_left[0].moved_key is not None:
+        # hosts moved to another subnet, if their name is unambiguous
+        key = lambda item: item.moved_key()
+        old_unique, old_left = split_unique(old_left, key)
+        new_unique, new_left = split_unique(new_left, key)
+        old_unique, new_unique = pair_by_name(old_unique, new_unique, key)
+        old_left += old_unique
+        new_left += new_unique
+    for old_item, new_item in merge(old_left, new_left,
+                                    lambda item: item.address_key()):
+        if old_item is None:
+            changes['added'].append(new_item)
+        elif new_item is None:
+            changes['removed'].append(old_item)
+        elif old_item.name == new_item.name:
+            classify(old_item, new_item)
+        else:
+            changes['renamed'].append((old_item, new_item))
+    return changes
+
+
+def find_shifts(old_subnets, renumbered):
+    """
+    Finds the runs of consecutive subnets of a zone renumbered by the same
+    offset
+
+    args:
+        old_subnets: the subnets of the old plan, in plan order
+        renumbered: the (old, new) renumbered subnets
+    """
+    moved = dict((id(old), new) for old, new in renumbered)
+    shifts = []
+
+    def add_shift(run, previous):
+        if len(run) < 2:
+            return
+        first = run[0]
+        new = moved[id(first)]
+        shifts.append({
+            'zone': first.zone, 'vrf': first.vrf, 'ipv': first.ipv,
+            'first': first.name,
+            'from': first.describe()['network'],
+            'to': new.describe()['network'],
+            'offset': new.start - first.start,
+            'subnets': len(run),
+            'after': previous.name if previous is not None else None,
+        })
+
+    for zone, subnets in groupby(old_subnets, key=lambda subnet: (
+            subnet.zone, subnet.network)):
+        previous = None
+        run = []
+        offset = None
+        for subnet in subnets:
+            new = moved.get(id(subnet))
+            subnet_offset = new.start - subnet.start if new else None
+            if run and subnet_offset != offset:
+                add_shift(run, previous)
+                previous = run[-1]
+                run = []
+            if new is None:
+                previous = subnet
+            else:
+                run.append(subnet)
+                offset = subnet_offset
+        add_shift(run, previous)
+    return shifts
+
+
+def zone_items(plan, zone_names=None):
+    """
+    Reads the subnets and hosts of a plan, restricted to some zones
+
+    args:
+        zone_names: the names of the zones to keep, or None for all
+    """
+    subnets, hosts = plan_items(plan)
+    if zone_names is None:
+        return subnets, hosts
+    zone_names = set(zone_names)
+    return ([subnet for subnet in subnets if subnet.zone in zone_names],
+            [host for host in hosts if host.zone in zone_names])
+
+
+def diff_plans(old_plan, new_plan, zone_names=None):
+    """
+    args:
+        zone_names: the names of the zones to compare, or None for all
+    returns:
+        the differences of two PlanFiles, as a json-serializable dict
+    """
+    old_subnets, old_hosts = zone_items(old_plan, zone_names)
+    new_subnets, new_hosts = zone_items(new_plan, zone_names)
+    result = {}
+    for name, old, new in (('subnets', old_subnets, new_subnets),
+                           ('hosts', old_hosts, new_hosts)):
+        changes = compare(old, new)
+        if name == 'subnets':
+            result['shifts'] = find_shifts(old, changes['renumbered'])
+        result[name] = dict(
+            (kind, [item.describe() if not isinstance(item, tuple) else
+                    {'old': item[0].describe(), 'new': item[1].describe()}
+                    for item in items])
+            for kind, items in changes.items())
+    return result
+
+
+def build_plan(data_dir, zone_names=None):
+    """
+    Allocates the networks of a data directory
+
+    returns:
+        a PlanWriter
+    """
+    from jinja2 import FileSystemLoader
+    zones_file, topology_dir, output_dirs = data_paths(data_dir)
+    zones = load_zones(zones_file)
+    args = argparse.Namespace(
+        zone=[zone for zone in (zone_names or sorted(zones)) if zone in zones],
+        vrf=None, network=None, in_network=None, topology=None,
+        match_topology=None, ipv4=False, ipv6=False)
+    loader = FileSystemLoader(topology_dir)
+    writer = PlanWriter()
+    for unit in select_networks(args, zones):
+        ngen = allocate_network(loader, unit, unit[1].get('params', {}),
+                                compact=True)
+        for zone in network_records(ngen.zones, unit[3]):
+            writer.add_zone(*zone)
+    return writer
+
+
+def checkout(revision, data_dir, directory):
+    """
+    Extracts the data directory at a git revision
+    """
+    prefix = subprocess.check_output(['git', 'rev-parse', '--show-prefix'],
+                                     cwd=data_dir).decode('utf-8').strip()
+    archive = subprocess.check_output(
+        ['git', 'archive', '--format=tar', '{0}:{1}'.format(revision, prefix)],
+        cwd=data_dir)
+    with tarfile.open(fileobj=BytesIO(archive)) as tar:
+        if hasattr(tarfile, 'data_filter'):
+            tar.extractall(directory, filter='data')
+        else:
+            tar.extractall(directory)
+
+
+def open_plan(source, data_dir, zone_names=None):
+    """
+    Opens a side of the diff
+
+    returns:
+        a PlanFile
+    """
+    if source.startswith('git:'):
+        directory = tempfile.mkdtemp(prefix='netgen-diff-')
+        try:
+            checkout(source[4:], data_dir, directory)
+            return open_plan(directory, data_dir, zone_names)
+        finally:
+            shutil.rmtree(directory)
+    if os.path.isfile(source):
+        return PlanFile(source)
+    if not os.path.isdir(source):
+        raise IOError('no such plan file or data directory: {0}'
+                      .format(source))
+    return PlanFile(None, data=build_plan(source, zone_names).getvalue())
+
+
+def counts(changes):
+    return ', '.join('{0} {1}'.format(len(changes[kind]), kind)
+                     for kind in KINDS)
+
+
+def format_item(item):
+    address = item.get('network') or item.get('address')
+    return '{0}/{1} {2} {3}'.format(item['zone'], item['vrf'], item['name'],
+                                    address)
+
+
+def print_report(result, summary=False, output_file=sys.stdout):
+    print('subnets: {0}'.format(counts(result['subnets'])), file=output_file)
+    print('hosts: {0}'.format(counts(result['hosts'])), file=output_file)
+    for shift in result['shifts']:
+        print('shift: {zone}/{vrf} {subnets} subnets from {first} moved by'
+              ' {offset:+d} addresses ({from} -> {to})'.format(**shift) +
+              (', after {0}'.format(shift['after'])
+               if shift['after'] is not None else ''),
+              file=output_file)
+    if summary:
+        return
+    symbols = {'added': '+', 'removed': '-', 'renumbered': '~',
+               'renamed': '=', 'changed': '*'}
+    for name in ('subnets', 'hosts'):
+        for kind in KINDS:
+            for item in result[name][kind]:
+                if 'old' in item:
+                    old, new = item['old'], item['new']
+                    if kind == 'renamed':
+                        detail = '{0} -> {1}'.format(old['name'],
+                                                     new['name'])
+                    elif kind == 'renumbered':
+                        detail = '{0} -> {1}'.format(
+                            old.get('network') or old['address'],
+                            new.get('network') or new['address'])
+                    else:
+                        detail = ', '.join(
+                            '{0}: {1} -> {2}'.format(key, old[key], new[key])
+                            for key in ('vlan', 'subnet', 'status')
+                            if key in old and old[key] != new[key])
+                    print('{0} {1} {2}: {3}'.format(
+                        symbols[kind], name[:-1], format_item(new),
+                        detail), file=output_file)
+                else:
+                    print('{0} {1} {2}'.format(symbols[kind], name[:-1],
+                                               format_item(item)),
+                          file=output_file)
+
+
+def parse_arguments(arguments):
+    parser = argparse.ArgumentParser(
+        prog='netgen diff',
+        description=('compare two generations of an address plan: data'
+                     ' directories, plan files or git:REV revisions of the'
+                     ' data directory'))
+    parser.add_argument('old', metavar='OLD')
+    parser.add_argument('new', metavar='NEW')
+    parser.add_argument('--data', '-d', metavar='DIR', type=str,
+                        default=os.environ.get('NETGEN_DATA_DIR', '.'),
+                        help='the data directory of git:REV (default: .)')
+    parser.add_argument('--zone', '-z', metavar='ZONE', type=str,
+                        action='append', default=None,
+                        help='only compare this zone (default: all)')
+    parser.add_argument('--json', action='store_true', default=False,
+                        help='output the differences as json')
+    parser.add_argument('--summary', action='store_true', default=False,
+                        help='only output the counts and the shifts')
+    parser.add_argument('--exit-code', action='store_true', default=False,
+                        help='exit with status 1 if there are differences')
+    parser.add_argument('--debug', action='store_true', default=False,
+                        help='don\'t catch exceptions')
+    return parser.parse_args(arguments)
+
+
+def main(arguments=None):
+    args = parse_arguments(arguments)
+    try:
+        old_plan = open_plan(args.old, args.data, args.zone)
+        new_plan = open_plan(args.new, args.data, args.zone)
+        result = diff_plans(old_plan, new_plan, args.zone)
+    except subprocess.CalledProcessError as exception:
+        if args.debug:
+            raise
+        sys.exit('git error: {0}'.format(exception))
+    except Exception as exception:
+        message = error_message(exception)
+        if isinstance(exception, ValueError):
+            message = 'error: {0}'.format(exception)
+        if message is None or args.debug:
+            raise
+        sys.exit(message)
+
+    if args.json:
+        json.dump(result, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+    else:
+        print_report(result, summary=args.summary)
+
+    if args.exit_code and (result['shifts'] or any(
+            result[name][kind] for name in ('subnets', 'hosts')
+            for kind in KINDS)):
+        sys.exit(1)
@@ -0,0 +1,158 @@
+"""
+Native emitters for the machine-readable output formats
+
+These walk the NetworkGenerator zones directly instead of rendering the
+bundled json, yaml, csv and hosts templates, and write their output in
+large chunks. They are only used in place of the bundled templates, a
+template with the same name in the output directory takes precedence.
+"""
+import csv
+from json.encoder import encode_basestring
+from ipaddress import IPv6Address
+
+
+def address_formatter(ipversion):
+    """
+    Returns a function formatting an integer address as a string
+    """
+    if ipversion == 4:
+        def format_ipv4(value):
+            return '{0}.{1}.{2}.{3}'.format(value >> 24, (value >> 16) & 255,
+                                            (value >> 8) & 255, value & 255)
+        return format_ipv4
+    return lambda value: str(IPv6Address(value))
+
+
+def netmask(subnet):
+    bits = subnet.net_max_prefixlen
+    mask = ((1 << bits) - 1) ^ ((1 << (bits - subnet.prefixlen)) - 1)
+    return str(subnet.Address(mask))
+
+
+# json string quoting, also valid for yaml double-quoted scalars
+quote = encode_basestring
+
+
+def emit_hosts(zones, ipversion, params, output_file):
+    fmt = address_formatter(ipversion)
+    for zone in zones:
+        for subnet in zone.subnets:
+            output_file.write(''.join(['\n{0} {1}'.format(fmt(host.addr),
+                                                          host.name)
+                                       for host in subnet.hosts]))
+    output_file.write('\n')
+
+
+def emit_csv(zones, ipversion, params, output_file):
+    fmt = address_formatter(ipversion)
+    output_file.write('\n')
+    writer = csv.writer(output_file, delimiter=';', lineterminator='\n')
+    for zone in zones:
+        for subnet in zone.subnets:
+            mask = netmask(subnet)
+            writer.writerows([(host.name, fmt(host.addr), mask)
+                              for host in subnet.hosts])
+
+
+def emit_json(zones, ipversion, params, output_file):
+    fmt = address_formatter(ipversion)
+    documents = []
+    for zone in zones:
+        lines = ['\n{{\n  "zone": {0},\n  "vrf": {1},'
+                 .format(quote('%s' % zone.name), quote('%s' % zone.vrf))]
+        subnets = []
+        for subnet in zone.subnets:
+            mask = quote(netmask(subnet))
+            parts = ['\n    {{'
+                     '\n      "name": {0},'
+                     '\n      "network": {1},'
+                     '\n      "address": {2},'
+                     '\n      "prefixlen": {3:d},'
+                     '\n      "netmask": {4},'
+                     .format(quote(subnet.name),
+                             quote('{0}/{1}'.format(fmt(subnet.start),
+                                                    subnet.prefixlen)),
+                             quote(fmt(subnet.start)), subnet.prefixlen, mask)]
+            if len(subnet.hosts):
+                parts.append('\n      "hosts": [')
+                parts.append(','.join([
+                    '\n        {{'
+                    '\n          "name": {0},'
+                    '\n          "address": {1},'
+                    '\n          "prefixlen": {2:d},'
+                    '\n          "netmask": {3}'
+                    '\n        }}'
+                    .format(quote(host.name), quote(fmt(host.addr)),
+                            subnet.prefixlen, mask)
+                    for host in subnet.hosts]))
+                parts.append('\n      ],')
+            parts.append('\n      "vlan": {0:d}\n    }}'
+                         .format(subnet.vlan or 0))
+            subnets.append(''.join(parts))
+        if subnets:
+            lines.append('\n  "subnets": [')
+            lines.append(','.join(subnets))
+            lines.append('\n  ],')
+        lines.append('\n  "ipv": "{0:d}"\n}}'.format(ipversion))
+        documents.append(''.join(lines))
+    output_file.write(','.join(documents))
+    output_file.write('\n')
+
+
+def emit_yaml(zones, ipversion, params, output_file):
+    fmt = address_formatter(ipversion)
+    write = output_file.write
+    for zone in zones:
+        write('\n- "zone": {0}'
+              '\n  "vrf": {1}'
+              '\n  "network": {2}'
+              '\n  "address": {3}'
+              '\n  "prefixlen": {4:d}'
+              '\n  "ipv": {5:d}'
+              .format(quote('%s' % zone.name), quote('%s' % zone.vrf),
+                      quote(str(zone.network)),
+                      quote(fmt(zone.start)), zone.prefixlen, ipversion))
+        if zone.subnets:
+            write('\n  "subnets":')
+        for subnet in zone.subnets:
+            mask = quote(netmask(subnet))
+            lines = ['\n    - "name": {0}'
+                     '\n      "network": {1}'
+                     '\n      "address": {2}'
+                     '\n      "prefixlen": {3:d}'
+                     '\n      "netmask": {4}'
+                     .format(quote(subnet.name),
+                             quote('{0}/{1}'.format(fmt(subnet.start),
+                                                    subnet.prefixlen)),
+                             quote(fmt(subnet.start)), subnet.prefixlen, mask)]
+            if subnet.vlan:
+                lines.append('\n      "vlan": {0:d}'.format(subnet.vlan))
+            lines.append('\n      "status": {0}'.format(quote(subnet.status)))
+            if len(subnet.hosts):
+                lines.append('\n      "hosts":')
+            for host in subnet.hosts:
+                lines.append('\n        - "name": {0}'
+                             '\n          "address": {1}'
+                             '\n          "prefixlen": {2:d}'
+                             '\n          "netmask": {3}'
+                             '\n          "status": {4}'
+                             .format(quote(host.name), quote(fmt(host.addr)),
+                                     subnet.prefixlen, mask,
+                                     quote(host.status)))
+                hostvars = host.vars
+                if hostvars:
+                    lines.append('\n          "vars":')
+                    lines.extend(['\n            {0}: {1}'
+                                  .format(quote('%s' % key),
+                                          quote('%s' % value))
+                                  for key, value in hostvars.items()])
+            write(''.join(lines))
+    write('\n')
+
+
+emitters = {
+    'csv': emit_csv,
+    'hosts': emit_hosts,
+    'json': emit_json,
+    'yaml': emit_yaml,
+}
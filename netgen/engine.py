@@ -1,20 +1,166 @@
 from __future__ import print_function
+from array import array
 from ipaddress import IPv4Network, IPv4Address
 from ipaddress import IPv6Network, IPv6Address
 from ipaddress import AddressValueError
-from jinja2 import Environment, FileSystemLoader, StrictUndefined
+from jinja2 import (Environment, FileSystemLoader, FileSystemBytecodeCache,
+                    StrictUndefined)
+from jinja2.exceptions import TemplateNotFound
+import os
 import re
-from six import u
+from six import u, integer_types
 import sys
-from voluptuous import Schema, Match, Required, Optional, MultipleInvalid, Any
+from types import GeneratorType
+from voluptuous import (Schema, Match, Required, Optional, MultipleInvalid,
+                        Any, All, Range)
 import yaml
 try:
     from yaml import CSafeLoader as YAMLLoader, CSafeDumper as YAMLDumper
 except ImportError:
     from yaml import SafeLoader as YAMLLoader, SafeDumper as YAMLDumper
 
-from .exception import NetworkFull, ConfigError, UnalignedSubnet
+from .allocators import allocators
+from .emitters import emitters
+from .providers import find_provider, provider_filename
+from .exception import NetworkFull, ConfigError
+from .streaming import IterReader, iter_yaml_mapping
 from .templateutils import TemplateUtils
+from .timing import timed
+from .validator import TopologyValidator
+
+
+padding_re = re.compile(r'^_/(\d+)$')
+
+
+# Jinja environments are shared by every Topology and NetworkGenerator of
+# the process, so that each template is only compiled once per run
+environment_options = {
+    'topology': {
+        'undefined': StrictUndefined,
+        'extensions': ['jinja2.ext.do', 'jinja2.ext.loopcontrols'],
+    },
+    'output': {
+        'extensions': ['jinja2.ext.do'],
+        'keep_trailing_newline': True,
+    },
+    'render': {
+        'extensions': ['jinja2.ext.do'],
+    },
+}
+
+templates_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'templates')
+
+_environments = {}
+_bytecode_cache = None
+_default_loader = None
+
+
+def set_template_cache(directory):
+    """
+    Enables the on-disk bytecode cache for all jinja environments
+
+    args:
+        directory: directory where compiled templates are stored,
+                   None disables the cache
+    """
+    global _bytecode_cache
+    if directory is None:
+        _bytecode_cache = None
+    else:
+        _bytecode_cache = FileSystemBytecodeCache(directory)
+    for env in _environments.values():
+        env.bytecode_cache = _bytecode_cache
+
+
+def loader_key(loader):
+    """
+    Returns the key of the environments of a loader: file system loaders
+    with the same search path share their environments, so that loaders
+    created again, as on each reload of the server, don't add environments
+    """
+    if type(loader) is FileSystemLoader:
+        return (FileSystemLoader, tuple(loader.searchpath), loader.encoding,
+                getattr(loader, 'followlinks', False))
+    return loader
+
+
+def get_environment(kind, loader, ipversion):
+    """
+    Returns the shared jinja environment for a loader and an ip version
+
+    args:
+        kind: one of 'topology', 'output' or 'render'
+        loader: the jinja loader used to find templates
+        ipversion: 4 or 6
+    returns:
+        a jinja Environment
+    """
+    key = (kind, loader_key(loader), ipversion)
+    env = _environments.get(key)
+    if env is None:
+        env = Environment(loader=loader, bytecode_cache=_bytecode_cache,
+                          **environment_options[kind])
+        TemplateUtils(ipversion).setup_environment(env)
+        _environments[key] = env
+    return env
+
+
+def is_bundled(env, name):
+    """
+    Checks if a template name resolves to a template bundled with netgen
+    """
+    try:
+        filename = env.loader.get_source(env, name)[1]
+    except TemplateNotFound:
+        return False
+    return (filename is not None and
+            os.path.dirname(os.path.abspath(filename)) == templates_dir)
+
+
+def default_loader():
+    global _default_loader
+    if _default_loader is None:
+        _default_loader = FileSystemLoader('templates')
+    return _default_loader
+
+
+def parse_topology_network(network):
+    """
+    returns:
+        a (network, ipversion) tuple
+    """
+    try:
+        return IPv4Network(u(str(network))), 4
+    except AddressValueError:
+        try:
+            return IPv6Network(u(str(network))), 6
+        except AddressValueError:
+            raise ConfigError('invalid network: {}'.format(str(network)))
+
+
+def load_topology(zone, vrf, network, name, params=None, loader=None):
+    """
+    Returns the topology named name: the NAME.yaml jinja template if it
+    exists, or a python provider (see netgen.providers)
+
+    returns:
+        a Topology or a PythonTopology object
+    """
+    try:
+        return Topology(zone, vrf, network, name, params=params,
+                        loader=loader)
+    except TemplateNotFound as exception:
+        ipversion = parse_topology_network(network)[1]
+        env = get_environment('topology', loader or default_loader(),
+                              ipversion)
+        with timed('load', dict(zone=zone, vrf=vrf, network=str(network),
+                                topology=provider_filename(name))):
+            provider = find_provider(env, name)
+        if provider is None:
+            raise exception
+        return PythonTopology(zone, vrf, network, provider[0], provider[1],
+                              params=params)
 
 
 class Topology(object):
@@ -22,25 +168,16 @@ class Topology(object):
     def __init__(self, zone, vrf, network, template,
                  params=None, loader=None):
 
-        try:
-            self.network = IPv4Network(u(str(network)))
-            self.ipversion = 4
-        except AddressValueError:
-            try:
-                self.network = IPv6Network(u(str(network)))
-                self.ipversion = 6
-            except AddressValueError:
-                raise ConfigError('invalid network: {}'.format(str(network)))
+        self.network, self.ipversion = parse_topology_network(network)
 
         if loader is None:
-            loader = FileSystemLoader('templates')
-        env = Environment(loader=loader,
-                          undefined=StrictUndefined,
-                          extensions=['jinja2.ext.do',
-                                      'jinja2.ext.loopcontrols'])
-        TemplateUtils(self.ipversion).setup_environment(env)
-
-        self.template = env.get_template('{0}.yaml'.format(template))
+            loader = default_loader()
+        env = get_environment('topology', loader, self.ipversion)
+
+        with timed('load', dict(zone=zone, vrf=vrf,
+                                network=str(self.network),
+                                topology='{0}.yaml'.format(template))):
+            self.template = env.get_template('{0}.yaml'.format(template))
         self.zone = zone
         self.vrf = vrf
         self.params = params if params is not None else {}
@@ -50,23 +187,132 @@ class Topology(object):
     @property
     def data(self):
         if self._data is None:
-            self._data = yaml.load(self.rendered, Loader=YAMLLoader)
+            rendered = self.rendered
+            with timed('parse', self.timing_context):
+                self._data = yaml.load(rendered, Loader=YAMLLoader)
         return self._data
 
     @property
     def rendered(self):
         if self._rendered is None:
-            self._rendered = self.template.render(zone=self.zone,
-                                                  vrf=self.vrf,
-                                                  network=self.network,
-                                                  params=self.params,
-                                                  ipv=self.ipversion)
+            with timed('render', self.timing_context):
+                self._rendered = self.template.render(**self.context)
         return self._rendered
 
+    @property
+    def timing_context(self):
+        return dict(zone=self.zone, vrf=self.vrf, network=str(self.network),
+                    topology=self.template.name)
+
+    @property
+    def context(self):
+        return dict(zone=self.zone, vrf=self.vrf, network=self.network,
+                    params=self.params, ipv=self.ipversion)
+
+    def stream(self):
+        """
+        Renders and parses the topology incrementally, without
+        keeping the rendered text or the whole data in memory
+
+        returns:
+            a generator of (key, value) pairs, see iter_yaml_mapping
+        """
+        chunks = self.template.generate(**self.context)
+        return iter_yaml_mapping(YAMLLoader(IterReader(chunks)))
+
     def __str__(self):
         return self.rendered
 
 
+class PythonTopology(Topology):
+    """
+    Topology generated by a python provider, without jinja rendering
+    and yaml parsing
+
+    args:
+        provider: callable receiving the template context as keyword
+                  arguments, returning the topology data or its subnets
+        name: name of the provider, for timings and messages
+    """
+
+    def __init__(self, zone, vrf, network, provider, name, params=None):
+        self.network, self.ipversion = parse_topology_network(network)
+        self.provider = provider
+        self.name = name
+        self.zone = zone
+        self.vrf = vrf
+        self.params = params if params is not None else {}
+        self._rendered = None
+        self._data = None
+
+    def generate(self):
+        """
+        Calls the provider
+
+        returns:
+            the topology data, whose subnets may be a generator
+        """
+        with timed('render', self.timing_context):
+            result = self.provider(**self.context)
+        if isinstance(result, dict):
+            return result
+        return {'zone': self.zone, 'network': str(self.network),
+                'vrf': self.vrf, 'subnets': result}
+
+    @property
+    def data(self):
+        if self._data is None:
+            data = self.generate()
+            subnets = data.get('subnets')
+            if isinstance(subnets, (tuple, GeneratorType)):
+                data = dict(data, subnets=list(subnets))
+            self._data = data
+        return self._data
+
+    @property
+    def rendered(self):
+        if self._rendered is None:
+            self._rendered = yaml.dump(self.data, Dumper=YAMLDumper,
+                                       default_flow_style=False)
+        return self._rendered
+
+    @property
+    def timing_context(self):
+        return dict(zone=self.zone, vrf=self.vrf, network=str(self.network),
+                    topology=self.name)
+
+    def stream(self):
+        """
+        Calls the provider, the subnets being allocated as they are
+        returned or yielded
+
+        returns:
+            a generator of (key, value) pairs, like Topology.stream()
+        """
+        data = self.generate()
+        for key, value in data.items():
+            if key == 'subnets' and isinstance(value, (list, tuple,
+                                                       GeneratorType)):
+                value = (subnet for subnet in value)
+            yield key, value
+
+
+def host_range_name(hostrange):
+    """
+    Returns the "first..last" names of a host range directive
+    """
+    prefix = hostrange.get('prefix', '')
+    if prefix.startswith('_'):
+        return prefix
+    prefix = prefix.lstrip('?!')
+    start = hostrange.get('start', 1)
+    names = ['{0}{1:0{2}d}{3}'.format(prefix, number,
+                                      hostrange.get('width', 0),
+                                      hostrange.get('suffix', ''))
+             for number in (start, start + hostrange['count'] - 1)]
+    return '..'.join(names)
+
+
 class Host(object):
     """
     Object representing a Host
@@ -79,15 +325,22 @@ class Host(object):
 
         args:
             name: hostname
-            address: IP address of the host
+            address: IP address of the host, as a string or an integer
         """
         self.name = name
-        self.address = self.Address(u(str(address)))
+        if isinstance(address, integer_types):
+            self.addr = address
+        else:
+            self.addr = int(self.Address(u(str(address))))
         if status not in self.valid_statuses:
             raise ValueError('{0} is not a valid status'.format(status))
         self.status = status
         self.vars = hostvars or dict()
 
+    @property
+    def address(self):
+        return self.Address(self.addr)
+
     def __repr__(self):
         return 'Host({0}: {1})'.format(self.name, self.address)
 
@@ -102,59 +355,215 @@ class IPv6Host(Host):
     Address = IPv6Address
 
 
+class HostView(object):
+    """
+    Lightweight view on a host stored in a HostTable
+
+    Exposes the same attributes as a Host object
+    """
+    __slots__ = ('_table', '_index')
+
+    def __init__(self, table, index):
+        self._table = table
+        self._index = index
+
+    @property
+    def name(self):
+        return self._table.names[self._index]
+
+    @property
+    def addr(self):
+        return self._table.start + self._table.offsets[self._index]
+
+    @property
+    def address(self):
+        return self._table.Address(self.addr)
+
+    @property
+    def status(self):
+        return Host.valid_statuses[self._table.statuses[self._index]]
+
+    @property
+    def vars(self):
+        return self._table.hostvars.get(self._index) or dict()
+
+    def __repr__(self):
+        return 'Host({0}: {1})'.format(self.name, self.address)
+
+
+class HostTable(object):
+    """
+    Compact storage for the hosts of a subnet
+
+    Hosts are stored as parallel arrays of names, address offsets
+    from the start of the subnet and status codes; hostvars are
+    stored sparsely. Items are HostView objects created on access.
+    """
+
+    def __init__(self, start, Address, offset_typecode):
+        self.start = start
+        self.Address = Address
+        self.names = []
+        self.offsets = array(offset_typecode)
+        self.statuses = array('B')
+        self.hostvars = {}
+
+    def add(self, name, address, status='active', hostvars=None):
+        if status not in Host.valid_statuses:
+            raise ValueError('{0} is not a valid status'.format(status))
+        index = len(self.names)
+        try:
+            self.offsets.append(address - self.start)
+        except OverflowError:
+            self.offsets = list(self.offsets)
+            self.offsets.append(address - self.start)
+        self.names.append(name)
+        self.statuses.append(Host.valid_statuses.index(status))
+        if hostvars:
+            self.hostvars[index] = hostvars
+        return HostView(self, index)
+
+    def extend(self, names, address, status='active', hostvars=None):
+        """
+        Adds hosts with consecutive addresses, from address
+        """
+        if status not in Host.valid_statuses:
+            raise ValueError('{0} is not a valid status'.format(status))
+        index = len(self.names)
+        offset = address - self.start
+        offsets = range(offset, offset + len(names))
+        try:
+            self.offsets.extend(offsets)
+        except OverflowError:
+            self.offsets = list(self.offsets)
+            self.offsets.extend(offsets)
+        self.names.extend(names)
+        self.statuses.extend([Host.valid_statuses.index(status)] * len(names))
+        if hostvars:
+            for host_index in range(index, index + len(names)):
+                self.hostvars[host_index] = hostvars
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [HostView(self, i)
+                    for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('host index out of range')
+        return HostView(self, index)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield HostView(self, index)
+
+    def __repr__(self):
+        return repr(list(self))
+
+
 class Subnet(object):
     """
     Object representing a Subnet
+
+    Addresses are handled as integers, the ipaddress objects
+    are only created when accessed
     """
     valid_statuses = ('reserved', 'active', 'deprecated')
 
     def __init__(self, name, network, vlan=None, mtu=None, shadow=False,
-                 status='active'):
+                 status='active', compact=False, count_only=False):
         """
         Subnet object initialization
 
         args:
             name: subnet name
-            network: Network address of the subnet
+            network: Network address of the subnet, as a string
+                     or an (address, prefixlen) tuple of integers
             vlan: optional vlan
+            compact: store hosts in a HostTable instead of a list
+            count_only: only count hosts, without storing them
         """
         self.name = name
         if status not in self.valid_statuses:
             raise ValueError('{0} is not a valid status'.format(status))
         self.status = status
-        self.hosts = []
+        self.compact = compact
+        self.count_only = count_only
+        self.host_count = 0
         self.vlan = vlan
         self.mtu = mtu
         self.shadow = shadow
-        self.network = self.Network(network, strict=False)
 
-        if self.network.prefixlen >= self.net_max_prefixlen - 1:
-            self.min_addr = self.network.network_address
-            self.max_addr = self.network.broadcast_address
+        if isinstance(network, tuple):
+            self.start, self.prefixlen = network
+            self._network = None
         else:
-            self.min_addr = self.network.network_address + 1
-            self.max_addr = self.network.broadcast_address - 1
+            self._network = self.Network(network, strict=False)
+            self.start = int(self._network.network_address)
+            self.prefixlen = self._network.prefixlen
+            if network != str(self._network):
+                print('warning: fixed {0} -> {1}'.format(network,
+                                                         self._network),
+                      file=sys.stderr)
+        self.end = self.start + (1 << (self.net_max_prefixlen
+                                       - self.prefixlen)) - 1
+
+        if self.prefixlen >= self.net_max_prefixlen - 1:
+            self._min_addr = self.start
+            self._max_addr = self.end
+        else:
+            self._min_addr = self.start + 1
+            self._max_addr = self.end - 1
 
-        self.cur_addr = self.min_addr
+        self._cur_addr = self._min_addr
 
-        if network != str(self.network):
-            print('warning: fixed {0} -> {1}'.format(network, self.network),
-                  file=sys.stderr)
+        if compact:
+            self.hosts = HostTable(self.start, self.Address,
+                                   self.offset_typecode)
+        else:
+            self.hosts = []
 
 #        if (self.ip_version == 6 and not shadow
-#            and 127 > self.network.prefixlen > 64):
+#            and 127 > self.prefixlen > 64):
 #            print('warning: use of ipv6 prefix length '
 #                  'larger than 64 ({0}: {1}) is discouraged '
-#                  '(except 127,128)'.format(name, self.network.prefixlen),
+#                  '(except 127,128)'.format(name, self.prefixlen),
 #                  file=sys.stderr)
 
-    def get_next_ip(self, prefixlen):
+    @property
+    def network(self):
+        if self._network is None:
+            self._network = self.Network((self.start, self.prefixlen))
+        return self._network
+
+    @property
+    def min_addr(self):
+        return self.Address(self._min_addr)
+
+    @property
+    def max_addr(self):
+        return self.Address(self._max_addr)
+
+    @property
+    def cur_addr(self):
+        return self.Address(self._cur_addr)
+
+    @cur_addr.setter
+    def cur_addr(self, address):
+        self._cur_addr = int(address)
+
+    def _next_ip(self, prefixlen):
         if not self.net_min_prefixlen < prefixlen < self.net_max_prefixlen:
             raise ConfigError('invalid padding prefixlen: {0}'
                               .format(prefixlen))
-        tmpnet = self.Network(u('{0}/{1}'.format(self.cur_addr, prefixlen)),
-                             strict=False)
-        return tmpnet.network_address + tmpnet.num_addresses + 1
+        mask = (1 << (self.net_max_prefixlen - prefixlen)) - 1
+        return (self._cur_addr | mask) + 2
+
+    def get_next_ip(self, prefixlen):
+        return self.Address(self._next_ip(prefixlen))
 
 
     def add_host(self, name, hostvars=None):
@@ -174,16 +583,16 @@ class Subnet(object):
         if self.shadow is True:
             raise ConfigError('cannot add host "{0}" to zero-sized subnet "{1}"'
                               .format(name, self.name))
-        addr = self.cur_addr
-        if addr not in self.network or addr > self.max_addr:
+        addr = self._cur_addr
+        if addr > self._max_addr:
             raise NetworkFull
-        self.cur_addr += 1
+        self._cur_addr += 1
         # check for special directives
         if name == '_':
             return None
-        match = re.match(r'^_/(\d+)$', name)
+        match = padding_re.match(name)
         if match:
-            self.cur_addr = self.get_next_ip(int(match.group(1)))
+            self._cur_addr = self._next_ip(int(match.group(1)))
             return None
 
         if name.startswith('?'):
@@ -195,10 +604,69 @@ class Subnet(object):
         else:
             status = 'active'
 
+        self.host_count += 1
+        if self.count_only:
+            return None
+        if self.compact:
+            return self.hosts.add(name, addr, status=status,
+                                  hostvars=hostvars)
         host = self.Host(name, addr, status=status, hostvars=hostvars)
         self.hosts.append(host)
         return host
 
+    def add_host_range(self, prefix='', start=1, count=0, width=0, suffix='',
+                       hostvars=None):
+        """
+        Adds count hosts at once, named prefix + number + suffix
+
+        Like in add_host, a "?" or "!" prefix sets the status of the hosts,
+        and a "_" or "_/N" prefix skips or pads count times
+
+        args:
+            prefix: start of the host names
+            start: number of the first host
+            count: number of hosts
+            width: minimum number of digits, zero-padded
+            suffix: end of the host names
+        """
+        if self.shadow is True:
+            raise ConfigError('cannot add host range "{0}" to zero-sized'
+                              ' subnet "{1}"'.format(prefix, self.name))
+        if count < 0:
+            raise ConfigError('invalid host range count: {0}'.format(count))
+        if padding_re.match(prefix):
+            for _ in range(count):
+                self.add_host(prefix)
+            return
+        addr = self._cur_addr
+        if addr + count - 1 > self._max_addr:
+            raise NetworkFull
+        self._cur_addr += count
+        if prefix == '_':
+            return
+
+        if prefix.startswith('?'):
+            status = 'reserved'
+            prefix = prefix[1:]
+        elif prefix.startswith('!'):
+            status = 'deprecated'
+            prefix = prefix[1:]
+        else:
+            status = 'active'
+
+        self.host_count += count
+        if self.count_only:
+            return
+        names = ['{0}{1:0{2}d}{3}'.format(prefix, number, width, suffix)
+                 for number in range(start, start + count)]
+        if self.compact:
+            self.hosts.extend(names, addr, status=status, hostvars=hostvars)
+            return
+        Host = self.Host
+        self.hosts.extend([Host(name, addr + index, status=status,
+                                hostvars=hostvars)
+                           for index, name in enumerate(names)])
+
 
     def __repr__(self):
         if self.vlan is not None:
@@ -211,19 +679,23 @@ class Subnet(object):
 class IPv4Subnet(Subnet):
 
     Network = IPv4Network
+    Address = IPv4Address
     Host = IPv4Host
     net_min_prefixlen = 0
     net_max_prefixlen = 32
     ip_version = 4
+    offset_typecode = 'I' if array('I').itemsize >= 4 else 'L'
 
 
 class IPv6Subnet(Subnet):
 
     Network = IPv6Network
+    Address = IPv6Address
     Host = IPv6Host
     net_min_prefixlen = 0
     net_max_prefixlen = 128
     ip_version = 6
+    offset_typecode = 'Q'
 
 
 class Zone(object):
@@ -231,17 +703,57 @@ class Zone(object):
     Object representing a Zone
     A Zone is associated to a VRF and contains subnets
     derived from a network address
+
+    The addresses of the subnets are chosen by the allocator of the zone,
+    one of the strategies of netgen.allocators
     """
 
-    def __init__(self, name, network, vrf=None):
+    def __init__(self, name, network, vrf=None, compact=False,
+                 count_only=False, allocator='sequential'):
         self.name = name
+        self.compact = compact
+        self.count_only = count_only
         self.network = self.Network(u(str(network)), strict=False)
         if network != str(self.network):
             print('warning: fixed {0} -> {1}'.format(network, self.network),
                   file=sys.stderr)
         self.vrf = vrf
-        self.cur_addr = self.network.network_address
+        self.start = int(self.network.network_address)
+        self.end = int(self.network.broadcast_address)
+        self.prefixlen = self.network.prefixlen
+        self._cur_addr = self.start
         self.subnets = []
+        if allocator not in allocators:
+            raise ConfigError('unknown allocator: {0}'.format(allocator))
+        self.allocator = allocators[allocator](self)
+
+    @property
+    def cur_addr(self):
+        return self.Address(self._cur_addr)
+
+    @cur_addr.setter
+    def cur_addr(self, address):
+        self._cur_addr = int(address)
+
+    def free_space(self):
+        """
+        Returns the free (start, end) integer intervals, in address order
+        """
+        return self.allocator.free_space()
+
+    def _next_subnet(self, prefixlen):
+        """
+        Rounds the current address up to the next boundary of prefixlen
+
+        args:
+            prefixlen: prefix length of the subnet
+        returns:
+            the subnet address, as an integer
+        """
+        if not self.net_min_prefixlen <= prefixlen <= self.net_max_prefixlen:
+            raise ConfigError('invalid prefixlen: {0}'.format(prefixlen))
+        mask = (1 << (self.net_max_prefixlen - prefixlen)) - 1
+        return (self._cur_addr + mask) & ~mask
 
     def get_next_subnet(self, prefixlen):
         """
@@ -252,16 +764,7 @@ class Zone(object):
         returns:
             a Network object
         """
-        try:
-            network = self.Network(u('{0}/{1}'.format(self.cur_addr, prefixlen)),
-                                   strict=True)
-        except ValueError:
-            net1 = self.Network(u('{0}/{1}'.format(self.cur_addr, prefixlen)),
-                                strict=False)
-            network = self.Network(u('{0}/{1}'.format(net1.network_address +
-                                                    net1.num_addresses,
-                                                    net1.prefixlen)))
-        return network
+        return self.Network((self._next_subnet(prefixlen), prefixlen))
 
     def add_subnet(self, name, prefixlen, vlan=None, align=None, mtu=None):
         """
@@ -286,8 +789,7 @@ class Zone(object):
 
         # align if asked
         if align is not None:
-            network = self.get_next_subnet(align)
-            self.cur_addr = network.network_address
+            self.allocator.align(align)
 
         # define status
         if name.startswith('?'):
@@ -304,36 +806,26 @@ class Zone(object):
             if name == '_':
                 return None
             elif align is not None:
-                network = self.get_next_subnet(align)
-                subnet = self.Subnet(name, u(str(network)), vlan,
-                                     mtu, shadow=True, status=status)
+                address = self.allocator.shadow(align)
+                subnet = self.Subnet(name, (address, align), vlan,
+                                     mtu, shadow=True, status=status,
+                                     compact=self.compact,
+                                     count_only=self.count_only)
                 self.subnets.append(subnet)
                 return subnet
             else:
                 raise ConfigError('zero-sized subnets must be named "_"')
 
-        # looking for next subnet address
-        network = self.get_next_subnet(prefixlen)
-
-        # checking is subnet fits
-        if (network.network_address < self.network.network_address or
-            network.broadcast_address > self.network.broadcast_address):
-                raise NetworkFull
-
-        # checking for unaligned subnets
-        if network.network_address > self.cur_addr:
-            raise UnalignedSubnet('unaligned subnet "{0}" ({1}, '
-                                  'should be {2})'
-                                  .format(name, network, self.cur_addr))
-
-        # shifting current address
-        self.cur_addr = network.network_address + network.num_addresses
+        address = self.allocator.allocate(name, prefixlen)
 
         if name == '_':
+            self.allocator.skip(address, prefixlen)
             return None
 
         # adding the subnet object
-        subnet = self.Subnet(name, u(str(network)), vlan, mtu)
+        subnet = self.Subnet(name, (address, prefixlen), vlan, mtu,
+                             compact=self.compact,
+                             count_only=self.count_only)
         self.subnets.append(subnet)
         return subnet
 
@@ -344,6 +836,7 @@ class Zone(object):
 class IPv4Zone(Zone):
 
     Network = IPv4Network
+    Address = IPv4Address
     Subnet = IPv4Subnet
     net_min_prefixlen = 0
     net_max_prefixlen = 32
@@ -352,6 +845,7 @@ class IPv4Zone(Zone):
 class IPv6Zone(Zone):
 
     Network = IPv6Network
+    Address = IPv6Address
     Subnet = IPv6Subnet
     net_min_prefixlen = 0
     net_max_prefixlen = 128
@@ -359,90 +853,243 @@ class IPv6Zone(Zone):
 
 class NetworkGenerator(object):
 
+    host_range_format = {
+        Optional('prefix'): Match(r'^([!?]?[A-Za-z0-9-]*|_(/\d+)?)$'),
+        Optional('suffix'): Match('^[A-Za-z0-9-]*$'),
+        Optional('start'): All(int, Range(min=0)),
+        Required('count'): All(int, Range(min=0)),
+        Optional('width'): All(int, Range(min=0)),
+        Optional('vars'): {str: Any(int, str, bool)},
+    }
+
+    subnet_format = {
+        Required('name'): Match('^([!?]?[A-Za-z0-9-]+|_)$'),
+        Required('size'): int,
+        Optional('vlan'): int,
+        Optional('align'): int,
+        Optional('mtu'): int,
+        Optional('hosts'): [
+            Any(Match(r'^([!?]?[A-Za-z0-9-]+|_(/\d+)?)$'),
+               {'name': Match(r'^([!?]?[A-Za-z0-9-]+|_(/\d+)?)$'),
+                Optional('vars'): {str: Any(int, str, bool)}},
+               {Required('range'): host_range_format})
+        ],
+    }
+
     topology_schema = Schema({
         Required('zone'): Match('^[A-Za-z0-9-]+$'),
         Required('network'): Any(lambda x: str(IPv4Network(u(str(x)))),
                                  lambda x: str(IPv6Network(u(str(x))))),
         Required('vrf'): Match('^[A-Za-z0-9-]+$'),
-        Required('subnets'): [{
-            Required('name'): Match('^([!?]?[A-Za-z0-9-]+|_)$'),
-            Required('size'): int,
-            Optional('vlan'): int,
-            Optional('align'): int,
-            Optional('mtu'): int,
-            Optional('hosts'): [
-                Any(Match('^([!?]?[A-Za-z0-9-]+|_(/\d+)?)$'),
-                   {'name': Match('^([!?]?[A-Za-z0-9-]+|_(/\d+)?)$'),
-                    Optional('vars'): {str: Any(int, str, bool)}})
-            ],
-        }]
+        Optional('allocator'): Any(*sorted(allocators)),
+        Required('subnets'): [subnet_format]
     })
 
-    def __init__(self, data, with_hosts=True):
+    subnet_schema = Schema(subnet_format)
+
+    topology_validator = TopologyValidator()
+
+    def __init__(self, data, with_hosts=True, compact=False, streaming=False,
+                 strict_schema=False, count_only=False):
         self.zones = []
         self.with_hosts = with_hosts
+        self.compact = compact
+        self.count_only = count_only
+        self.strict_schema = strict_schema
         if isinstance(data, Topology):
-            self.parse(data.data)
+            if streaming:
+                with timed('stream-topology', data.timing_context):
+                    self.parse_stream(data.stream())
+            else:
+                self.parse(data.data)
         else:
             self.parse(data)
 
+    def validate(self, data):
+        """
+        Validates a topology, with the voluptuous schema if strict_schema
+        is set or with the equivalent fast validator otherwise
+        """
+        if self.strict_schema:
+            return self.topology_schema(data)
+        return self.topology_validator(data)
+
     def parse(self, data):
-        data = self.topology_schema(data)
-        zone = self.add_zone(data['zone'], data['network'], data['vrf'])
+        context = {}
+        if isinstance(data, dict):
+            context = dict(zone=data.get('zone'), vrf=data.get('vrf'),
+                           network=data.get('network'))
+        with timed('validate', context):
+            data = self.validate(data)
+        with timed('allocate', dict(zone=data['zone'], vrf=data['vrf'],
+                                    network=data['network'])):
+            zone = self.add_zone(data['zone'], data['network'], data['vrf'],
+                                 data.get('allocator', 'sequential'))
+
+            for elt in data.get('subnets', []):
+                self.allocate_subnet(zone, elt, data)
+
+    def parse_stream(self, items):
+        """
+        Validates and allocates a topology incrementally, subnet by subnet
 
-        for elt in data.get('subnets', []):
-            try:
-                subnet = zone.add_subnet(elt['name'], elt['size'],
-                                         vlan=elt.get('vlan'),
-                                         align=elt.get('align'),
-                                         mtu=elt.get('mtu'))
-            except NetworkFull:
-                raise NetworkFull('network full while adding subnet "{0}" '
-                                  'to network {1} of zone "{2}"'
-                                  .format(elt['name'], data['network'],
-                                          data['zone']))
+        Unlike parse(), an allocation error can be reported before
+        a validation error in a following subnet
 
-            if not self.with_hosts:
+        args:
+            items: (key, value) pairs, as returned by Topology.stream()
+        """
+        header = {}
+        zone = data = None
+        pending = None
+        for key, value in items:
+            if key is None:
+                # not a mapping, let the schema report it
+                return self.parse(value)
+            if key != 'subnets' or not isinstance(value, GeneratorType):
+                if isinstance(value, GeneratorType):
+                    value = list(value)
+                header[key] = value
                 continue
+            if zone is None and all(key in header
+                                    for key in ('zone', 'network', 'vrf')):
+                data = self.validate_header(header, with_subnets=True)
+                zone = self.add_zone(data['zone'], data['network'],
+                                     data['vrf'],
+                                     data.get('allocator', 'sequential'))
+                for index, elt in enumerate(value):
+                    elt = self.validate_subnet(elt, index)
+                    self.allocate_subnet(zone, elt, data)
+            else:
+                # subnets before the zone definition, allocated at the end
+                pending = list(value)
+
+        data = self.validate_header(header, with_subnets=(zone is not None or
+                                                          pending is not None))
+        if zone is None:
+            zone = self.add_zone(data['zone'], data['network'], data['vrf'],
+                                 data.get('allocator', 'sequential'))
+        elif data.get('allocator', 'sequential') != zone.allocator.name:
+            # the subnets were allocated before reading the allocator
+            raise ConfigError('the allocator of zone "{0}" must be set'
+                              ' before its subnets'.format(data['zone']))
+        for index, elt in enumerate(pending or []):
+            elt = self.validate_subnet(elt, index)
+            self.allocate_subnet(zone, elt, data)
+
+    def validate_header(self, header, with_subnets):
+        """
+        Validates the top-level keys of a topology, except subnets
+        """
+        if with_subnets:
+            header = dict(header, subnets=[])
+        return self.validate(header)
+
+    def validate_subnet(self, elt, index):
+        """
+        Validates a single subnet of a topology
+
+        Errors are reported with the same path as when validating
+        the whole topology
+        """
+        if not self.strict_schema:
+            return self.topology_validator.validate_subnet(elt,
+                                                           ['subnets', index])
+        try:
+            return self.subnet_schema(elt)
+        except MultipleInvalid as exception:
+            exception.prepend(['subnets', index])
+            raise
+
+    def allocate_subnet(self, zone, elt, data):
+        """
+        Adds a validated subnet and its hosts to a zone
 
-            for host in elt.get('hosts', []):
-                if isinstance(host, dict):
-                    hostname = host['name']
-                    hostvars = host.get('vars')
-                else:
-                    hostname = host
-                    hostvars = None
+        args:
+            zone: the Zone object
+            elt: the subnet data
+            data: the topology data, used for error messages
+        """
+        try:
+            subnet = zone.add_subnet(elt['name'], elt['size'],
+                                     vlan=elt.get('vlan'),
+                                     align=elt.get('align'),
+                                     mtu=elt.get('mtu'))
+        except NetworkFull:
+            raise NetworkFull('network full while adding subnet "{0}" '
+                              'to network {1} of zone "{2}"'
+                              .format(elt['name'], data['network'],
+                                      data['zone']))
+
+        if not self.with_hosts:
+            return
+
+        for host in elt.get('hosts', []):
+            if isinstance(host, dict) and 'range' in host:
+                hostrange = dict(host['range'])
+                hostvars = hostrange.pop('vars', None)
                 try:
-                    subnet.add_host(hostname, hostvars=hostvars)
+                    subnet.add_host_range(hostvars=hostvars, **hostrange)
                 except NetworkFull:
-                    raise NetworkFull('network full while adding host "{0}" '
-                                      'to subnet "{1}" in network "{2}" '
-                                      'of zone "{3}"'
-                                      .format(hostname, elt['name'],
-                                              data['network'], data['zone']))
-
-    def add_zone(self, name, network, vrf=None):
-        zone = self.Zone(name, network, vrf)
+                    raise NetworkFull('network full while adding host range'
+                                      ' "{0}" to subnet "{1}" in network'
+                                      ' "{2}" of zone "{3}"'
+                                      .format(host_range_name(hostrange),
+                                              elt['name'], data['network'],
+                                              data['zone']))
+                continue
+            if isinstance(host, dict):
+                hostname = host['name']
+                hostvars = host.get('vars')
+            else:
+                hostname = host
+                hostvars = None
+            try:
+                subnet.add_host(hostname, hostvars=hostvars)
+            except NetworkFull:
+                raise NetworkFull('network full while adding host "{0}" '
+                                  'to subnet "{1}" in network "{2}" '
+                                  'of zone "{3}"'
+                                  .format(hostname, elt['name'],
+                                          data['network'], data['zone']))
+
+    def add_zone(self, name, network, vrf=None, allocator='sequential'):
+        zone = self.Zone(name, network, vrf, compact=self.compact,
+                         count_only=self.count_only, allocator=allocator)
         self.zones.append(zone)
         return zone
 
     def render(self, template, loader, params=None):
-        env = Environment(loader=loader, extensions=['jinja2.ext.do'])
-        TemplateUtils(self.ipversion).setup_environment(env)
+        env = get_environment('render', loader, self.ipversion)
         template = env.get_template('{0}.tpl'.format(template))
         return template.render(zones=self.zones,
                                ipv=self.ipversion,
                                params=(params or {}))
 
-    def stream(self, template, loader, output_file, params=None):
-        env = Environment(loader=loader,
-                          extensions=['jinja2.ext.do'],
-                          keep_trailing_newline=True)
-        TemplateUtils(self.ipversion).setup_environment(env)
-        template = env.get_template('{0}.tpl'.format(template))
-        template.stream(zones=self.zones,
-                        ipv=self.ipversion,
-                        params=(params or {})).dump(output_file)
+    def stream(self, template, loader, output_file, params=None,
+               native=True):
+        with timed('output', dict(template=template)):
+            env = get_environment('output', loader, self.ipversion)
+            name = '{0}.tpl'.format(template)
+            if native and template in emitters and is_bundled(env, name):
+                emitters[template](self.zones, self.ipversion,
+                                   (params or {}), output_file)
+                return
+            template = env.get_template(name)
+            template.stream(zones=self.zones,
+                            ipv=self.ipversion,
+                            params=(params or {})).dump(output_file)
+
+    def stream_outputs(self, outputs, loader, params=None, native=True):
+        """
+        Streams several templates from the same allocation
+
+        args:
+            outputs: (template, output file) pairs
+        """
+        for template, output_file in outputs:
+            self.stream(template, loader, output_file, params=params,
+                        native=native)
 
 
 class IPv4NetworkGenerator(NetworkGenerator):
@@ -0,0 +1,173 @@
+"""
+Network selection filters
+
+The --network and --in-network filters are stored in a binary prefix
+trie per ip version, so that checking a network costs one walk down its
+prefix bits, whatever the number of filters.
+"""
+from collections import namedtuple
+from ipaddress import IPv4Network, IPv6Network, ip_network
+from six import u, string_types
+
+# trie node flags
+EXACT = 1
+CONTAINS = 2
+
+
+class NetworkRecord(namedtuple('NetworkRecord',
+                               ['version', 'value', 'prefixlen'])):
+    """
+    A network parsed once, as integers
+    """
+    __slots__ = ()
+
+
+def parse_network(network):
+    """
+    Parses a network string or an ipaddress network
+
+    returns:
+        a NetworkRecord
+    raises:
+        ValueError: if network is not a valid network
+    """
+    if isinstance(network, string_types):
+        if ':' in network:
+            network = IPv6Network(u(network))
+        else:
+            network = IPv4Network(u(network))
+    elif not isinstance(network, (IPv4Network, IPv6Network)):
+        network = ip_network(network)
+    return NetworkRecord(network.version, int(network.network_address),
+                         network.prefixlen)
+
+
+class PrefixTrie(object):
+    """
+    Binary trie of the prefixes of one ip version, each node being
+    a [child 0, child 1, flags] list
+    """
+
+    def __init__(self, bits):
+        self.bits = bits
+        self.root = [None, None, 0]
+
+    def add(self, record, flag):
+        node = self.root
+        for shift in range(self.bits - 1, self.bits - 1 - record.prefixlen,
+                           -1):
+            bit = (record.value >> shift) & 1
+            if node[bit] is None:
+                node[bit] = [None, None, 0]
+            node = node[bit]
+        node[2] |= flag
+
+    def match(self, record):
+        """
+        returns:
+            EXACT if record was added with EXACT, ored with CONTAINS if it
+            is a subnet of a prefix added with CONTAINS
+        """
+        node = self.root
+        value = record.value
+        flags = node[2] & CONTAINS
+        for shift in range(self.bits - 1, self.bits - 1 - record.prefixlen,
+                           -1):
+            node = node[(value >> shift) & 1]
+            if node is None:
+                return flags
+            flags |= node[2] & CONTAINS
+        return flags | (node[2] & EXACT)
+
+
+class NetworkFilter(object):
+    """
+    Selects the networks of the zones
+
+    args:
+        vrfs: only select networks in these vrfs
+        networks: only select these networks
+        in_networks: only select networks contained in these networks
+        topologies: only select networks using these topologies
+        topology_patterns: only select networks whose topology matches
+                           one of these compiled regular expressions
+        ipversion: only select networks of this ip version
+    Filters left to None select everything.
+    """
+
+    def __init__(self, vrfs=None, networks=None, in_networks=None,
+                 topologies=None, topology_patterns=None, ipversion=None):
+        self.vrfs = set(vrfs) if vrfs else None
+        self.topologies = set(topologies) if topologies else None
+        self.topology_patterns = topology_patterns or None
+        self.ipversion = ipversion
+        self.required = 0
+        self.tries = {4: PrefixTrie(32), 6: PrefixTrie(128)}
+        if networks:
+            self.required |= EXACT
+            for network in networks:
+                record = parse_network(network)
+                self.tries[record.version].add(record, EXACT)
+        if in_networks:
+            self.required |= CONTAINS
+            for network in in_networks:
+                record = parse_network(network)
+                self.tries[record.version].add(record, CONTAINS)
+
+    @classmethod
+    def from_arguments(cls, args):
+        """
+        Creates the filter of the netgen command-line arguments
+        """
+        return cls(vrfs=args.vrf, networks=args.network,
+                   in_networks=args.in_network, topologies=args.topology,
+                   topology_patterns=args.match_topology,
+                   ipversion=4 if args.ipv4 else 6 if args.ipv6 else None)
+
+    def match_subzone(self, subzone):
+        """
+        Checks the vrf and topology of a zones.yaml entry
+        """
+        if self.vrfs is not None and subzone['vrf'] not in self.vrfs:
+            return False
+        topology = subzone['topology']
+        if self.topologies is not None and topology not in self.topologies:
+            return False
+        if self.topology_patterns is not None:
+            for regexp in self.topology_patterns:
+                if regexp.search(topology):
+                    break
+            else:
+                return False
+        return True
+
+    def match_network(self, record):
+        """
+        Checks the ip version and address of a NetworkRecord
+        """
+        if self.ipversion is not None and record.version != self.ipversion:
+            return False
+        if not self.required:
+            return True
+        flags = self.tries[record.version].match(record)
+        return flags & self.required == self.required
+
+    def select(self, zones, zone_names):
+        """
+        Applies the filters to the zones
+
+        returns:
+            a generator of (zone, subzone, network, ipversion) tuples,
+            in output order
+        """
+        for zone in zone_names:
+            for subzone in zones[zone]:
+                if not self.match_subzone(subzone):
+                    continue
+                networks = subzone['network']
+                if not isinstance(networks, (list, tuple)):
+                    networks = [networks]
+                for network in networks:
+                    record = parse_network(network)
+                    if self.match_network(record):
+                        yield (zone, subzone, network, record.version)
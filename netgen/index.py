@@ -0,0 +1,400 @@
+"""
+Address and name lookup index of an address plan
+
+The allocated zones, subnets and hosts are stored as sorted integer
+intervals, one set per vrf and ip version, so the owners of an address
+are found by bisection. Names are looked up in a hash map.
+The index is persisted as json and rebuilt when the data directory
+changes.
+"""
+from __future__ import print_function
+import argparse
+import json
+import os
+import sys
+import tempfile
+from bisect import bisect_right
+from ipaddress import ip_address, IPv4Address, IPv6Address
+from jinja2 import FileSystemLoader
+from six import u
+
+from .__main__ import (data_paths, load_zones, zones_cache_file,
+                       select_networks, allocate_network, error_message)
+from .cache import ResultCache, code_digest, topology_digest, replace
+from .engine import get_environment
+
+INDEX_VERSION = 1
+
+Addresses = {4: IPv4Address, 6: IPv6Address}
+
+
+class IntervalIndex(object):
+    """
+    Sorted integer intervals, which may be nested but not overlap
+
+    Each interval holds a record, a (kind, name, zone, prefixlen, vlan,
+    status) list
+    """
+
+    def __init__(self, starts, ends, records, parents=None):
+        self.starts = starts
+        self.ends = ends
+        self.records = records
+        if parents is None:
+            parents = self.nesting(starts, ends)
+        self.parents = parents
+
+    @classmethod
+    def build(cls, intervals):
+        """
+        args:
+            intervals: an iterable of (start, end, record)
+        """
+        intervals = sorted(intervals, key=lambda item: (item[0], -item[1]))
+        return cls([item[0] for item in intervals],
+                   [item[1] for item in intervals],
+                   [item[2] for item in intervals])
+
+    @staticmethod
+    def nesting(starts, ends):
+        """
+        Returns the index of the enclosing interval of each interval,
+        or -1 for top-level intervals
+        """
+        parents = []
+        stack = []
+        for start, end in zip(starts, ends):
+            while stack and ends[stack[-1]] < start:
+                stack.pop()
+            parents.append(stack[-1] if stack else -1)
+            stack.append(len(parents) - 1)
+        return parents
+
+    def find(self, address):
+        """
+        Returns the index of the innermost interval containing address,
+        or -1
+        """
+        index = bisect_right(self.starts, address) - 1
+        while index >= 0 and self.ends[index] < address:
+            index = self.parents[index]
+        return index
+
+    def chain(self, index):
+        """
+        Returns the indexes of an interval and of its enclosing intervals
+        """
+        indexes = []
+        while index >= 0:
+            indexes.append(index)
+            index = self.parents[index]
+        return indexes
+
+    def __len__(self):
+        return len(self.starts)
+
+
+class LookupIndex(object):
+    """
+    Lookup index of the zones, subnets and hosts of an address plan
+    """
+
+    def __init__(self, key=None):
+        self.key = key
+        self.intervals = {}
+        self.names = None
+        self._pending = {}
+
+    def add_network(self, ngen):
+        """
+        Adds the allocated zones of a NetworkGenerator
+        """
+        for zone in ngen.zones:
+            intervals = self._pending.setdefault(
+                (u('{0}').format(zone.vrf), ngen.ipversion), [])
+            intervals.append((zone.start, zone.end,
+                              ['zone', zone.name, zone.name, zone.prefixlen,
+                               None, None]))
+            for subnet in zone.subnets:
+                intervals.append((subnet.start, subnet.end,
+                                  ['subnet', subnet.name, zone.name,
+                                   subnet.prefixlen, subnet.vlan,
+                                   subnet.status]))
+                for host in subnet.hosts:
+                    intervals.append((host.addr, host.addr,
+                                      ['host', host.name, zone.name,
+                                       subnet.net_max_prefixlen, None,
+                                       host.status]))
+
+    def finalize(self):
+        """
+        Sorts the added networks, must be called before lookups
+        """
+        for key, intervals in self._pending.items():
+            self.intervals[key] = IntervalIndex.build(intervals)
+        self._pending = {}
+        self.names = None
+
+    def name_map(self):
+        """
+        Returns the map of names to (vrf, ipversion, index) tuples
+        """
+        if self.names is None:
+            names = {}
+            for key in sorted(self.intervals):
+                for index, record in enumerate(self.intervals[key].records):
+                    if record[0] != 'zone':
+                        names.setdefault(record[1], []).append(key + (index,))
+            self.names = names
+        return self.names
+
+    def lookup_address(self, address):
+        """
+        Finds the owners of an address in every vrf
+
+        returns:
+            a list of result dicts
+        """
+        address = ip_address(u(address))
+        results = []
+        for key in sorted(self.intervals):
+            vrf, ipversion = key
+            if ipversion != address.version:
+                continue
+            index = self.intervals[key].find(int(address))
+            if index >= 0:
+                results.append(self.result(key, index, int(address)))
+        return results
+
+    def lookup_name(self, name):
+        """
+        Finds the subnets and hosts with this name
+
+        returns:
+            a list of result dicts
+        """
+        return [self.result((vrf, ipversion), index)
+                for vrf, ipversion, index in self.name_map().get(name, [])]
+
+    def lookup(self, query):
+        try:
+            return self.lookup_address(query)
+        except ValueError:
+            return self.lookup_name(query)
+
+    def result(self, key, index, address=None):
+        """
+        Describes an interval and its enclosing intervals
+        """
+        vrf, ipversion = key
+        intervals = self.intervals[key]
+        Address = Addresses[ipversion]
+        if address is None:
+            address = intervals.starts[index]
+        result = {'vrf': vrf, 'ipv': ipversion,
+                  'address': str(Address(address))}
+        for position in intervals.chain(index):
+            kind, name, zone, prefixlen, vlan, status = \
+                intervals.records[position]
+            network = '{0}/{1}'.format(Address(intervals.starts[position]),
+                                       prefixlen)
+            result.setdefault('zone', zone)
+            if kind == 'zone':
+                result.setdefault('network', network)
+            elif kind == 'subnet':
+                if 'subnet' in result:
+                    # enclosing zero-sized subnet
+                    continue
+                result.update(subnet=name, subnet_network=network,
+                              vlan=vlan)
+                result.setdefault('status', status)
+            elif kind == 'host':
+                result.update(host=name, status=status)
+        return result
+
+    def dump(self, index_file):
+        data = {
+            'version': INDEX_VERSION,
+            'key': self.key,
+            'intervals': [[vrf, ipversion, intervals.starts, intervals.ends,
+                           intervals.parents, intervals.records]
+                          for (vrf, ipversion), intervals
+                          in sorted(self.intervals.items())],
+        }
+        json.dump(data, index_file, separators=(',', ':'))
+
+    @classmethod
+    def load(cls, index_file):
+        data = json.load(index_file)
+        if data.get('version') != INDEX_VERSION:
+            raise ValueError('unsupported index version')
+        index = cls(data['key'])
+        for vrf, ipversion, starts, ends, parents, records \
+                in data['intervals']:
+            index.intervals[(vrf, ipversion)] = IntervalIndex(
+                starts, ends, records, parents)
+        return index
+
+
+def index_key(zones, topology_dir):
+    """
+    Computes the key of the index of a data directory
+
+    returns:
+        the key, or None if a topology uses dynamic references
+    """
+    loader = FileSystemLoader(topology_dir)
+    digests = {}
+    for subzones in zones.values():
+        for subzone in subzones:
+            for ipversion in (4, 6):
+                name = subzone['topology']
+                env = get_environment('topology', loader, ipversion)
+                digest = topology_digest(env, name)
+                if digest is None:
+                    return None
+                digests['{0}/{1}'.format(ipversion, name)] = digest
+    return ResultCache.key(code_digest(), INDEX_VERSION, zones, digests)
+
+
+def build_index(zones, topology_dir, key=None):
+    """
+    Allocates all the networks of the zones and indexes them
+    """
+    args = argparse.Namespace(zone=sorted(zones), vrf=None, network=None,
+                              in_network=None, topology=None,
+                              match_topology=None, ipv4=False, ipv6=False)
+    loader = FileSystemLoader(topology_dir)
+    index = LookupIndex(key)
+    for unit in select_networks(args, zones):
+        index.add_network(allocate_network(loader, unit,
+                                           unit[1].get('params', {}),
+                                           compact=True))
+    index.finalize()
+    return index
+
+
+def open_index(data_dir, index_path, rebuild=False, cache_file=None):
+    """
+    Loads the persisted index, or builds and saves it if it is missing
+    or out of date
+
+    args:
+        cache_file: the zones cache, see load_zones
+    """
+    zones_file, topology_dir, output_dirs = data_paths(data_dir)
+    zones = load_zones(zones_file, cache_file=cache_file)
+    key = index_key(zones, topology_dir)
+    if not rebuild and key is not None:
+        try:
+            with open(index_path, 'r') as index_fd:
+                index = LookupIndex.load(index_fd)
+            if index.key == key:
+                return index
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            pass
+    index = build_index(zones, topology_dir, key)
+    if key is not None:
+        save_index(index, index_path)
+    return index
+
+
+def save_index(index, index_path):
+    directory = os.path.dirname(os.path.abspath(index_path))
+    temp_fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(temp_fd, 'w') as index_fd:
+            index.dump(index_fd)
+        replace(temp_path, index_path)
+    except Exception:
+        try:
+            os.unlink(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+def format_result(result):
+    lines = ['zone: {0} ({1})'.format(result['zone'], result['network']),
+             'vrf: {0}'.format(result['vrf'])]
+    if 'subnet' in result:
+        lines.append('subnet: {0} ({1})'.format(result['subnet'],
+                                                result['subnet_network']))
+        if result['vlan'] is not None:
+            lines.append('vlan: {0}'.format(result['vlan']))
+    if 'host' in result:
+        lines.append('host: {0}'.format(result['host']))
+    lines.append('address: {0}'.format(result['address']))
+    if result.get('status') is not None:
+        lines.append('status: {0}'.format(result['status']))
+    return '\n'.join(lines)
+
+
+def parse_arguments(arguments):
+    parser = argparse.ArgumentParser(
+        prog='netgen lookup',
+        description='find the owner of an address or the address of a name')
+    parser.add_argument('query', metavar='ADDRESS|NAME', nargs='+',
+                        help='address or subnet/host name to look up')
+    parser.add_argument('--data', '-d', metavar='DIR', type=str,
+                        default=os.environ.get('NETGEN_DATA_DIR', '.'),
+                        help='the data directory (default: .)')
+    parser.add_argument('--index', '-i', metavar='FILE', type=str,
+                        default=None,
+                        help='the index file (default: DIR/.netgen-index.json)')
+    parser.add_argument('--rebuild', action='store_true', default=False,
+                        help='rebuild the index even if it is up to date')
+    parser.add_argument('--zones-cache', metavar='DIR', type=str,
+                        default=os.environ.get('NETGEN_ZONES_CACHE'),
+                        help=('store the parsed zone file in this directory'
+                              ' (default: $XDG_CACHE_HOME/netgen or'
+                              ' ~/.cache/netgen)'))
+    parser.add_argument('--no-zones-cache', action='store_true',
+                        default=False,
+                        help='always parse the zone file')
+    parser.add_argument('--zone', '-z', metavar='ZONE', type=str,
+                        action='append', default=None,
+                        help='only output results in this zone')
+    parser.add_argument('--vrf', '-v', metavar='VRF', type=str,
+                        action='append', default=None,
+                        help='only output results in this vrf')
+    parser.add_argument('--json', action='store_true', default=False,
+                        help='output the results as json')
+    parser.add_argument('--debug', action='store_true', default=False,
+                        help='don\'t catch exceptions')
+    return parser.parse_args(arguments)
+
+
+def main(arguments=None):
+    args = parse_arguments(arguments)
+    index_path = args.index or os.path.join(args.data, '.netgen-index.json')
+
+    try:
+        index = open_index(args.data, index_path, rebuild=args.rebuild,
+                           cache_file=zones_cache_file(args, args.data))
+    except Exception as exception:
+        message = error_message(exception)
+        if message is None or args.debug:
+            raise
+        sys.exit(message)
+
+    found = True
+    results = []
+    for query in args.query:
+        matches = [result for result in index.lookup(query)
+                   if (not args.zone or result['zone'] in args.zone) and
+                   (not args.vrf or result['vrf'] in args.vrf)]
+        if not matches:
+            print('not found: {0}'.format(query), file=sys.stderr)
+            found = False
+        for result in matches:
+            result['query'] = query
+            results.append(result)
+
+    if args.json:
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+    else:
+        print('\n\n'.join(format_result(result) for result in results))
+    if not found:
+        sys.exit(1)
@@ -0,0 +1,539 @@
+"""
+Binary address plan files
+
+A plan file stores allocated zones, subnets and hosts as fixed-width
+little-endian records, so that PlanFile can memory-map it and read any
+record without loading the rest. Names, vrfs and hostvars are interned
+in a string table.
+
+Layout:
+    header: magic, version, record counts and section offsets
+    zones: one ZONE record per zone, referencing its subnets range
+    subnets: one SUBNET record per subnet, referencing its hosts range
+    hosts: one HOST record per host
+    names: subnet and host references sorted by name
+    string offsets: count + 1 offsets into the string data
+    string data: utf-8 strings
+
+Addresses are stored as (high, low) 64 bit halves. Subnets are stored
+in allocation order, so are the hosts of a subnet: both are sorted by
+address within their zone or subnet.
+"""
+import bisect
+import json
+import mmap
+import os
+import struct
+import tempfile
+from collections import namedtuple
+from io import BytesIO
+from ipaddress import IPv4Address, IPv6Address, IPv4Network, IPv6Network
+
+from .cache import replace
+
+MAGIC = b'NGPLAN\0\0'
+PLAN_VERSION = 1
+
+# magic, version, zones, subnets, hosts, strings, then the offsets of the
+# zones, subnets, hosts, names, string offsets and string data sections
+HEADER = struct.Struct('<8sIIIQIQQQQQQ')
+# name, vrf, ipversion, prefixlen, start, first subnet, subnet count
+ZONE = struct.Struct('<IIBB2xQQII')
+# name, zone, prefixlen, status, shadow, vlan, mtu, start, first host,
+# host count, enclosing (shadow) subnet
+SUBNET = struct.Struct('<IIBBBxiiQQQII')
+# name, status, hostvars, address
+HOST = struct.Struct('<IB3xIQQ')
+NAME = struct.Struct('<Q')
+OFFSET = struct.Struct('<Q')
+
+NONE = 0xffffffff
+NO_VALUE = -1
+MASK64 = (1 << 64) - 1
+# names section entries referencing subnets have this bit set
+SUBNET_NAME = 1 << 63
+
+STATUSES = ('reserved', 'active', 'deprecated')
+
+Addresses = {4: IPv4Address, 6: IPv6Address}
+Networks = {4: IPv4Network, 6: IPv6Network}
+
+PlanZone = namedtuple('PlanZone', ['index', 'name', 'vrf', 'ipversion',
+                                   'network', 'subnets'])
+PlanSubnet = namedtuple('PlanSubnet', ['index', 'name', 'zone', 'network',
+                                       'status', 'shadow', 'vlan', 'mtu',
+                                       'hosts'])
+PlanHost = namedtuple('PlanHost', ['index', 'name', 'subnet', 'address',
+                                   'status', 'vars'])
+
+
+def network_records(zones, ipversion):
+    """
+    Returns the allocated zones of a network as json-serializable lists,
+    the format of the lines read by PlanCollector
+    """
+    return [[zone.name, zone.vrf, ipversion, zone.start, zone.prefixlen,
+             [[subnet.name, subnet.start, subnet.prefixlen,
+               STATUSES.index(subnet.status), subnet.shadow, subnet.vlan,
+               subnet.mtu,
+               [[host.name, host.addr, STATUSES.index(host.status),
+                 host.vars or None]
+                for host in subnet.hosts]]
+              for subnet in zone.subnets]]
+            for zone in zones]
+
+
+def write_network(zones, ipversion, output_file):
+    """
+    Writes the allocated zones of a network as a json line
+    """
+    output_file.write(json.dumps(network_records(zones, ipversion),
+                                 separators=(',', ':')))
+    output_file.write('\n')
+
+
+class PlanCollector(object):
+    """
+    File-like object feeding the lines written by write_network
+    to a PlanWriter
+
+    Like StatsCollector, this lets netgen --write-plan go through the
+    regular output path, the result cache and the worker processes
+    """
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.buffer = ''
+
+    def write(self, data):
+        lines = (self.buffer + data).split('\n')
+        self.buffer = lines.pop()
+        for line in lines:
+            if line:
+                for zone in json.loads(line):
+                    self.writer.add_zone(*zone)
+
+    def flush(self):
+        pass
+
+
+class PlanWriter(object):
+    """
+    Accumulates zones and writes them as a plan file
+    """
+
+    def __init__(self):
+        self.strings = {}
+        self.zones = bytearray()
+        self.subnets = bytearray()
+        self.hosts = bytearray()
+        self.zone_count = 0
+        self.subnet_count = 0
+        self.host_count = 0
+        # (name, names section entry)
+        self.names = []
+
+    def intern(self, string):
+        if string is None:
+            return NONE
+        index = self.strings.get(string)
+        if index is None:
+            index = self.strings[string] = len(self.strings)
+        return index
+
+    def add_zone(self, name, vrf, ipversion, start, prefixlen, subnets):
+        """
+        Adds a zone, as found in a network_records list
+        """
+        self.zones += ZONE.pack(self.intern(name),
+                                self.intern(None if vrf is None
+                                            else u'{0}'.format(vrf)),
+                                ipversion, prefixlen, start >> 64,
+                                start & MASK64, self.subnet_count,
+                                len(subnets))
+        zone_index = self.zone_count
+        self.zone_count += 1
+        bits = 32 if ipversion == 4 else 128
+        # address order, enclosing subnets first, whatever the allocator
+        subnets = sorted(subnets, key=lambda subnet: (subnet[1], subnet[2]))
+        # (end, index) of the subnets enclosing the current one
+        stack = []
+        for (subnet_name, subnet_start, subnet_prefixlen, status, shadow,
+             vlan, mtu, hosts) in subnets:
+            while stack and stack[-1][0] < subnet_start:
+                stack.pop()
+            self.names.append((subnet_name,
+                               SUBNET_NAME | self.subnet_count))
+            self.subnets += SUBNET.pack(
+                self.intern(subnet_name), zone_index, subnet_prefixlen,
+                status, shadow, NO_VALUE if vlan is None else vlan,
+                NO_VALUE if mtu is None else mtu, subnet_start >> 64,
+                subnet_start & MASK64, self.host_count, len(hosts),
+                stack[-1][1] if stack else NONE)
+            stack.append((subnet_start + (1 << (bits - subnet_prefixlen)) - 1,
+                          self.subnet_count))
+            self.subnet_count += 1
+            for host_name, address, host_status, hostvars in hosts:
+                self.names.append((host_name, self.host_count))
+                self.hosts += HOST.pack(
+                    self.intern(host_name), host_status,
+                    NONE if not hostvars else
+                    self.intern(json.dumps(hostvars, sort_keys=True)),
+                    address >> 64, address & MASK64)
+                self.host_count += 1
+
+    def dump(self, plan_file):
+        """
+        Writes the plan to a binary file object
+        """
+        strings = sorted(self.strings, key=self.strings.get)
+        data = [string.encode('utf-8') for string in strings]
+        names = bytearray()
+        for name, entry in sorted(self.names,
+                                  key=lambda item: item[0].encode('utf-8')):
+            names += NAME.pack(entry)
+        offsets = bytearray()
+        position = 0
+        for item in data:
+            offsets += OFFSET.pack(position)
+            position += len(item)
+        offsets += OFFSET.pack(position)
+
+        sections = [self.zones, self.subnets, self.hosts, names, offsets]
+        section_offsets = []
+        position = HEADER.size
+        for section in sections:
+            section_offsets.append(position)
+            position += len(section)
+        section_offsets.append(position)
+
+        plan_file.write(HEADER.pack(MAGIC, PLAN_VERSION, self.zone_count,
+                                    self.subnet_count, self.host_count,
+                                    len(data), *section_offsets))
+        for section in sections:
+            plan_file.write(section)
+        for item in data:
+            plan_file.write(item)
+
+    def getvalue(self):
+        """
+        Returns the plan as bytes
+        """
+        plan_file = BytesIO()
+        self.dump(plan_file)
+        return plan_file.getvalue()
+
+    def save(self, path):
+        directory = os.path.dirname(os.path.abspath(path))
+        temp_fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+        try:
+            with os.fdopen(temp_fd, 'wb') as plan_fd:
+                self.dump(plan_fd)
+            replace(temp_path, path)
+        except Exception:
+            try:
+                os.unlink(temp_path)
+            except OSError:
+                pass
+            raise
+
+
+class PlanFile(object):
+    """
+    Memory-mapped plan file reader
+
+    Records are decoded on access, opening a plan only reads its header
+    """
+
+    def __init__(self, path, data=None):
+        """
+        args:
+            data: read the plan from this buffer instead of mapping path
+        """
+        if data is None:
+            with open(path, 'rb') as plan_fd:
+                data = mmap.mmap(plan_fd.fileno(), 0,
+                                 access=mmap.ACCESS_READ)
+        self.data = data
+        try:
+            header = HEADER.unpack_from(self.data, 0)
+        except struct.error:
+            self.close()
+            raise ValueError('{0}: not a plan file'.format(path))
+        if header[0] != MAGIC:
+            self.close()
+            raise ValueError('{0}: not a plan file'.format(path))
+        if header[1] != PLAN_VERSION:
+            self.close()
+            raise ValueError('{0}: unsupported plan version {1}'
+                             .format(path, header[1]))
+        (self.zone_count, self.subnet_count, self.host_count,
+         self.string_count) = header[2:6]
+        (self.zones_offset, self.subnets_offset, self.hosts_offset,
+         self.names_offset, self.offsets_offset,
+         self.strings_offset) = header[6:]
+        self._zone_names = None
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def string(self, index):
+        if index == NONE:
+            return None
+        start, end = struct.unpack_from('<QQ', self.data,
+                                        self.offsets_offset +
+                                        index * OFFSET.size)
+        return self.data[self.strings_offset + start:
+                         self.strings_offset + end].decode('utf-8')
+
+    def _check(self, index, count):
+        if not 0 <= index < count:
+            raise IndexError('record index out of range')
+
+    def zone(self, index):
+        self._check(index, self.zone_count)
+        (name, vrf, ipversion, prefixlen, high, low, first,
+         count) = ZONE.unpack_from(self.data, self.zones_offset +
+                                   index * ZONE.size)
+        return PlanZone(index, self.string(name), self.string(vrf), ipversion,
+                        Networks[ipversion](((high << 64) | low, prefixlen)),
+                        range(first, first + count))
+
+    def subnet(self, index):
+        self._check(index, self.subnet_count)
+        (name, zone, prefixlen, status, shadow, vlan, mtu, high, low, first,
+         count, parent) = SUBNET.unpack_from(self.data, self.subnets_offset +
+                                     index * SUBNET.size)
+        ipversion = self._zone_ipversion(zone)
+        return PlanSubnet(index, self.string(name), zone,
+                          Networks[ipversion](((high << 64) | low,
+                                               prefixlen)),
+                          STATUSES[status], bool(shadow),
+                          None if vlan == NO_VALUE else vlan,
+                          None if mtu == NO_VALUE else mtu,
+                          range(first, first + count))
+
+    def host(self, index, subnet=None):
+        """
+        args:
+            subnet: the index of the subnet of the host, found by
+                    bisection if not given
+        """
+        self._check(index, self.host_count)
+        name, status, hostvars, high, low = HOST.unpack_from(
+            self.data, self.hosts_offset + index * HOST.size)
+        if subnet is None:
+            subnet = self._host_subnet(index)
+        zone = self._subnet_zone(subnet)
+        hostvars = self.string(hostvars)
+        return PlanHost(index, self.string(name), subnet,
+                        Addresses[self._zone_ipversion(zone)](
+                            (high << 64) | low),
+                        STATUSES[status],
+                        json.loads(hostvars) if hostvars else {})
+
+    def rows(self, record):
+        """
+        Iterates over the raw tuples of all the ZONE, SUBNET or HOST
+        records, without building the ipaddress objects
+        """
+        offset, count = {
+            ZONE: (self.zones_offset, self.zone_count),
+            SUBNET: (self.subnets_offset, self.subnet_count),
+            HOST: (self.hosts_offset, self.host_count),
+        }[record]
+        return record.iter_unpack(self.data[offset:
+                                            offset + count * record.size])
+
+    def string_table(self):
+        """
+        Returns all the strings, decoded
+        """
+        offsets = [offset for offset, in OFFSET.iter_unpack(
+            self.data[self.offsets_offset:self.strings_offset])]
+        data = self.data[self.strings_offset:
+                         self.strings_offset + offsets[-1]]
+        return [data[start:end].decode('utf-8')
+                for start, end in zip(offsets, offsets[1:])]
+
+    def zones(self):
+        for index in range(self.zone_count):
+            yield self.zone(index)
+
+    def subnets(self, zone):
+        """
+        Returns the subnets of a zone
+        """
+        return [self.subnet(index) for index in zone.subnets]
+
+    def hosts(self, subnet):
+        """
+        Returns the hosts of a subnet
+        """
+        return [self.host(index, subnet.index) for index in subnet.hosts]
+
+    def find_zones(self, name):
+        """
+        Returns the zones with this name, one per network
+        """
+        if self._zone_names is None:
+            zone_names = {}
+            for index in range(self.zone_count):
+                name_index = ZONE.unpack_from(
+                    self.data, self.zones_offset + index * ZONE.size)[0]
+                zone_names.setdefault(self.string(name_index),
+                                      []).append(index)
+            self._zone_names = zone_names
+        return [self.zone(index) for index in self._zone_names.get(name, [])]
+
+    def lookup_name(self, name):
+        """
+        Returns the subnets and hosts with this name
+        """
+        key = name.encode('utf-8')
+        low, high = 0, self.subnet_count + self.host_count
+        while low < high:
+            middle = (low + high) // 2
+            if self._name_key(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        results = []
+        while (low < self.subnet_count + self.host_count and
+               self._name_key(low) == key):
+            entry = self._name_entry(low)
+            if entry & SUBNET_NAME:
+                results.append(self.subnet(entry & ~SUBNET_NAME))
+            else:
+                results.append(self.host(entry))
+            low += 1
+        return results
+
+    def lookup_address(self, address, vrf=None):
+        """
+        Returns the innermost zone, subnet or host containing an address,
+        for each zone containing it
+
+        args:
+            address: an ipaddress address or a string
+            vrf: only look in the zones of this vrf
+        """
+        if not isinstance(address, (IPv4Address, IPv6Address)):
+            text = u'{0}'.format(address)
+            address = (IPv6Address if ':' in text else IPv4Address)(text)
+        value = int(address)
+        results = []
+        for zone_index in range(self.zone_count):
+            (name, zone_vrf, ipversion, prefixlen, high, low, first,
+             count) = ZONE.unpack_from(self.data, self.zones_offset +
+                                       zone_index * ZONE.size)
+            start = (high << 64) | low
+            bits = 32 if ipversion == 4 else 128
+            if (ipversion != address.version or
+                    not start <= value < start + (1 << (bits - prefixlen))):
+                continue
+            if vrf is not None and self.string(zone_vrf) != vrf:
+                continue
+            results.append(self._lookup_in_zone(zone_index, first, count,
+                                                value, bits))
+        return results
+
+    def _lookup_in_zone(self, zone_index, first, count, value, bits):
+        index = bisect.bisect_right(_Starts(self, SUBNET, self.subnets_offset,
+                                            first, count), value) - 1
+        if index < 0:
+            return self.zone(zone_index)
+        subnet_index = first + index
+        # shadow subnets can enclose the following subnets
+        while True:
+            subnet = SUBNET.unpack_from(self.data, self.subnets_offset +
+                                        subnet_index * SUBNET.size)
+            start = (subnet[7] << 64) | subnet[8]
+            if value < start + (1 << (bits - subnet[2])):
+                break
+            subnet_index = subnet[11]
+            if subnet_index == NONE:
+                return self.zone(zone_index)
+        host_first, host_count = subnet[9], subnet[10]
+        host = bisect.bisect_left(_Starts(self, HOST, self.hosts_offset,
+                                          host_first, host_count), value)
+        if host < host_count:
+            host_record = HOST.unpack_from(self.data, self.hosts_offset +
+                                           (host_first + host) * HOST.size)
+            if (host_record[3] << 64) | host_record[4] == value:
+                return self.host(host_first + host, subnet_index)
+        return self.subnet(subnet_index)
+
+    def _zone_ipversion(self, zone):
+        return struct.unpack_from('<B', self.data, self.zones_offset +
+                                  zone * ZONE.size + 8)[0]
+
+    def _subnet_zone(self, subnet):
+        return struct.unpack_from('<I', self.data, self.subnets_offset +
+                                  subnet * SUBNET.size + 4)[0]
+
+    def _host_subnet(self, host):
+        """
+        Finds the subnet holding a host, subnets being stored in
+        the order of their hosts
+        """
+        low, high = 0, self.subnet_count
+        while low < high:
+            middle = (low + high) // 2
+            first, count = struct.unpack_from(
+                '<QI', self.data, self.subnets_offset +
+                middle * SUBNET.size + 36)
+            if first + count <= host:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _name_entry(self, position):
+        return NAME.unpack_from(self.data, self.names_offset +
+                                position * NAME.size)[0]
+
+    def _name_key(self, position):
+        entry = self._name_entry(position)
+        if entry & SUBNET_NAME:
+            offset = (self.subnets_offset +
+                      (entry & ~SUBNET_NAME) * SUBNET.size)
+        else:
+            offset = self.hosts_offset + entry * HOST.size
+        index = struct.unpack_from('<I', self.data, offset)[0]
+        start, end = struct.unpack_from('<QQ', self.data,
+                                        self.offsets_offset +
+                                        index * OFFSET.size)
+        return self.data[self.strings_offset + start:
+                         self.strings_offset + end]
+
+
+class _Starts(object):
+    """
+    Sequence of the start addresses of a range of records, for bisect
+    """
+
+    def __init__(self, plan, record, offset, first, count):
+        self.data = plan.data
+        self.record = record
+        self.offset = offset
+        self.first = first
+        self.count = count
+        # position of the (high, low) address in the record
+        self.address = record.size - 16 if record is HOST else 20
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        high, low = struct.unpack_from(
+            '<QQ', self.data, self.offset +
+            (self.first + index) * self.record.size + self.address)
+        return (high << 64) | low
@@ -0,0 +1,136 @@
+"""
+Python topology providers
+
+A topology can be generated by python code instead of a jinja template:
+either a NAME.py file in the topology directory defining a topology()
+function, or a callable registered under NAME in the "netgen.topologies"
+entry point group. Jinja templates (NAME.yaml) take precedence.
+
+The provider is called with the template context as keyword arguments
+(zone, vrf, network, params and ipv) and returns the topology data as
+a dict, or returns or yields the list of subnets.
+
+The code of a provider may read files or import modules netgen does not
+know about, so its results are only cached (--result-cache, lookup index)
+if a NAME.py file lists the files it depends on, relative to the
+topology directory, in a module-level "dependencies" list. They are then
+hashed with its source. Entry points are never cached.
+"""
+import hashlib
+import types
+
+from jinja2.exceptions import TemplateNotFound
+
+from .exception import ConfigError
+
+ENTRY_POINT_GROUP = 'netgen.topologies'
+
+# (loader, name) -> (provider, uptodate)
+_providers = {}
+
+
+def provider_filename(name):
+    return '{0}.py'.format(name)
+
+
+def load_file_provider(env, name):
+    """
+    Loads the topology() function of a NAME.py file found by the jinja
+    loader of env
+
+    returns:
+        the function, or None if there is no such file
+    """
+    key = (env.loader, name)
+    cached = _providers.get(key)
+    if cached is not None and cached[1] is not None and cached[1]():
+        return cached[0]
+    try:
+        source, filename, uptodate = env.loader.get_source(
+            env, provider_filename(name))
+    except TemplateNotFound:
+        return None
+    filename = filename or provider_filename(name)
+    module = types.ModuleType('netgen.topologies.{0}'.format(name))
+    module.__file__ = filename
+    exec(compile(source, filename, 'exec'), module.__dict__)
+    provider = module.__dict__.get('topology')
+    if not callable(provider):
+        raise ConfigError('{0} does not define a topology() function'
+                          .format(provider_filename(name)))
+    _providers[key] = (provider, uptodate)
+    return provider
+
+
+def find_entry_point(name):
+    """
+    returns:
+        the entry point named name in the netgen.topologies group, or None
+    """
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:
+        try:
+            import pkg_resources
+        except ImportError:
+            return None
+        for entry_point in pkg_resources.iter_entry_points(ENTRY_POINT_GROUP,
+                                                           name):
+            return entry_point
+        return None
+    entry_points = entry_points()
+    if hasattr(entry_points, 'select'):
+        entry_points = entry_points.select(group=ENTRY_POINT_GROUP)
+    else:
+        entry_points = entry_points.get(ENTRY_POINT_GROUP, ())
+    for entry_point in entry_points:
+        if entry_point.name == name:
+            return entry_point
+    return None
+
+
+def find_provider(env, name):
+    """
+    Finds the python provider of a topology
+
+    returns:
+        a (provider, description) tuple, or None if there is no provider
+    """
+    provider = load_file_provider(env, name)
+    if provider is not None:
+        return provider, provider_filename(name)
+    entry_point = find_entry_point(name)
+    if entry_point is not None:
+        return entry_point.load(), '{0}:{1}'.format(ENTRY_POINT_GROUP, name)
+    return None
+
+
+def provider_digest(env, name):
+    """
+    Returns the digest of the source of a NAME.py provider and of its
+    dependencies, used as the result cache key of its topology
+
+    returns:
+        the hex digest, or None for entry points and providers without
+        dependencies list, whose inputs are unknown
+    raises:
+        TemplateNotFound: if there is no provider
+        ConfigError: if a dependency can't be read
+    """
+    provider = load_file_provider(env, name)
+    if provider is None:
+        if find_entry_point(name) is None:
+            raise TemplateNotFound('{0}.yaml'.format(name))
+        return None
+    dependencies = provider.__globals__.get('dependencies')
+    if dependencies is None:
+        return None
+    digest = hashlib.sha256()
+    for filename in [provider_filename(name)] + list(dependencies):
+        try:
+            source = env.loader.get_source(env, filename)[0]
+        except TemplateNotFound:
+            raise ConfigError('{0}: dependency {1} not found'
+                              .format(provider_filename(name), filename))
+        digest.update(hashlib.sha256(source.encode('utf-8')).digest())
+    return digest.hexdigest()
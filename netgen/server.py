@@ -0,0 +1,330 @@
+"""
+Long-running netgen server
+
+Loads the data directory once and answers render requests sent by
+netgen-client over a unix socket or a localhost tcp socket, so repeated
+calls don't pay for interpreter startup, zone file parsing and template
+compilation.
+
+The protocol is line based: the client sends a json object with the
+command-line arguments, the server answers with a json object holding
+the exit status, the output and the error message.
+"""
+from __future__ import print_function
+import argparse
+import json
+import os
+import socket
+import stat
+import sys
+import threading
+import traceback
+from jinja2 import FileSystemLoader
+from six import StringIO
+from six.moves import socketserver
+
+from .__main__ import (argument_parser, parse_arguments, data_paths,
+                       load_zones, generate)
+from .cache import MemoryCache
+from .engine import set_template_cache
+
+
+def default_socket(data_dir):
+    return os.environ.get('NETGEN_SOCKET',
+                          os.path.join(data_dir, '.netgen.sock'))
+
+
+class Capture(StringIO):
+    """
+    Output buffer standing for the stdout of the client
+    """
+
+    def __init__(self, tty=False):
+        StringIO.__init__(self)
+        self.tty = tty
+
+    def isatty(self):
+        return self.tty
+
+
+class DataDirectory(object):
+    """
+    Loaded state of a data directory, refreshed when its files change
+
+    The loaders are kept between requests, so compiled templates are
+    reused until their source changes, and the result keys of the
+    networks only change when their zone, topology or output changes.
+    """
+
+    def __init__(self, path, debug=False):
+        self.path = os.path.abspath(path)
+        self.debug = debug
+        self.snapshot = {}
+        self.zones = None
+        self.topology_dir = None
+        self.output_dirs = None
+        self.refresh()
+
+    def scan(self):
+        """
+        Returns the (mtime, size) of the files in the data directory
+        used for generation
+        """
+        files = {}
+        paths = [os.path.join(self.path, 'zones.yaml')]
+        for directory in ('topology', 'output'):
+            for root, dirnames, filenames in os.walk(
+                    os.path.join(self.path, directory)):
+                paths.append(root)
+                paths.extend([os.path.join(root, name)
+                              for name in filenames])
+        for path in paths:
+            try:
+                info = os.stat(path)
+            except OSError:
+                continue
+            files[path] = (info.st_mtime, info.st_size)
+        return files
+
+    def refresh(self):
+        """
+        Reloads what changed since the last call
+
+        returns:
+            the sorted list of changed paths
+        """
+        snapshot = self.scan()
+        changed = sorted(path for path in set(snapshot) | set(self.snapshot)
+                         if snapshot.get(path) != self.snapshot.get(path))
+        if not changed:
+            return changed
+        self.snapshot = snapshot
+        zones_file, topology_dir, output_dirs = data_paths(self.path)
+        if self.zones is None or zones_file in changed:
+            self.zones = load_zones(zones_file, debug=self.debug)
+        if topology_dir != self.topology_dir:
+            self.topology_dir = topology_dir
+            self.topo_loader = FileSystemLoader(topology_dir)
+        if output_dirs != self.output_dirs:
+            self.output_dirs = output_dirs
+            self.output_loader = FileSystemLoader(output_dirs)
+        return changed
+
+
+class Server(object):
+    """
+    Answers render requests using a loaded data directory
+    """
+
+    def __init__(self, data, cache_size=None, interval=2.0):
+        """
+        args:
+            data: the DataDirectory
+            cache_size: maximum size of the in-memory results
+            interval: seconds between checks for changed files
+        """
+        self.data = data
+        self.cache = MemoryCache(cache_size)
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+
+    def handle(self, arguments, tty=False):
+        """
+        Runs a netgen command line
+
+        returns:
+            a (status, output, error message) tuple
+        """
+        stdout, stderr = sys.stdout, sys.stderr
+        output = Capture(tty)
+        errors = StringIO()
+        status, message = 0, None
+        with self.lock:
+            sys.stdout, sys.stderr = output, errors
+            try:
+                self.generate(arguments, output)
+            except SystemExit as exception:
+                if isinstance(exception.code, int):
+                    status = exception.code
+                elif exception.code is not None:
+                    status, message = 1, '{0}'.format(exception.code)
+            except Exception as exception:
+                status = 1
+                message = 'internal error: {0}'.format(exception)
+                print(traceback.format_exc(), file=stderr)
+            finally:
+                sys.stdout, sys.stderr = stdout, stderr
+        if errors.getvalue():
+            message = errors.getvalue() + (message or '')
+        return status, output.getvalue(), message
+
+    def generate(self, arguments, output):
+        args = parse_arguments(arguments)
+        data = self.data
+        if (args.data is not None and
+                os.path.abspath(args.data) != data.path):
+            sys.exit('server data directory is {0}'.format(data.path))
+        if any(path is not None for template, path in args.outputs):
+            sys.exit('output files are not supported by the server')
+        # any local process can connect: options writing or deleting files
+        # on the server side are refused
+        parser = argument_parser()
+        for option in ('result_cache', 'result_cache_size', 'write_plan',
+                       'profile_output'):
+            if getattr(args, option) != parser.get_default(option):
+                sys.exit('--{0} is not supported by the server'
+                         .format(option.replace('_', '-')))
+        # the server renders in its own process, with its own caches
+        args.jobs = 1
+        generate(args, data.zones, data.topology_dir, data.output_dirs,
+                 output, cache=self.cache,
+                 loaders=(data.topo_loader, data.output_loader))
+        self.cache.evict()
+
+    def refresh(self):
+        """
+        Reloads the data directory if files changed
+        """
+        # sys.stderr is only the server's own while holding the lock,
+        # handle() swaps it for the duration of a request
+        with self.lock:
+            try:
+                changed = self.data.refresh()
+            except SystemExit as exception:
+                print('reload failed: {0}'.format(exception.code),
+                      file=sys.stderr)
+                return
+            for path in changed:
+                print('changed: {0}'.format(path), file=sys.stderr)
+
+    def watch(self):
+        while not self.stopped.wait(self.interval):
+            self.refresh()
+
+    def start_watcher(self):
+        watcher = threading.Thread(target=self.watch, name='netgen-watcher')
+        watcher.daemon = True
+        watcher.start()
+        return watcher
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        line = self.rfile.readline()
+        try:
+            request = json.loads(line.decode('utf-8'))
+            arguments = [str(argument) for argument in request['arguments']]
+        except (ValueError, KeyError, TypeError) as exception:
+            response = {'status': 2, 'output': '',
+                        'error': 'invalid request: {0}'.format(exception)}
+        else:
+            status, output, error = self.server.netgen.handle(
+                arguments, tty=bool(request.get('tty')))
+            response = {'status': status, 'output': output, 'error': error}
+        self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+
+
+class UnixServer(socketserver.UnixStreamServer):
+
+    def server_bind(self):
+        # remove the socket left by a previous server
+        try:
+            if stat.S_ISSOCK(os.stat(self.server_address).st_mode):
+                os.unlink(self.server_address)
+        except OSError:
+            pass
+        socketserver.UnixStreamServer.server_bind(self)
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        try:
+            os.unlink(self.server_address)
+        except OSError:
+            pass
+
+
+class TCPServer(socketserver.TCPServer):
+    allow_reuse_address = True
+
+
+def make_server(netgen_server, address):
+    """
+    Creates the socket server
+
+    args:
+        address: a unix socket path, or a (host, port) tuple
+    """
+    if isinstance(address, tuple):
+        server = TCPServer(address, RequestHandler)
+    else:
+        server = UnixServer(address, RequestHandler)
+    server.netgen = netgen_server
+    return server
+
+
+def parse_arguments_serve(arguments):
+    parser = argparse.ArgumentParser(
+        prog='netgen serve',
+        description='serve ip address plans to netgen-client')
+    parser.add_argument('--data', '-d', metavar='DIR', type=str,
+                        default=os.environ.get('NETGEN_DATA_DIR', '.'),
+                        help='the data directory (default: .)')
+    listen = parser.add_mutually_exclusive_group()
+    listen.add_argument('--socket', '-s', metavar='PATH', type=str,
+                        default=None,
+                        help='listen on this unix socket'
+                             ' (default: DIR/.netgen.sock)')
+    listen.add_argument('--port', '-P', metavar='PORT', type=int,
+                        default=None,
+                        help='listen on this localhost tcp port instead')
+    parser.add_argument('--interval', metavar='SECONDS', type=float,
+                        default=2.0,
+                        help='interval between checks for changed files'
+                             ' (default: 2)')
+    parser.add_argument('--cache-size', metavar='MB', type=int, default=256,
+                        help='maximum size of the in-memory results'
+                             ' (default: 256)')
+    parser.add_argument('--template-cache', metavar='DIR', type=str,
+                        default=os.environ.get('NETGEN_TEMPLATE_CACHE'),
+                        help='store compiled templates in this directory')
+    parser.add_argument('--debug', action='store_true', default=False,
+                        help='don\'t catch exceptions')
+    return parser.parse_args(arguments)
+
+
+def main(arguments=None):
+    args = parse_arguments_serve(arguments)
+
+    if args.template_cache is not None:
+        try:
+            if not os.path.isdir(args.template_cache):
+                os.makedirs(args.template_cache)
+        except OSError as exception:
+            sys.exit('io error: {0}'.format(exception))
+        set_template_cache(args.template_cache)
+
+    netgen_server = Server(DataDirectory(args.data, debug=args.debug),
+                           cache_size=args.cache_size * 2 ** 20,
+                           interval=args.interval)
+
+    if args.port is not None:
+        address = ('127.0.0.1', args.port)
+    else:
+        address = args.socket or default_socket(args.data)
+
+    try:
+        server = make_server(netgen_server, address)
+    except (OSError, socket.error) as exception:
+        sys.exit('io error: {0}'.format(exception))
+
+    print('listening on {0}'.format(address), file=sys.stderr)
+    netgen_server.start_watcher()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        netgen_server.stopped.set()
+        server.server_close()
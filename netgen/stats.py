@@ -1,76 +1,224 @@
-from __future__ import division
+from __future__ import print_function, division
 import argparse
 import json
-import ipaddr
-from ipaddress import IPv4Network, IPv6Network
 import sys
 
+from .emitters import address_formatter
+from .streaming import iter_json_values
+
+
+def prefix_size(network):
+    """
+    Parses a network string without building ipaddress objects
+
+    returns:
+        a (ipversion, prefixlen, number of addresses) tuple
+    """
+    address, _, prefixlen = network.partition('/')
+    if ':' in address:
+        ipversion, bits = 6, 128
+    else:
+        ipversion, bits = 4, 32
+    prefixlen = int(prefixlen) if prefixlen else bits
+    if not 0 <= prefixlen <= bits:
+        raise ValueError('invalid prefix length: {0}'.format(network))
+    return ipversion, prefixlen, 1 << (bits - prefixlen)
+
+
+def percent(part, total):
+    return part / total * 100 if total else 0.0
+
+
+def zone_stats(zone, ipversion):
+    """
+    Returns the usage of an allocated Zone, from its host counters
+
+    returns:
+        the Analyzer.add_zone arguments, as a json-serializable list
+    """
+    fmt = address_formatter(ipversion)
+    return [str(zone.network), zone.vrf, ipversion,
+            1 << (zone.net_max_prefixlen - zone.prefixlen),
+            [['{0}/{1}'.format(fmt(subnet.start), subnet.prefixlen),
+              subnet.prefixlen, subnet.host_count or None]
+             for subnet in zone.subnets]]
+
+
+def write_stats(zones, ipversion, output_file):
+    """
+    Writes the usage of allocated zones, one json line per zone
+    """
+    for zone in zones:
+        output_file.write(json.dumps(zone_stats(zone, ipversion)))
+        output_file.write('\n')
+
+
+class StatsCollector(object):
+    """
+    File-like object feeding the lines written by write_stats
+    to an Analyzer
+
+    netgen --stats writes the usage of each network with write_stats
+    through the regular output path, so that it works with the result
+    cache and the worker processes
+    """
+
+    def __init__(self, analyzer):
+        self.analyzer = analyzer
+        self.buffer = ''
+
+    def write(self, data):
+        lines = (self.buffer + data).split('\n')
+        self.buffer = lines.pop()
+        for line in lines:
+            if line:
+                self.analyzer.add_zone(*json.loads(line))
+
+    def flush(self):
+        pass
+
 
 class Analyzer(object):
+    """
+    Computes the address space usage of zones
+
+    Zones are analyzed one at a time, the totals are kept per ip version,
+    per vrf and per subnet prefix length
+    """
 
-    def __init__(self, ipv, verbose=False):
+    def __init__(self, ipv=None, verbose=False, output_file=None):
+        """
+        args:
+            ipv: only analyze zones of this ip version (default: all)
+            verbose: print the usage of each subnet
+        """
+        if ipv not in (None, 4, 6):
+            raise ValueError(ipv)
         self.verbose = verbose
         self.ipv = ipv
-        if ipv == 4:
-            self.Network = IPv4Network
-        elif ipv == 6:
-            self.Network = IPv6Network
-        else:
-            raise ValueError(ipv)
+        self.output_file = output_file
+        # ipversion -> [networks, used hosts, used netspace, netspace]
+        self.totals = {}
+        # (ipversion, vrf) -> [networks, used hosts, used netspace, netspace]
+        self.vrfs = {}
+        # (ipversion, prefixlen) -> [subnets, used hosts, netspace]
+        self.prefixes = {}
+
+    def write(self, line):
+        print(line, file=self.output_file or sys.stdout)
 
     def analyze(self, data):
-        total_used = total_nused = total_avail = 0
-        if not data:
-            return
-        for zone in data:
-            (used, nused, avail) = self.analyze_zone(zone)
-            total_used += used
-            total_nused += nused
-            total_avail += avail
-        print('=> {} networks: {} used ({:.02f}% hosts / {:.02f}% net), '
-              '{} wasted ({:.02f}% hosts / {:.02f}% net), {} total'
-              .format(len(data),
-                      total_used,
-                      total_used / total_avail * 100,
-                      total_nused / total_avail * 100,
-                      total_avail - total_used,
-                      (total_avail - total_used) / total_avail * 100,
-                      (total_avail - total_nused) / total_avail * 100,
-                      total_avail))
+        """
+        Analyzes an iterable of zones and prints the totals
+        """
+        for zone in data or []:
+            self.analyze_zone(zone)
+        self.report()
 
     def analyze_zone(self, zone):
-        supernet = self.Network(zone['network'])
-        supernet_hosts = supernet.num_addresses
-        subnets_hosts = sum([self.Network(subnet['network']).num_addresses
-                             for subnet in zone['subnets']
-                             if 'hosts' in subnet])
-        print('network {}: {}/{} netspace used ({:.02f}%)'
-              .format(supernet, subnets_hosts,
-                      supernet_hosts, subnets_hosts / supernet_hosts * 100))
-        used_hosts = 0
-        last_subnet = None
-        for subnet in zone['subnets']:
-            #if last_subnet is not None and subnet.subnet_of(last_subnet):
-            #    continue
-            used_hosts += self.analyze_subnet(subnet)
-            last_subnet = subnet
-        print('-> {}: {}/{} ({:.02f}%) really used, {} wasted\n'
-              .format(supernet, used_hosts, supernet_hosts,
-                      used_hosts / supernet_hosts * 100,
-                      supernet_hosts - used_hosts))
-        return (used_hosts, subnets_hosts, supernet_hosts)
-
-    def analyze_subnet(self, subnet):
-        subnet_obj = self.Network(subnet['network'])
-        subnet_hosts_max = subnet_obj.num_addresses
-        subnet_hosts = len(subnet.get('hosts', []))
-        if not subnet_hosts:
-            return 0
-        if self.verbose:
-            print('  - {}: {}/{} used ({:.02f}%)'
-                  .format(subnet_obj, subnet_hosts, subnet_hosts_max,
-                          subnet_hosts / subnet_hosts_max * 100))
-        return subnet_hosts
+        """
+        Analyzes a zone, as found in the netgen yaml output
+
+        returns:
+            a (used hosts, used netspace, netspace) tuple,
+            or None if the zone is filtered out
+        """
+        if 'network' not in zone:
+            raise ValueError('zone "{0}" has no network, use the yaml output'
+                             ' converted with netgen-yaml2json'
+                             .format(zone.get('zone')))
+        ipversion, prefixlen, supernet_size = prefix_size(zone['network'])
+        if self.ipv is not None and ipversion != self.ipv:
+            return None
+        subnets = []
+        for subnet in zone.get('subnets') or []:
+            hosts = subnet.get('hosts')
+            subnets.append((subnet['network'],
+                            prefix_size(subnet['network'])[1],
+                            len(hosts) if hosts is not None else None))
+        return self.add_zone(zone['network'], zone.get('vrf'), ipversion,
+                             supernet_size, subnets)
+
+    def add_zone(self, network, vrf, ipversion, supernet_size, subnets):
+        """
+        Adds the usage of a zone to the totals
+
+        args:
+            subnets: iterable of (network, prefixlen, host count) tuples,
+                     with a host count of None for subnets without hosts
+        returns:
+            a (used hosts, used netspace, netspace) tuple
+        """
+        bits = 32 if ipversion == 4 else 128
+        used_hosts = subnets_hosts = 0
+        verbose = []
+        for subnet_network, prefixlen, hosts in subnets:
+            size = 1 << (bits - prefixlen)
+            prefix = self.prefixes.setdefault((ipversion, prefixlen),
+                                              [0, 0, 0])
+            prefix[0] += 1
+            prefix[2] += size
+            if hosts is None:
+                continue
+            subnets_hosts += size
+            if not hosts:
+                continue
+            used_hosts += hosts
+            prefix[1] += hosts
+            if self.verbose:
+                verbose.append('  - {0}: {1}/{2} used ({3:.02f}%)'
+                               .format(subnet_network, hosts, size,
+                                       percent(hosts, size)))
+        self.write('network {0}: {1}/{2} netspace used ({3:.02f}%)'
+                   .format(network, subnets_hosts, supernet_size,
+                           percent(subnets_hosts, supernet_size)))
+        for line in verbose:
+            self.write(line)
+        self.write('-> {0}: {1}/{2} ({3:.02f}%) really used, {4} wasted\n'
+                   .format(network, used_hosts, supernet_size,
+                           percent(used_hosts, supernet_size),
+                           supernet_size - used_hosts))
+        for totals in (self.totals.setdefault(ipversion, [0, 0, 0, 0]),
+                       self.vrfs.setdefault((ipversion, vrf), [0, 0, 0, 0])):
+            totals[0] += 1
+            totals[1] += used_hosts
+            totals[2] += subnets_hosts
+            totals[3] += supernet_size
+        return (used_hosts, subnets_hosts, supernet_size)
+
+    def report(self):
+        """
+        Prints the totals of each ip version, vrf and prefix length
+        """
+        for ipversion in sorted(self.totals):
+            networks, used, nused, avail = self.totals[ipversion]
+            self.write('=> {0} ipv{1} networks: {2} used ({3:.02f}% hosts /'
+                       ' {4:.02f}% net), {5} wasted ({6:.02f}% hosts /'
+                       ' {7:.02f}% net), {8} total'
+                       .format(networks, ipversion, used,
+                               percent(used, avail), percent(nused, avail),
+                               avail - used, percent(avail - used, avail),
+                               percent(avail - nused, avail), avail))
+            self.write('   by vrf:')
+            for (version, vrf), totals in sorted(self.vrfs.items(),
+                                                 key=lambda item: '{0}'
+                                                 .format(item[0])):
+                if version != ipversion:
+                    continue
+                networks, used, nused, avail = totals
+                self.write('     {0}: {1} networks, {2}/{3} used'
+                           ' ({4:.02f}% hosts / {5:.02f}% net)'
+                           .format(vrf, networks, used, avail,
+                                   percent(used, avail),
+                                   percent(nused, avail)))
+            self.write('   by prefix length:')
+            for (version, prefixlen), totals in sorted(self.prefixes.items()):
+                if version != ipversion:
+                    continue
+                subnets, used, size = totals
+                self.write('     /{0}: {1} subnets, {2}/{3} used ({4:.02f}%)'
+                           .format(prefixlen, subnets, used, size,
+                                   percent(used, size)))
 
 
 def main():
@@ -79,18 +227,22 @@ def main():
                         default=False)
     parser.add_argument('filename', nargs='?',
                         type=argparse.FileType('r'), default=sys.stdin,
-                        help='netgen json data file name')
+                        help=('netgen json data file name, a list of zones'
+                              ' or one zone per line'))
 
     ipv_group = parser.add_mutually_exclusive_group()
-    ipv_group.required = True
     ipv_group.add_argument('--ipv4', '-4', action='store_true', default=False,
                                            help='only output ipv4 entries')
     ipv_group.add_argument('--ipv6', '-6', action='store_true', default=False,
                                            help='only output ipv6 entries')
     args = parser.parse_args()
-    try:
-        data = json.load(args.filename)
-    except ValueError as err:
-        print('error loading file: {}'.format(err))
 
-    Analyzer(4 if args.ipv4 else 6, verbose=args.verbose).analyze(data)
+    ipv = 4 if args.ipv4 else 6 if args.ipv6 else None
+    analyzer = Analyzer(ipv, verbose=args.verbose)
+    try:
+        for value in iter_json_values(args.filename):
+            for zone in (value if isinstance(value, list) else [value]):
+                analyzer.analyze_zone(zone)
+    except (ValueError, KeyError, TypeError, AttributeError) as err:
+        sys.exit('error loading file: {0}'.format(err))
+    analyzer.report()
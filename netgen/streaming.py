@@ -0,0 +1,252 @@
+"""
+Helpers for incremental parsing of large documents
+"""
+import json
+import re
+from yaml.events import (AliasEvent, ScalarEvent, SequenceStartEvent,
+                         SequenceEndEvent, MappingStartEvent, MappingEndEvent,
+                         StreamEndEvent)
+from yaml.nodes import ScalarNode, SequenceNode, MappingNode
+from yaml.composer import ComposerError
+
+
+class IterReader(object):
+    """
+    File-like object reading from an iterable of strings
+
+    Used to feed the output of template.generate() to a yaml parser
+    without joining it in a single string
+    """
+
+    def __init__(self, chunks, name='<generator>'):
+        self.chunks = iter(chunks)
+        self.name = name
+        self.buffer = ''
+
+    def read(self, size=-1):
+        parts = [self.buffer]
+        length = len(self.buffer)
+        while size < 0 or length < size:
+            try:
+                chunk = next(self.chunks)
+            except StopIteration:
+                break
+            parts.append(chunk)
+            length += len(chunk)
+        data = ''.join(parts)
+        if size < 0:
+            self.buffer = ''
+            return data
+        self.buffer = data[size:]
+        return data[:size]
+
+
+class EventComposer(object):
+    """
+    Builds yaml nodes from the events of a loader
+
+    This works with both the pure python and the libyaml based loaders,
+    which allows constructing documents piece by piece
+    """
+
+    def __init__(self, loader):
+        self.loader = loader
+        self.anchors = {}
+
+    def compose(self, event):
+        """
+        Composes the node starting with event, consuming the loader
+        events up to the end of the node
+        """
+        loader = self.loader
+        if isinstance(event, AliasEvent):
+            if event.anchor not in self.anchors:
+                raise ComposerError(None, None, 'found undefined alias {0!r}'
+                                    .format(event.anchor), event.start_mark)
+            return self.anchors[event.anchor]
+        if isinstance(event, ScalarEvent):
+            tag = event.tag
+            if tag is None or tag == '!':
+                tag = loader.resolve(ScalarNode, event.value, event.implicit)
+            node = ScalarNode(tag, event.value, event.start_mark,
+                              event.end_mark, style=event.style)
+        elif isinstance(event, SequenceStartEvent):
+            tag = event.tag
+            if tag is None or tag == '!':
+                tag = loader.resolve(SequenceNode, None, event.implicit)
+            node = SequenceNode(tag, [], event.start_mark, None,
+                                flow_style=event.flow_style)
+            if event.anchor is not None:
+                self.anchors[event.anchor] = node
+            while not loader.check_event(SequenceEndEvent):
+                node.value.append(self.compose(loader.get_event()))
+            node.end_mark = loader.get_event().end_mark
+            return node
+        elif isinstance(event, MappingStartEvent):
+            tag = event.tag
+            if tag is None or tag == '!':
+                tag = loader.resolve(MappingNode, None, event.implicit)
+            node = MappingNode(tag, [], event.start_mark, None,
+                               flow_style=event.flow_style)
+            if event.anchor is not None:
+                self.anchors[event.anchor] = node
+            while not loader.check_event(MappingEndEvent):
+                key = self.compose(loader.get_event())
+                value = self.compose(loader.get_event())
+                node.value.append((key, value))
+            node.end_mark = loader.get_event().end_mark
+            return node
+        else:
+            raise ComposerError(None, None, 'unexpected event {0}'
+                                .format(event), event.start_mark)
+        if event.anchor is not None:
+            self.anchors[event.anchor] = node
+        return node
+
+    def construct(self, event):
+        """
+        Composes and constructs the python object starting with event
+        """
+        return self.loader.construct_document(self.compose(event))
+
+
+def iter_yaml_mapping(loader):
+    """
+    Parses a single yaml document whose root is a mapping, incrementally
+
+    Top-level keys are yielded as (key, value) pairs. When a value is a
+    sequence, it is yielded as a generator of its items, which must be
+    consumed before resuming the iteration.
+    If the root of the document is not a mapping, a single (None, value)
+    pair is yielded.
+    """
+    composer = EventComposer(loader)
+    try:
+        loader.get_event()  # StreamStartEvent
+        if loader.check_event(StreamEndEvent):
+            yield (None, None)
+            return
+        loader.get_event()  # DocumentStartEvent
+        event = loader.get_event()
+        if not isinstance(event, MappingStartEvent):
+            yield (None, composer.construct(event))
+        else:
+            while not loader.check_event(MappingEndEvent):
+                key = composer.construct(loader.get_event())
+                event = loader.get_event()
+                if isinstance(event, SequenceStartEvent):
+                    items = iter_yaml_sequence(loader, composer)
+                    yield (key, items)
+                    for _ in items:
+                        pass
+                else:
+                    yield (key, composer.construct(event))
+            loader.get_event()  # MappingEndEvent
+        loader.get_event()  # DocumentEndEvent
+        if not loader.check_event(StreamEndEvent):
+            event = loader.get_event()
+            raise ComposerError('expected a single document in the stream',
+                                None, 'but found another document',
+                                event.start_mark)
+    finally:
+        loader.dispose()
+
+
+def iter_yaml_sequence(loader, composer):
+    """
+    Yields the items of a sequence whose start event was consumed
+    """
+    while not loader.check_event(SequenceEndEvent):
+        yield composer.construct(loader.get_event())
+    loader.get_event()
+
+
+JSON_SEPARATORS_RE = re.compile(r'[\s,]*')
+
+
+def iter_json_values(input_file, chunk_size=65536):
+    """
+    Parses a json stream incrementally, without reading it whole
+
+    If the stream is a json array, its items are yielded one by one.
+    Otherwise the top-level values, separated by whitespace or commas
+    as in json lines or in the netgen json output, are yielded.
+    """
+    decoder = json.JSONDecoder()
+    buffer = input_file.read(chunk_size)
+    eof = not buffer
+    position = 0
+    in_array = None
+    # size of the largest value so far, buffered before decoding the
+    # next one to avoid decoding incomplete values of similar size
+    largest = 0
+    while True:
+        position = JSON_SEPARATORS_RE.match(buffer, position).end()
+        if position == len(buffer):
+            if eof:
+                if in_array:
+                    raise ValueError('unterminated array')
+                return
+            buffer = input_file.read(chunk_size)
+            eof = not buffer
+            position = 0
+            continue
+        if in_array is None:
+            in_array = buffer[position] == '['
+            if in_array:
+                position += 1
+                continue
+        if in_array and buffer[position] == ']':
+            position += 1
+            in_array = None
+            continue
+        if not eof and len(buffer) - position <= largest:
+            more = input_file.read(largest + chunk_size)
+            eof = not more
+            buffer = buffer[position:] + more
+            position = 0
+            continue
+        try:
+            value, end = decoder.raw_decode(buffer, position)
+        except ValueError:
+            if eof:
+                raise
+            end = None
+        if end is None or (end == len(buffer) and not eof):
+            # incomplete value, read at least as much as buffered
+            # so that large values are decoded in linear time
+            more = input_file.read(max(chunk_size, len(buffer) - position))
+            eof = not more
+            buffer = buffer[position:] + more
+            position = 0
+            continue
+        largest = max(largest, end - position)
+        yield value
+        position = end
+
+
+def iter_yaml_documents(loader):
+    """
+    Parses a yaml stream incrementally, document by document
+
+    Yields a (is_sequence, value) pair for each document. When the root
+    of a document is a sequence, value is a generator of its items,
+    which must be consumed before resuming the iteration.
+    """
+    composer = EventComposer(loader)
+    try:
+        loader.get_event()  # StreamStartEvent
+        while not loader.check_event(StreamEndEvent):
+            loader.get_event()  # DocumentStartEvent
+            composer.anchors = {}
+            event = loader.get_event()
+            if isinstance(event, SequenceStartEvent):
+                items = iter_yaml_sequence(loader, composer)
+                yield (True, items)
+                for _ in items:
+                    pass
+            else:
+                yield (False, composer.construct(event))
+            loader.get_event()  # DocumentEndEvent
+    finally:
+        loader.dispose()
@@ -0,0 +1,166 @@
+"""
+Timing hooks for the generation stages
+
+Topology and NetworkGenerator time their stages with timed() blocks.
+Callbacks registered with register() are called at the end of each
+block with the stage name, the elapsed time in seconds and a context
+dict describing the network. Without callbacks, timed() blocks only
+cost a list check.
+
+Stages:
+    load: loading and compilation of the topology template
+    render: rendering of the topology template
+    parse: yaml parsing of the rendered topology
+    validate: validation of the topology data
+    allocate: allocation of the subnets and hosts
+    stream-topology: with streaming, render, parse, validate and
+                     allocate are interleaved and timed together
+    output: rendering of the output
+"""
+from __future__ import print_function, division
+import json
+import time
+from collections import OrderedDict
+
+clock = getattr(time, 'perf_counter', time.time)
+
+_callbacks = []
+
+stages = ('load', 'render', 'parse', 'validate', 'allocate',
+          'stream-topology', 'output')
+
+
+def register(callback):
+    """
+    Registers a callback(stage, elapsed, context)
+    """
+    _callbacks.append(callback)
+
+
+def unregister(callback):
+    _callbacks.remove(callback)
+
+
+class timed(object):
+    """
+    Context manager timing a stage for the registered callbacks
+    """
+    __slots__ = ('stage', 'context', 'start')
+
+    def __init__(self, stage, context=None):
+        self.stage = stage
+        self.context = context
+        self.start = None
+
+    def __enter__(self):
+        if _callbacks:
+            self.start = clock()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.start is not None:
+            elapsed = clock() - self.start
+            for callback in list(_callbacks):
+                callback(self.stage, elapsed, self.context or {})
+
+
+class Profiler(object):
+    """
+    Timing callback accumulating the stages of each network
+
+    The network being generated is set with begin() and end(), which
+    also measure its total time, including result cache lookups
+    """
+
+    def __init__(self):
+        self.networks = OrderedDict()
+        self.current = None
+        self.start = None
+
+    def __call__(self, stage, elapsed, context):
+        if self.current is None:
+            return
+        timings = self.networks[self.current]
+        timings[stage] = timings.get(stage, 0.0) + elapsed
+
+    def begin(self, zone, network, topology):
+        self.current = (zone, network, topology)
+        self.networks.setdefault(self.current, {})
+        self.start = clock()
+
+    def end(self):
+        """
+        returns:
+            the timings of the network
+        """
+        timings = self.networks[self.current]
+        timings['total'] = timings.get('total', 0.0) + clock() - self.start
+        self.current = None
+        return timings
+
+    def merge(self, key, timings):
+        """
+        Adds the timings of a network measured by another profiler
+        """
+        merged = self.networks.setdefault(tuple(key), {})
+        for stage, elapsed in timings.items():
+            merged[stage] = merged.get(stage, 0.0) + elapsed
+
+    def totals(self):
+        totals = {}
+        for timings in self.networks.values():
+            for stage, elapsed in timings.items():
+                totals[stage] = totals.get(stage, 0.0) + elapsed
+        return totals
+
+    def columns(self):
+        seen = set()
+        for timings in self.networks.values():
+            seen.update(timings)
+        columns = [stage for stage in stages if stage in seen]
+        columns.extend(sorted(seen - set(stages) - set(['total'])))
+        return columns + ['total']
+
+    def report(self, output_file):
+        """
+        Prints the timings of the networks, the slowest first
+        """
+        columns = self.columns()
+        rows = sorted(self.networks.items(),
+                      key=lambda item: -item[1].get('total', 0.0))
+        widths = [max([len(header)] + [len('{0}'.format(key[index]))
+                                       for key, timings in rows])
+                  for index, header in enumerate(('zone', 'network',
+                                                  'topology'))]
+        line = ' '.join(['{{{0}:<{1}}}'.format(index, width)
+                         for index, width in enumerate(widths)] +
+                        ['{{{0}:>{1}}}'.format(index + 3,
+                                               max(len(column), 9))
+                         for index, column in enumerate(columns)])
+        print(line.format('zone', 'network', 'topology', *columns),
+              file=output_file)
+        for key, timings in rows:
+            print(line.format(*(list(key) + [self.seconds(timings, column)
+                                             for column in columns])),
+                  file=output_file)
+        totals = self.totals()
+        print(line.format('total', '', '', *[self.seconds(totals, column)
+                                             for column in columns]),
+              file=output_file)
+
+    @staticmethod
+    def seconds(timings, stage):
+        if stage not in timings:
+            return '-'
+        return '{0:.4f}'.format(timings[stage])
+
+    def dump(self, output_file):
+        """
+        Writes the timings as json
+        """
+        networks = [{'zone': key[0], 'network': key[1], 'topology': key[2],
+                     'stages': timings}
+                    for key, timings in self.networks.items()]
+        json.dump({'networks': networks, 'totals': self.totals()},
+                  output_file, indent=2, sort_keys=True)
+        output_file.write('\n')
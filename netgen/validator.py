@@ -0,0 +1,247 @@
+"""
+Fast validator for the topology format
+
+Performs the same checks as NetworkGenerator.topology_schema and reports
+the same error messages, using precompiled patterns and a single pass
+over the data instead of the generic voluptuous machinery
+"""
+import re
+from ipaddress import IPv4Network, IPv6Network
+from six import u, integer_types
+from voluptuous import Invalid, MultipleInvalid
+
+from .allocators import allocators
+
+
+NAME_RE = re.compile(r'^[A-Za-z0-9-]+$')
+SUBNET_NAME_RE = re.compile(r'^([!?]?[A-Za-z0-9-]+|_)$')
+HOST_NAME_RE = re.compile(r'^([!?]?[A-Za-z0-9-]+|_(/\d+)?)$')
+RANGE_PREFIX_RE = re.compile(r'^([!?]?[A-Za-z0-9-]*|_(/\d+)?)$')
+RANGE_SUFFIX_RE = re.compile(r'^[A-Za-z0-9-]*$')
+
+DICT_VALUE = ' for dictionary value'
+
+
+def match_error(pattern, value, suffix=''):
+    """
+    Returns the error message if value does not match pattern, or None
+    """
+    try:
+        if pattern.match(value):
+            return None
+    except TypeError:
+        return 'expected string or buffer' + suffix
+    return ('does not match regular expression {0}'.format(pattern.pattern)
+            + suffix)
+
+
+def int_error(value, suffix=''):
+    if isinstance(value, integer_types):
+        return None
+    return 'expected int' + suffix
+
+
+def positive_int_error(value, suffix=''):
+    message = int_error(value, suffix)
+    if message is None and value < 0:
+        return 'value must be at least 0' + suffix
+    return message
+
+
+def network_value(value):
+    """
+    Returns the normalized network string, or None if invalid
+    """
+    text = u(str(value))
+    if ':' in text:
+        networks = (IPv6Network, IPv4Network)
+    else:
+        networks = (IPv4Network, IPv6Network)
+    for network in networks:
+        try:
+            return str(network(text))
+        except ValueError:
+            pass
+    return None
+
+
+class TopologyValidator(object):
+    """
+    Validates the data of a topology
+
+    Raises voluptuous.MultipleInvalid on errors, like the schema
+    """
+
+    top_keys = ('zone', 'network', 'vrf', 'subnets')
+    subnet_required = ('name', 'size')
+    subnet_int_keys = frozenset(('size', 'vlan', 'align', 'mtu'))
+    range_int_keys = frozenset(('start', 'count', 'width'))
+
+    def __call__(self, data):
+        """
+        Validates a whole topology
+
+        returns:
+            the validated data, with a normalized network
+        """
+        errors = []
+        result = self.check_topology(data, [], errors)
+        if errors:
+            raise MultipleInvalid(errors)
+        return result
+
+    def validate_subnet(self, elt, path):
+        """
+        Validates a single subnet, reporting errors below path
+        """
+        errors = []
+        self.check_subnet(elt, list(path[:-1]), path[-1], errors)
+        if errors:
+            raise MultipleInvalid(errors)
+        return elt
+
+    def check_topology(self, data, path, errors):
+        if not isinstance(data, dict):
+            errors.append(Invalid('expected a dictionary', path))
+            return None
+        result = {}
+        for key, value in data.items():
+            message = None
+            if key == 'zone' or key == 'vrf':
+                message = match_error(NAME_RE, value, DICT_VALUE)
+            elif key == 'network':
+                value = network_value(value)
+                if value is None:
+                    message = 'not a valid value' + DICT_VALUE
+            elif key == 'allocator':
+                try:
+                    known = value in allocators
+                except TypeError:
+                    known = False
+                if not known:
+                    message = 'not a valid value' + DICT_VALUE
+            elif key == 'subnets':
+                if isinstance(value, list):
+                    self.check_sequence(value, path + [key],
+                                        self.check_subnet, errors)
+                else:
+                    message = 'expected a list' + DICT_VALUE
+            else:
+                errors.append(Invalid('extra keys not allowed',
+                                      path + [key]))
+                continue
+            if message is not None:
+                errors.append(Invalid(message, path + [key]))
+            result[key] = value
+        for key in self.top_keys:
+            if key not in data:
+                errors.append(Invalid('required key not provided',
+                                      path + [key]))
+        return result
+
+    @staticmethod
+    def check_sequence(items, path, check, errors):
+        """
+        Checks the items of a list
+
+        Like voluptuous, errors on the items themselves are accumulated,
+        but an error inside an item stops the validation of the list
+        """
+        item_errors = []
+        for index, item in enumerate(items):
+            inner_errors = []
+            if check(item, path, index, inner_errors) is False:
+                item_errors.extend(inner_errors)
+            elif inner_errors:
+                errors.extend(inner_errors)
+                return
+        errors.extend(item_errors)
+
+    def check_subnet(self, elt, path, index, errors):
+        """
+        Checks a subnet, returns False if elt itself is invalid
+        """
+        path = path + [index]
+        if not isinstance(elt, dict):
+            errors.append(Invalid('expected a dictionary', path))
+            return False
+        for key, value in elt.items():
+            if key in self.subnet_int_keys:
+                message = int_error(value, DICT_VALUE)
+            elif key == 'name':
+                message = match_error(SUBNET_NAME_RE, value, DICT_VALUE)
+            elif key == 'hosts':
+                if isinstance(value, list):
+                    self.check_sequence(value, path + [key],
+                                        self.check_host, errors)
+                    continue
+                message = 'expected a list' + DICT_VALUE
+            else:
+                message = 'extra keys not allowed'
+            if message is not None:
+                errors.append(Invalid(message, path + [key]))
+        for key in self.subnet_required:
+            if key not in elt:
+                errors.append(Invalid('required key not provided',
+                                      path + [key]))
+
+    def check_host(self, host, path, index, errors):
+        """
+        Checks a host, returns False if host itself is invalid
+        """
+        if host.__class__ is str and HOST_NAME_RE.match(host):
+            return
+        path = path + [index]
+        if not isinstance(host, dict):
+            message = match_error(HOST_NAME_RE, host)
+            if message is not None:
+                errors.append(Invalid(message, path))
+                return False
+            return
+        if len(host) == 1 and isinstance(host.get('range'), dict):
+            self.check_range(host['range'], path + ['range'], errors)
+            return
+        for key, value in host.items():
+            if key == 'name':
+                message = match_error(HOST_NAME_RE, value, DICT_VALUE)
+            elif key == 'vars':
+                if isinstance(value, dict):
+                    self.check_hostvars(value, path + ['vars'], errors)
+                    continue
+                message = 'expected a dictionary' + DICT_VALUE
+            else:
+                message = 'extra keys not allowed'
+            if message is not None:
+                errors.append(Invalid(message, path + [key]))
+
+    def check_range(self, hostrange, path, errors):
+        """
+        Checks a host range directive
+        """
+        for key, value in hostrange.items():
+            if key in self.range_int_keys:
+                message = positive_int_error(value, DICT_VALUE)
+            elif key == 'prefix':
+                message = match_error(RANGE_PREFIX_RE, value, DICT_VALUE)
+            elif key == 'suffix':
+                message = match_error(RANGE_SUFFIX_RE, value, DICT_VALUE)
+            elif key == 'vars':
+                if isinstance(value, dict):
+                    self.check_hostvars(value, path + ['vars'], errors)
+                    continue
+                message = 'expected a dictionary' + DICT_VALUE
+            else:
+                message = 'extra keys not allowed'
+            if message is not None:
+                errors.append(Invalid(message, path + [key]))
+        if 'count' not in hostrange:
+            errors.append(Invalid('required key not provided',
+                                  path + ['count']))
+
+    def check_hostvars(self, hostvars, path, errors):
+        for key, value in hostvars.items():
+            if not isinstance(key, str):
+                errors.append(Invalid('expected str', path + [key]))
+            elif not isinstance(value, (integer_types, str, bool)):
+                errors.append(Invalid('expected int' + DICT_VALUE,
+                                      path + [key]))
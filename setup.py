@@ -32,6 +32,7 @@ setup(
         'console_scripts': [
             'network-generator = netgen.__main__:main',
             'netgen = netgen.__main__:main',
+            'netgen-client = netgen.client:main',
             'netgen-stats = netgen.stats:main',
             'netgen-yaml2json = netgen.converters:yaml2json',
             'netgen-json2yaml = netgen.converters:json2yaml',
@@ -1,9 +1,56 @@
 from __future__ import print_function, unicode_literals
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
 import unittest
 import netgen
 import netgen.engine
+import netgen.__main__
+import netgen.client
+import netgen.index
+import netgen.server
+import netgen.timing
+from netgen.cache import ParsedFileCache, ResultCache, template_digest
+from netgen.capacity import cidr_blocks, fit_count
+from netgen.converters import convert_json, convert_yaml
+from netgen.diff import diff_plans
+from netgen.filters import NetworkFilter, parse_network
+from netgen.plan import PlanFile, PlanWriter, network_records
+from netgen.stats import Analyzer, prefix_size
+from netgen.streaming import iter_json_values
 from netgen.templateutils import TemplateUtils
 from ipaddress import IPv4Address, IPv4Network
+from jinja2 import DictLoader, FileSystemLoader
+from six import StringIO
+
+EXAMPLES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'examples')
+
+
+def setUpModule():
+    # keeps the parsed zone files out of the user cache directory
+    global zones_cache_dir
+    zones_cache_dir = tempfile.mkdtemp()
+    os.environ['NETGEN_ZONES_CACHE'] = zones_cache_dir
+
+
+def tearDownModule():
+    del os.environ['NETGEN_ZONES_CACHE']
+    shutil.rmtree(zones_cache_dir)
+
+
+def run_main(*arguments):
+    stdout = sys.stdout
+    sys.stdout = output = StringIO()
+    try:
+        netgen.__main__.main(['-d', EXAMPLES_DIR] + list(arguments))
+    finally:
+        sys.stdout = stdout
+    return output.getvalue()
 
 class IPv4Host(unittest.TestCase):
 
@@ -180,6 +227,81 @@ class UnalignedIPv4Zone(unittest.TestCase):
     def test_subnets(self):
         self.assertEqual(self.zone.subnets, [])
 
+class IPv4ZoneAllocation(unittest.TestCase):
+
+    def setUp(self):
+        self.zone = netgen.IPv4Zone('testzone', '192.168.20.0/23')
+
+    def test_sequential(self):
+        self.zone.add_subnet('a', 26)
+        subnet = self.zone.add_subnet('b', 26)
+        self.assertEqual(str(subnet.network), '192.168.20.64/26')
+        self.assertEqual(subnet.start, int(IPv4Address('192.168.20.64')))
+        self.assertEqual(subnet.end, int(IPv4Address('192.168.20.127')))
+
+    def test_align(self):
+        self.zone.add_subnet('a', 30)
+        subnet = self.zone.add_subnet('b', 26, align=24)
+        self.assertEqual(str(subnet.network), '192.168.21.0/26')
+
+    def test_unaligned(self):
+        self.zone.add_subnet('a', 30)
+        self.assertRaises(netgen.UnalignedSubnet,
+                          self.zone.add_subnet, 'b', 26)
+
+    def test_full(self):
+        self.zone.add_subnet('a', 24)
+        self.zone.add_subnet('b', 24)
+        self.assertRaises(netgen.NetworkFull,
+                          self.zone.add_subnet, 'c', 30)
+
+    def test_padding(self):
+        subnet = self.zone.add_subnet('a', 24)
+        subnet.add_host('h1')
+        subnet.add_host('_/28')
+        host = subnet.add_host('h2')
+        self.assertEqual(str(host.address), '192.168.20.17')
+
+
+class IPv6ZoneAllocation(unittest.TestCase):
+
+    def test_sequential(self):
+        zone = netgen.IPv6Zone('testzone', '2001:db8::/48')
+        zone.add_subnet('a', 64)
+        subnet = zone.add_subnet('b', 64)
+        self.assertEqual(str(subnet.network), '2001:db8:0:1::/64')
+        self.assertEqual(str(subnet.add_host('h1').address),
+                         '2001:db8:0:1::1')
+
+
+class CompactHosts(unittest.TestCase):
+
+    def setUp(self):
+        self.subnet = netgen.IPv4Subnet('testsub', '192.168.10.0/24',
+                                        compact=True)
+        self.subnet.add_host('host1')
+        self.subnet.add_host('?host2', hostvars={'role': 'db'})
+        self.subnet.add_host('_')
+        self.subnet.add_host('!host3')
+
+    def test_hosts(self):
+        self.assertEqual([(host.name, str(host.address), host.status)
+                          for host in self.subnet.hosts],
+                         [('host1', '192.168.10.1', 'active'),
+                          ('host2', '192.168.10.2', 'reserved'),
+                          ('host3', '192.168.10.4', 'deprecated')])
+
+    def test_vars(self):
+        self.assertEqual(self.subnet.hosts[0].vars, {})
+        self.assertEqual(self.subnet.hosts[1].vars, {'role': 'db'})
+
+    def test_repr(self):
+        regular = netgen.IPv4Subnet('testsub', '192.168.10.0/24')
+        for name in ('host1', '?host2', '_', '!host3'):
+            regular.add_host(name)
+        self.assertEqual(repr(self.subnet.hosts), repr(regular.hosts))
+
+
 class TestTemplateUtils(unittest.TestCase):
 
     def setUp(self):
@@ -212,3 +334,1088 @@ class TestTemplateUtils(unittest.TestCase):
         for count in range(10):
             self.assertEqual([i for i in self.templateutils.function_range1(count)],
                              [i + 1 for i in range(count)])
+
+
+class SharedEnvironment(unittest.TestCase):
+
+    def setUp(self):
+        self.loader = netgen.engine.default_loader()
+
+    def test_same_environment(self):
+        self.assertIs(netgen.engine.get_environment('output', self.loader, 4),
+                      netgen.engine.get_environment('output', self.loader, 4))
+
+    def test_environment_per_ipversion(self):
+        self.assertIsNot(netgen.engine.get_environment('output', self.loader, 4),
+                         netgen.engine.get_environment('output', self.loader, 6))
+
+    def test_environment_per_kind(self):
+        self.assertIsNot(netgen.engine.get_environment('output', self.loader, 4),
+                         netgen.engine.get_environment('topology', self.loader, 4))
+
+    def test_same_search_path(self):
+        directory = os.path.join(EXAMPLES_DIR, 'topology')
+        count = len(netgen.engine._environments)
+        env = netgen.engine.get_environment(
+            'topology', netgen.engine.FileSystemLoader(directory), 4)
+        for _ in range(3):
+            self.assertIs(netgen.engine.get_environment(
+                'topology', netgen.engine.FileSystemLoader(directory), 4), env)
+        self.assertLessEqual(len(netgen.engine._environments), count + 1)
+        self.assertIsNot(netgen.engine.get_environment(
+            'topology', netgen.engine.FileSystemLoader(EXAMPLES_DIR), 4), env)
+
+
+class ParallelGeneration(unittest.TestCase):
+
+    def test_same_output(self):
+        for template in ('netgen', 'json', 'bind-reverse'):
+            self.assertEqual(run_main('-z', 'zone0', '-o', template, '-j', '2'),
+                             run_main('-z', 'zone0', '-o', template))
+
+
+class StreamingTopology(unittest.TestCase):
+
+    def test_same_output(self):
+        for template in ('netgen', 'yaml'):
+            self.assertEqual(run_main('-z', 'zone0', '-o', template,
+                                      '--streaming'),
+                             run_main('-z', 'zone0', '-o', template))
+
+    def test_subnet_error_path(self):
+        loader = DictLoader({'bad.yaml': (
+            "zone: '{{ zone }}'\nnetwork: '{{ network }}'\nvrf: '{{ vrf }}'\n"
+            "subnets:\n  - name: a\n    size: 28\n  - name: b\n    size: x\n")})
+        topology = netgen.Topology('z', 'v', '10.0.0.0/24', 'bad', loader=loader)
+        with self.assertRaises(netgen.engine.MultipleInvalid) as context:
+            netgen.IPv4NetworkGenerator(topology, streaming=True)
+        self.assertIn("data['subnets'][1]['size']", str(context.exception))
+
+
+class FastValidator(unittest.TestCase):
+
+    def setUp(self):
+        self.schema = netgen.NetworkGenerator.topology_schema
+        self.validator = netgen.NetworkGenerator.topology_validator
+        self.valid = {
+            'zone': 'z', 'network': '10.0.0.0/24', 'vrf': 'v',
+            'subnets': [{'name': '?a', 'size': 28, 'vlan': 10,
+                         'hosts': ['h1', '_', '_/30', '!h2',
+                                   {'name': 'h3', 'vars': {'a': 1}}]}],
+        }
+
+    def assertSameResult(self, data):
+        try:
+            expected = self.schema(data)
+        except netgen.engine.MultipleInvalid as exception:
+            with self.assertRaises(netgen.engine.MultipleInvalid) as context:
+                self.validator(data)
+            self.assertEqual([str(error) for error in context.exception.errors],
+                             [str(error) for error in exception.errors])
+        else:
+            self.assertEqual(self.validator(data), expected)
+
+    def test_valid(self):
+        self.assertSameResult(self.valid)
+
+    def test_network(self):
+        self.assertSameResult(dict(self.valid, network='2001:db8::/32'))
+        self.assertSameResult(dict(self.valid, network='10.0.0.1/24'))
+
+    def test_header(self):
+        self.assertSameResult(dict(self.valid, zone='a b'))
+        self.assertSameResult(dict(self.valid, extra=1))
+        self.assertSameResult(dict(self.valid, subnets='x'))
+        self.assertSameResult(None)
+
+    def test_host_range(self):
+        subnet = self.valid['subnets'][0]
+        for host in ({'range': {'prefix': '?web-', 'count': 2, 'width': 3}},
+                     {'range': {'prefix': 'a b', 'count': 'x', 'y': 1}},
+                     {'range': {'count': 1, 'vars': {'a': 1.5}}},
+                     {'range': {'prefix': 'w', 'count': 2, 'width': -1}},
+                     {'range': {'count': -2, 'start': -1}},
+                     {'range': {}}, {'range': 3},
+                     {'range': {'count': 1}, 'name': 'a'}):
+            self.assertSameResult(dict(self.valid,
+                                       subnets=[dict(subnet, hosts=[host])]))
+
+    def test_allocator(self):
+        self.assertSameResult(dict(self.valid, allocator='buddy'))
+        self.assertSameResult(dict(self.valid, allocator='best'))
+        self.assertSameResult(dict(self.valid, allocator=['buddy']))
+
+    def test_subnets(self):
+        subnet = self.valid['subnets'][0]
+        for elt in (dict(subnet, size='x'), dict(subnet, name='a b'),
+                    dict(subnet, hosts=['a b', 3, 'ok']),
+                    dict(subnet, hosts=[{'name': 'a', 'vars': {'b': 1.5}}]),
+                    {'size': 24}, 'x'):
+            self.assertSameResult(dict(self.valid, subnets=[elt, 'y']))
+
+
+class NativeEmitters(unittest.TestCase):
+
+    topology = {
+        'zone': 'z', 'network': '10.0.0.0/16', 'vrf': 'v',
+        'subnets': [{'name': 'a', 'size': 28, 'vlan': 10,
+                     'hosts': ['h1', '?h2', '_', '!h3',
+                               {'name': 'h4', 'vars': {'a': 1, 'b': True}}]},
+                    {'name': 'b', 'size': 30},
+                    {'name': 'c', 'size': 0, 'align': 24}],
+    }
+
+    def render(self, template, native, ngen_class=netgen.IPv4NetworkGenerator):
+        output = StringIO()
+        ngen = ngen_class(self.topology)
+        ngen.stream(template, netgen.engine.FileSystemLoader(
+            netgen.engine.templates_dir), output, native=native)
+        return output.getvalue()
+
+    def test_same_output(self):
+        for template in ('yaml', 'csv', 'hosts'):
+            self.assertEqual(self.render(template, True),
+                             self.render(template, False))
+
+    def test_json(self):
+        import json
+        output = self.render('json', True)
+        self.assertEqual(output.replace('}\n  ],', '},\n  ],'),
+                         self.render('json', False))
+        data = json.loads(output)
+        self.assertEqual(data['subnets'][0]['hosts'][3]['address'], '10.0.0.5')
+
+
+class ResultCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_put_get(self):
+        cache = ResultCache(self.directory)
+        key = cache.key('a', 1, {'b': 2})
+        self.assertIsNone(cache.get(key))
+        cache.put(key, 'output')
+        self.assertEqual(cache.get(key), 'output')
+
+    def test_evict(self):
+        cache = ResultCache(self.directory, max_size=10)
+        for index in range(4):
+            cache.put(cache.key(index), '12345')
+        cache.evict()
+        self.assertEqual(len(list(cache.files())), 2)
+
+    def test_evict_foreign_files(self):
+        foreign = [os.path.join(self.directory, 'ab', name)
+                   for name in ('notes.txt', 'cd' + '0' * 62)]
+        os.mkdir(os.path.join(self.directory, 'ab'))
+        for path in foreign:
+            with open(path, 'w') as foreign_fd:
+                foreign_fd.write('1234567890')
+        # not created empty: no marker, nothing is evicted
+        cache = ResultCache(self.directory, max_size=0)
+        cache.put(cache.key(0), '12345')
+        cache.evict()
+        self.assertTrue(all(os.path.exists(path) for path in foreign))
+        self.assertEqual(len(list(cache.files())), 1)
+        # unrelated files are never entries
+        cache = ResultCache(os.path.join(self.directory, 'cache'), max_size=0)
+        os.mkdir(os.path.join(cache.directory, 'ab'))
+        shutil.copy(foreign[0], os.path.join(cache.directory, 'ab'))
+        cache.evict()
+        self.assertTrue(os.path.exists(os.path.join(cache.directory, 'ab',
+                                                    'notes.txt')))
+
+    def test_template_digest_includes(self):
+        templates = {'main.tpl': '{% include "inc.tpl" %}', 'inc.tpl': 'a'}
+        env = netgen.engine.Environment(loader=DictLoader(templates))
+        digest = template_digest(env, 'main.tpl')
+        templates['inc.tpl'] = 'b'
+        self.assertNotEqual(template_digest(env, 'main.tpl'), digest)
+
+    def test_cached_output(self):
+        expected = run_main('-z', 'zone0')
+        self.assertEqual(run_main('-z', 'zone0', '--result-cache', self.directory),
+                         expected)
+        self.assertEqual(run_main('-z', 'zone0', '--result-cache', self.directory),
+                         expected)
+
+
+class ZonesCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.source = os.path.join(self.directory, 'zones.yaml')
+        self.cache = ParsedFileCache(os.path.join(self.directory, 'cache'))
+        self.parsed = []
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def parse(self, data):
+        self.parsed.append(data)
+        return data.upper()
+
+    def write(self, data, mtime):
+        with open(self.source, 'wb') as source_fd:
+            source_fd.write(data)
+        os.utime(self.source, (mtime, mtime))
+
+    def test_hit(self):
+        self.write(b'abc', 1000000000)
+        self.assertEqual(self.cache.load(self.source, self.parse), b'ABC')
+        self.assertEqual(self.cache.load(self.source, self.parse), b'ABC')
+        self.assertEqual(self.parsed, [b'abc'])
+
+    def test_invalidation(self):
+        self.write(b'abc', 1000000000)
+        self.cache.load(self.source, self.parse)
+        # same size and old mtime: the entry is trusted without reading
+        self.write(b'abd', 1000000000)
+        self.assertEqual(self.cache.load(self.source, self.parse), b'ABC')
+        self.write(b'abcd', 1000000000)
+        self.assertEqual(self.cache.load(self.source, self.parse), b'ABCD')
+        self.write(b'abcd', 1000000001)
+        self.assertEqual(self.cache.load(self.source, self.parse), b'ABCD')
+        self.assertEqual(self.parsed, [b'abc', b'abcd'])
+
+    def test_code_change(self):
+        self.write(b'abc', 1000000000)
+        self.cache.load(self.source, self.parse)
+        self.cache.code_files = ('engine.py',)
+        self.assertEqual(self.cache.load(self.source, self.parse), b'ABC')
+        self.assertEqual(self.parsed, [b'abc', b'abc'])
+
+    def test_corrupt(self):
+        self.write(b'abc', 1000000000)
+        with open(self.cache.path, 'wb') as cache_fd:
+            cache_fd.write(b'garbage')
+        self.assertEqual(self.cache.load(self.source, self.parse), b'ABC')
+        self.assertEqual(self.cache.load(self.source, self.parse), b'ABC')
+        self.assertEqual(len(self.parsed), 1)
+
+    def test_default_path(self):
+        args = netgen.__main__.argument_parser().parse_args(['-z', 'zone0'])
+        args.zones_cache = None
+        environ = os.environ.copy()
+        os.environ['XDG_CACHE_HOME'] = self.directory
+        try:
+            path = netgen.__main__.zones_cache_file(args, EXAMPLES_DIR)
+        finally:
+            os.environ.clear()
+            os.environ.update(environ)
+        self.assertEqual(os.path.dirname(path),
+                         os.path.join(self.directory, 'netgen'))
+        args.no_zones_cache = True
+        self.assertIsNone(netgen.__main__.zones_cache_file(args,
+                                                           EXAMPLES_DIR))
+
+    def test_cached_zones(self):
+        expected = run_main('-z', 'zone0', '--no-zones-cache')
+        for _ in range(2):
+            self.assertEqual(run_main('-z', 'zone0', '--zones-cache',
+                                      self.directory), expected)
+        self.assertEqual(len([name for name in os.listdir(self.directory)
+                              if name.startswith('zones-')]), 1)
+
+
+class LazyImports(unittest.TestCase):
+
+    def test_argument_parsing(self):
+        code = ('import sys\n'
+                'import netgen.__main__\n'
+                'netgen.__main__.parse_arguments(["-z", "zone0"])\n'
+                'print(sorted(set(["pkg_resources", "jinja2", "yaml",'
+                ' "voluptuous", "netgen.engine"]) & set(sys.modules)))\n')
+        output = subprocess.check_output([sys.executable, '-c', code])
+        self.assertEqual(output.decode('utf-8').strip(), '[]')
+
+    def test_star_import(self):
+        code = ('import sys\n'
+                'import netgen\n'
+                'print("netgen.engine" in sys.modules)\n'
+                'from netgen import *\n'
+                'print(NetworkGenerator.__module__, Topology.__module__,'
+                ' ConfigError.__module__)\n')
+        output = subprocess.check_output([sys.executable, '-c', code])
+        self.assertEqual(output.decode('utf-8').split(),
+                         ['False', 'netgen.engine', 'netgen.engine',
+                          'netgen.exception'])
+        for name in netgen.__all__:
+            self.assertTrue(hasattr(netgen, name), name)
+
+    def test_package_names(self):
+        self.assertIs(netgen.IPv4Host, netgen.engine.IPv4Host)
+        self.assertIs(netgen.NetworkFull, netgen.exception.NetworkFull)
+        self.assertRaises(AttributeError, getattr, netgen, 'missing')
+
+
+class NetworkFilters(unittest.TestCase):
+
+    def setUp(self):
+        self.zones = {'zone0': [
+            {'vrf': 'vrf0', 'topology': 'a',
+             'network': ['10.0.0.0/24', '10.0.1.0/24', '2001:db8::/48']},
+            {'vrf': 'vrf1', 'topology': 'b', 'network': '10.1.0.0/16'},
+        ]}
+
+    def select(self, **filters):
+        return [unit[2] for unit in
+                NetworkFilter(**filters).select(self.zones, ['zone0'])]
+
+    def test_in_network(self):
+        self.assertEqual(self.select(in_networks=['10.0.0.0/16']),
+                         ['10.0.0.0/24', '10.0.1.0/24'])
+        self.assertEqual(self.select(in_networks=['10.0.1.0/24',
+                                                  '2001:db8::/32']),
+                         ['10.0.1.0/24', '2001:db8::/48'])
+        self.assertEqual(self.select(in_networks=['0.0.0.0/0']),
+                         ['10.0.0.0/24', '10.0.1.0/24', '10.1.0.0/16'])
+        self.assertEqual(self.select(in_networks=['10.1.0.0/17']), [])
+
+    def test_network(self):
+        self.assertEqual(self.select(networks=['10.0.1.0/24', '10.1.0.0/16'],
+                                     in_networks=['10.0.0.0/16']),
+                         ['10.0.1.0/24'])
+        self.assertEqual(self.select(networks=['2001:DB8::/48']),
+                         ['2001:db8::/48'])
+
+    def test_subzone(self):
+        self.assertEqual(self.select(vrfs=['vrf1']), ['10.1.0.0/16'])
+        self.assertEqual(self.select(ipversion=6), ['2001:db8::/48'])
+        self.assertEqual(self.select(topologies=['a'], ipversion=4),
+                         ['10.0.0.0/24', '10.0.1.0/24'])
+
+    def test_parse_network(self):
+        self.assertEqual(parse_network('10.0.0.0/8'), (4, 10 << 24, 8))
+        self.assertEqual(parse_network(IPv4Network('10.0.0.0/8')),
+                         (4, 10 << 24, 8))
+        self.assertRaises(ValueError, parse_network, '10.0.0.1/8')
+
+    def test_command_line(self):
+        output = run_main('-z', 'zone0', '-o', 'json', '-N', '10.0.0.0/8',
+                          '-N', '198.51.100.0/25', '-N', '198.51.0.0/16')
+        self.assertEqual([zone['subnets'][0]['network'] for zone
+                          in iter_json_values(StringIO(output))],
+                         ['198.51.100.0/27'])
+
+
+class BinaryPlan(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'plan.bin')
+        zone = netgen.IPv4Zone('zone0', '10.0.0.0/16', vrf='vrf0')
+        subnet = zone.add_subnet('subnet0', 24, vlan=10)
+        subnet.add_host('host0')
+        subnet.add_host('_')
+        subnet.add_host('?host1', hostvars={'role': 'db'})
+        zone.add_subnet('shadow', 0, align=20)
+        zone.add_subnet('subnet1', 25)
+        writer = PlanWriter()
+        for record in network_records([zone], 4):
+            writer.add_zone(*record)
+        writer.save(self.path)
+        self.plan = PlanFile(self.path)
+
+    def tearDown(self):
+        self.plan.close()
+        shutil.rmtree(self.directory)
+
+    def test_records(self):
+        zone, = self.plan.zones()
+        self.assertEqual((zone.name, zone.vrf, str(zone.network)),
+                         ('zone0', 'vrf0', '10.0.0.0/16'))
+        subnets = self.plan.subnets(zone)
+        self.assertEqual([(subnet.name, str(subnet.network), subnet.shadow)
+                          for subnet in subnets],
+                         [('subnet0', '10.0.0.0/24', False),
+                          ('shadow', '10.0.16.0/20', True),
+                          ('subnet1', '10.0.16.0/25', False)])
+        self.assertEqual(subnets[0].vlan, 10)
+        hosts = self.plan.hosts(subnets[0])
+        self.assertEqual([(host.name, str(host.address), host.status)
+                          for host in hosts],
+                         [('host0', '10.0.0.1', 'active'),
+                          ('host1', '10.0.0.3', 'reserved')])
+        self.assertEqual(hosts[1].vars, {'role': 'db'})
+        self.assertEqual(self.plan.host(1).subnet, 0)
+
+    def test_lookup_address(self):
+        def names(address):
+            return [result.name
+                    for result in self.plan.lookup_address(address)]
+        self.assertEqual(names('10.0.0.3'), ['host1'])
+        self.assertEqual(names('10.0.0.2'), ['subnet0'])
+        self.assertEqual(names('10.0.16.200'), ['shadow'])
+        self.assertEqual(names('10.0.16.100'), ['subnet1'])
+        self.assertEqual(names('10.0.1.1'), ['zone0'])
+        self.assertEqual(names('10.0.200.1'), ['zone0'])
+        self.assertEqual(names('10.1.0.1'), [])
+        self.assertEqual(names('2001:db8::1'), [])
+
+    def test_lookup_name(self):
+        self.assertEqual([result.address for result
+                          in self.plan.lookup_name('host1')],
+                         [IPv4Address('10.0.0.3')])
+        self.assertEqual([result.index for result
+                          in self.plan.lookup_name('subnet1')], [2])
+        self.assertEqual(self.plan.lookup_name('missing'), [])
+
+    def test_command_line(self):
+        run_main('-z', 'zone0', '--write-plan', self.path)
+        with PlanFile(self.path) as plan:
+            self.assertEqual(len(plan.find_zones('zone0')), 3)
+            self.assertEqual([str(result.address) for result
+                              in plan.lookup_name('zone0-subnet1-host0')],
+                             ['192.0.2.33', '198.51.100.33',
+                              '2001:db8:0:100::1'])
+
+
+class PlanDiff(unittest.TestCase):
+
+    def plan(self, subnets):
+        zone = netgen.IPv4Zone('zone0', '10.0.0.0/16', vrf='vrf0')
+        for name, hosts, vlan in subnets:
+            subnet = zone.add_subnet(name, 24, vlan=vlan)
+            for host in hosts:
+                subnet.add_host(host)
+        writer = PlanWriter()
+        for record in network_records([zone], 4):
+            writer.add_zone(*record)
+        return PlanFile(None, data=writer.getvalue())
+
+    def test_shift(self):
+        old = self.plan([('a', ['a1'], None), ('b', ['b1'], None),
+                         ('c', ['c1', 'c2'], None), ('d', [], None)])
+        new = self.plan([('a', ['a1'], None), ('new', [], None),
+                         ('b', ['b1'], None), ('c', ['c1', 'c2'], None),
+                         ('d', [], 12)])
+        result = diff_plans(old, new)
+        subnets = result['subnets']
+        self.assertEqual([item['name'] for item in subnets['added']],
+                         ['new'])
+        self.assertEqual([(item['old']['network'], item['new']['network'])
+                          for item in subnets['renumbered']],
+                         [('10.0.1.0/24', '10.0.2.0/24'),
+                          ('10.0.2.0/24', '10.0.3.0/24'),
+                          ('10.0.3.0/24', '10.0.4.0/24')])
+        self.assertEqual(subnets['changed'], [])
+        self.assertEqual(len(result['hosts']['renumbered']), 3)
+        self.assertEqual(result['shifts'], [{
+            'zone': 'zone0', 'vrf': 'vrf0', 'ipv': 4, 'first': 'b',
+            'from': '10.0.1.0/24', 'to': '10.0.2.0/24', 'offset': 256,
+            'subnets': 3, 'after': 'a'}])
+
+    def test_renamed_and_changed(self):
+        old = self.plan([('a', ['a1', 'a2'], 10), ('b', ['!b1'], None)])
+        new = self.plan([('a', ['a1', 'a3'], 11), ('c', ['b1'], None)])
+        result = diff_plans(old, new)
+        self.assertEqual([(item['old']['name'], item['new']['name'])
+                          for item in result['subnets']['renamed']],
+                         [('b', 'c')])
+        self.assertEqual([item['new']['vlan']
+                          for item in result['subnets']['changed']], [11])
+        self.assertEqual([(item['old']['name'], item['new']['name'])
+                          for item in result['hosts']['renamed']],
+                         [('a2', 'a3')])
+        self.assertEqual([(item['old']['status'], item['new']['status'],
+                           item['new']['subnet'])
+                          for item in result['hosts']['changed']],
+                         [('deprecated', 'active', 'c')])
+        self.assertEqual(result['shifts'], [])
+
+    def test_zone_filter(self):
+        old = self.plan([('a', ['a1'], None)])
+        new = self.plan([('a', ['a1', 'a2'], None)])
+        self.assertEqual(len(diff_plans(old, new)['hosts']['added']), 1)
+        result = diff_plans(old, new, ['zone1'])
+        self.assertEqual(result['hosts']['added'], [])
+        result = diff_plans(old, new, ['zone0'])
+        self.assertEqual(len(result['hosts']['added']), 1)
+
+    def test_same_host_names(self):
+        old = self.plan([('a', ['gw', 'a1'], None), ('b', ['gw'], None)])
+        new = self.plan([('n', ['gw'], None), ('a', ['gw', 'a1'], None),
+                         ('b', ['gw'], None)])
+        hosts = diff_plans(old, new)['hosts']
+        self.assertEqual([(item['subnet'], item['name'])
+                          for item in hosts['added']], [('n', 'gw')])
+        self.assertEqual(sorted((item['old']['subnet'], item['new']['subnet'],
+                                 item['new']['name'])
+                                for item in hosts['renumbered']),
+                         [('a', 'a', 'a1'), ('a', 'a', 'gw'),
+                          ('b', 'b', 'gw')])
+        self.assertEqual(hosts['renamed'], [])
+
+    def test_command_line(self):
+        stdout = sys.stdout
+        sys.stdout = output = StringIO()
+        try:
+            netgen.__main__.main(['diff', '--json', EXAMPLES_DIR,
+                                  EXAMPLES_DIR])
+        finally:
+            sys.stdout = stdout
+        result = json.loads(output.getvalue())
+        self.assertEqual(result['shifts'], [])
+        self.assertFalse(any(result['hosts'].values()))
+
+
+class FreeSpace(unittest.TestCase):
+
+    def test_zone_free_space(self):
+        zone = netgen.IPv4Zone('zone0', '0.0.0.0/24')
+        zone.add_subnet('a', 28)
+        zone.add_subnet('_', 28)
+        zone.add_subnet('b', 28, align=26)
+        zone.add_subnet('_', 28)
+        self.assertEqual(zone.allocator.free, [(16, 63), (80, 95)])
+        self.assertEqual(zone.free_space(), [(16, 63), (80, 255)])
+        zone.add_subnet('c', 25, align=25)
+        self.assertEqual(zone.free_space(), [(16, 63), (80, 127)])
+
+    def test_blocks(self):
+        self.assertEqual(cidr_blocks(16, 63, 32), [(16, 28), (32, 27)])
+        self.assertEqual(cidr_blocks(0, 2 ** 32 - 1, 32), [(0, 0)])
+        self.assertEqual(fit_count(16, 63, 27, 32), 1)
+        self.assertEqual(fit_count(16, 63, 28, 32), 3)
+        self.assertEqual(fit_count(17, 31, 28, 32), 0)
+
+    def test_command_line(self):
+        stdout = sys.stdout
+        sys.stdout = output = StringIO()
+        try:
+            netgen.__main__.main(['capacity', '--json', '-d', EXAMPLES_DIR,
+                                  '-l', '26', '-l', '64'])
+        finally:
+            sys.stdout = stdout
+        ipv4, ipv6 = json.loads(output.getvalue())
+        self.assertEqual((ipv4['free'], ipv4['size'], ipv4['fits']),
+                         (192, 512, {'/26': 2}))
+        self.assertEqual(ipv4['networks'][0]['gaps'],
+                         ['192.0.2.160/27', '192.0.2.192/26'])
+        self.assertEqual(ipv6['fits'], {'/64': 2 ** 32 - 5 * 256})
+
+
+class Allocators(unittest.TestCase):
+
+    def test_buddy_packing(self):
+        zone = netgen.IPv4Zone('zone0', '10.0.0.0/23', allocator='buddy')
+        zone.add_subnet('a', 30)
+        zone.add_subnet('b', 24)
+        zone.add_subnet('c', 30)
+        zone.add_subnet('d', 26, align=25)
+        self.assertEqual([str(subnet.network) for subnet in zone.subnets],
+                         ['10.0.0.0/30', '10.0.1.0/24', '10.0.0.4/30',
+                          '10.0.0.128/26'])
+        start = int(IPv4Address('10.0.0.0'))
+        self.assertEqual(zone.free_space(), [(start + 8, start + 127),
+                                             (start + 192, start + 255)])
+        self.assertRaises(netgen.NetworkFull, zone.add_subnet, 'e', 25)
+        self.assertRaises(netgen.ConfigError, zone.add_subnet, 'f', 0,
+                          align=26)
+
+    def test_topology(self):
+        loader = DictLoader({'t.yaml': (
+            "zone: '{{ zone }}'\nnetwork: '{{ network }}'\nvrf: '{{ vrf }}'\n"
+            "allocator: buddy\nsubnets:\n  - name: a\n    size: 30\n"
+            "  - name: b\n    size: 25\n")})
+        for streaming in (False, True):
+            topology = netgen.Topology('z', 'v', '10.0.0.0/24', 't',
+                                       loader=loader)
+            ngen = netgen.IPv4NetworkGenerator(topology, streaming=streaming)
+            self.assertEqual([str(subnet.network)
+                              for subnet in ngen.zones[0].subnets],
+                             ['10.0.0.0/30', '10.0.0.128/25'])
+
+    def test_allocator_after_subnets(self):
+        loader = DictLoader({'t.yaml': (
+            "zone: '{{ zone }}'\nnetwork: '{{ network }}'\nvrf: '{{ vrf }}'\n"
+            "subnets:\n  - name: a\n    size: 30\nallocator: buddy\n")})
+        topology = netgen.Topology('z', 'v', '10.0.0.0/24', 't', loader=loader)
+        self.assertRaises(netgen.ConfigError, netgen.IPv4NetworkGenerator,
+                          topology, streaming=True)
+
+
+class HostRange(unittest.TestCase):
+
+    def test_same_hosts(self):
+        for compact in (False, True):
+            zone = netgen.IPv4Zone('zone0', '10.0.0.0/24', compact=compact)
+            hosts = zone.add_subnet('a', 26)
+            for name in ('x', '?web-08', '?web-09', '?web-10', '_', '_',
+                         '_/30', '_/30', '!db1b', '!db2b'):
+                hosts.add_host(name)
+            ranges = zone.add_subnet('b', 26)
+            ranges.add_host('x')
+            ranges.add_host_range('?web-', start=8, count=3, width=2)
+            ranges.add_host_range('_', count=2)
+            ranges.add_host_range('_/30', count=2)
+            ranges.add_host_range('!db', count=2, suffix='b')
+            self.assertEqual(
+                [(host.name, host.addr - 64, host.status)
+                 for host in ranges.hosts],
+                [(host.name, host.addr, host.status) for host in hosts.hosts])
+            self.assertEqual(ranges.host_count, hosts.host_count)
+            self.assertEqual(ranges._cur_addr - 64, hosts._cur_addr)
+
+    def test_topology(self):
+        template = (
+            "zone: '{{ zone }}'\nnetwork: '{{ network }}'\nvrf: '{{ vrf }}'\n"
+            "subnets:\n  - name: a\n    size: 28\n    hosts:\n"
+            "      - range: {prefix: web-, count: 3, width: 3,"
+            " vars: {role: web}}\n"
+            "      - range: {prefix: db, start: 5, count: %d}\n")
+        loader = DictLoader({'full.yaml': template % 12,
+                             't.yaml': template % 11})
+        topology = netgen.Topology('z', 'v', '10.0.0.0/24', 'full',
+                                   loader=loader)
+        with self.assertRaises(netgen.NetworkFull) as context:
+            netgen.IPv4NetworkGenerator(topology)
+        self.assertIn('host range "db5..db16"', str(context.exception))
+        bad_loader = DictLoader({'bad.yaml': template.replace(
+            'width: 3', 'width: -1') % 2})
+        topology = netgen.Topology('z', 'v', '10.0.0.0/24', 'bad',
+                                   loader=bad_loader)
+        with self.assertRaises(netgen.engine.MultipleInvalid) as context:
+            netgen.IPv4NetworkGenerator(topology)
+        self.assertIn('value must be at least 0', str(context.exception))
+        topology = netgen.Topology('z', 'v', '10.0.0.0/24', 't', loader=loader)
+        hosts = netgen.IPv4NetworkGenerator(topology).zones[0].subnets[0].hosts
+        self.assertEqual([(host.name, str(host.address), host.vars)
+                          for host in hosts[:4]],
+                         [('web-001', '10.0.0.1', {'role': 'web'}),
+                          ('web-002', '10.0.0.2', {'role': 'web'}),
+                          ('web-003', '10.0.0.3', {'role': 'web'}),
+                          ('db5', '10.0.0.4', {})])
+
+
+class PythonProviders(unittest.TestCase):
+
+    basic = (
+        "def topology(zone, vrf, network, params, ipv):\n"
+        "    for subnet_i in range(5):\n"
+        "        name = '{0}-subnet{1}'.format(zone, subnet_i)\n"
+        "        yield {'name': name, 'size': 27,\n"
+        "               'hosts': ['{0}-host{1}'.format(name, host_i)\n"
+        "                         for host_i in range(10)]}\n")
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.data_dir = os.path.join(self.directory, 'data')
+        shutil.copytree(EXAMPLES_DIR, self.data_dir)
+        os.remove(os.path.join(self.data_dir, 'topology', 'basic.yaml'))
+        with open(os.path.join(self.data_dir, 'topology', 'basic.py'),
+                  'w') as topology_fd:
+            topology_fd.write(self.basic)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def run_main(self, *arguments):
+        stdout = sys.stdout
+        sys.stdout = output = StringIO()
+        try:
+            netgen.__main__.main(['-d', self.data_dir, '--no-zones-cache']
+                                 + list(arguments))
+        finally:
+            sys.stdout = stdout
+        return output.getvalue()
+
+    def test_same_output(self):
+        for arguments in (['-o', 'json'], ['-o', 'yaml', '--streaming'],
+                          ['-o', 'netgen', '--strict-schema']):
+            self.assertEqual(self.run_main('-z', 'zone0', *arguments),
+                             run_main('-z', 'zone0', *arguments))
+
+    def test_dict_provider(self):
+        loader = DictLoader({'t.py': (
+            "def topology(zone, vrf, network, params, ipv):\n"
+            "    return {'zone': zone, 'vrf': vrf, 'network': str(network),\n"
+            "            'allocator': params['allocator'],\n"
+            "            'subnets': [{'name': 'a', 'size': 30},\n"
+            "                        {'name': 'b', 'size': 25}]}\n")})
+        topology = netgen.engine.load_topology('z', 'v', '10.0.0.0/24', 't',
+                                               params={'allocator': 'buddy'},
+                                               loader=loader)
+        self.assertIn('allocator: buddy', str(topology))
+        for streaming in (False, True):
+            ngen = netgen.IPv4NetworkGenerator(topology, streaming=streaming)
+            self.assertEqual([str(subnet.network)
+                              for subnet in ngen.zones[0].subnets],
+                             ['10.0.0.0/30', '10.0.0.128/25'])
+
+    def test_result_cache(self):
+        cache_dir = os.path.join(self.directory, 'cache')
+        expected = self.run_main('-z', 'zone0', '--result-cache', cache_dir)
+        with open(os.path.join(self.data_dir, 'topology', 'basic.py'),
+                  'a') as topology_fd:
+            topology_fd.write("    yield {'name': 'extra', 'size': 27}\n")
+        self.assertNotEqual(self.run_main('-z', 'zone0',
+                                          '--result-cache', cache_dir),
+                            expected)
+
+    def test_digest(self):
+        from netgen.providers import provider_digest
+        env = netgen.engine.get_environment(
+            'topology', FileSystemLoader(os.path.join(self.data_dir,
+                                                      'topology')), 4)
+        self.assertIsNone(provider_digest(env, 'basic'))
+        loader = DictLoader({
+            't.py': ("dependencies = ['sizes.txt']\n"
+                     "def topology(zone, vrf, network, params, ipv):\n"
+                     "    return []\n"),
+            'sizes.txt': '27\n'})
+        env = netgen.engine.get_environment('topology', loader, 4)
+        digest = provider_digest(env, 't')
+        self.assertIsNotNone(digest)
+        loader.mapping['sizes.txt'] = '28\n'
+        self.assertNotEqual(provider_digest(env, 't'), digest)
+        del loader.mapping['sizes.txt']
+        self.assertRaises(netgen.ConfigError, provider_digest, env, 't')
+
+
+class MultipleOutputs(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def read(self, name):
+        with open(os.path.join(self.directory, name)) as output_fd:
+            return output_fd.read()
+
+    def test_outputs(self):
+        json_file = os.path.join(self.directory, 'plan.json')
+        reverse_file = os.path.join(self.directory, 'rev.zone')
+        for arguments in ([], ['-j', '2'],
+                          ['--result-cache',
+                           os.path.join(self.directory, 'cache')]):
+            output = run_main('-z', 'zone0', '-o', 'csv',
+                              '-o', 'json:' + json_file,
+                              '-o', 'bind-reverse:' + reverse_file,
+                              *arguments)
+            self.assertEqual(output, run_main('-z', 'zone0', '-o', 'csv'))
+            self.assertEqual(self.read('plan.json'),
+                             run_main('-z', 'zone0', '-o', 'json'))
+            self.assertEqual(self.read('rev.zone'),
+                             run_main('-z', 'zone0', '-o', 'bind-reverse'))
+
+    def test_failure(self):
+        json_file = os.path.join(self.directory, 'plan.json')
+        with self.assertRaises(SystemExit):
+            run_main('-z', 'zone0', '-o', 'json:' + json_file,
+                     '-o', 'missing:' + os.path.join(self.directory, 'x'))
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_arguments(self):
+        stderr = sys.stderr
+        sys.stderr = StringIO()
+        try:
+            for arguments in (['-o', 'json', '-o', 'csv'],
+                              ['-o', 'json:a', '-o', 'csv:a'],
+                              ['-o', 'json:a', '--stats'], ['-o', 'json:']):
+                with self.assertRaises(SystemExit):
+                    netgen.__main__.parse_arguments(['-z', 'zone0']
+                                                    + arguments)
+        finally:
+            sys.stderr = stderr
+
+
+class ServerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.data_dir = os.path.join(self.directory, 'data')
+        shutil.copytree(EXAMPLES_DIR, self.data_dir)
+        self.server = netgen.server.Server(
+            netgen.server.DataDirectory(self.data_dir))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_handle(self):
+        for arguments in (['-z', 'zone0'], ['-z', 'zone0', '-o', 'json', '-4']):
+            self.assertEqual(self.server.handle(arguments),
+                             (0, run_main(*arguments), None))
+        # one cached result per network and output
+        self.assertEqual(len(self.server.cache), 5)
+
+    def test_error(self):
+        self.assertEqual(self.server.handle(['-z', 'nozone']),
+                         (1, '', 'zone "nozone" does not exists'))
+        status, output, error = self.server.handle([])
+        self.assertEqual(status, 2)
+        self.assertIn('--zone', error)
+
+    def test_refused_options(self):
+        target = os.path.join(self.directory, 'target')
+        for arguments in (['--result-cache', target],
+                          ['--result-cache-size', '1'],
+                          ['--write-plan', target],
+                          ['--profile-output', target],
+                          ['-o', 'json:' + target]):
+            status, output, error = self.server.handle(['-z', 'zone0']
+                                                       + arguments)
+            self.assertEqual((status, output), (1, ''))
+            self.assertIn('not supported by the server', error)
+        self.assertFalse(os.path.exists(target))
+
+    def test_reload(self):
+        output_dir = os.path.join(self.data_dir, 'output')
+        os.mkdir(output_dir)
+        with open(os.path.join(output_dir, 'names.tpl'), 'w') as output_fd:
+            output_fd.write('{{ zones|map(attribute="name")|join(",") }}\n')
+        with open(os.path.join(self.data_dir, 'zones.yaml'), 'a') as zones_fd:
+            zones_fd.write('zone1:\n'
+                           '  - {network: 10.0.0.0/24, topology: basic,'
+                           ' vrf: vrf1}\n')
+        self.assertEqual(self.server.handle(['-z', 'zone1'])[0], 1)
+        self.server.refresh()
+        self.assertEqual(self.server.handle(['-z', 'zone1', '-o', 'names']),
+                         (0, 'zone1\n', None))
+
+    def test_socket(self):
+        address = os.path.join(self.directory, 'netgen.sock')
+        server = netgen.server.make_server(self.server, address)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            response = netgen.client.request(['-z', 'zone0', '-o', 'yaml'],
+                                             address)
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+        self.assertEqual(response, (0, run_main('-z', 'zone0', '-o', 'yaml'),
+                                    None))
+
+
+class LookupIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.index_path = os.path.join(self.directory, 'index.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_nested_intervals(self):
+        intervals = netgen.index.IntervalIndex.build([
+            (0, 255, 'zone'), (0, 63, 'shadow'), (0, 31, 'subnet'),
+            (5, 5, 'host'), (128, 191, 'other')])
+        self.assertEqual([intervals.records[index] for index
+                          in intervals.chain(intervals.find(5))],
+                         ['host', 'subnet', 'shadow', 'zone'])
+        self.assertEqual(intervals.records[intervals.find(40)], 'shadow')
+        self.assertEqual(intervals.records[intervals.find(100)], 'zone')
+        self.assertEqual(intervals.find(256), -1)
+
+    def test_lookup(self):
+        index = netgen.index.open_index(EXAMPLES_DIR, self.index_path)
+        result, = index.lookup('192.0.2.34')
+        self.assertEqual((result['zone'], result['vrf'], result['subnet'],
+                          result['subnet_network'], result['vlan'],
+                          result['host']),
+                         ('zone0', 'vrf0', 'zone0-subnet1', '192.0.2.32/27',
+                          None, 'zone0-subnet1-host1'))
+        result, = index.lookup('198.51.100.34')
+        self.assertEqual((result['subnet'], result['vlan']),
+                         ('zone0-subnet1', 11))
+        self.assertNotIn('host', result)
+        self.assertEqual([result['address'] for result
+                          in index.lookup('zone0-subnet0-host0')],
+                         ['192.0.2.1', '198.51.100.1', '2001:db8::1'])
+        self.assertEqual(index.lookup('10.0.0.1'), [])
+
+    def test_persisted(self):
+        index = netgen.index.open_index(EXAMPLES_DIR, self.index_path)
+        with open(self.index_path) as index_fd:
+            loaded = netgen.index.LookupIndex.load(index_fd)
+        self.assertEqual(loaded.key, index.key)
+        for query in ('2001:db8::1', 'zone0-subnet2'):
+            self.assertEqual(loaded.lookup(query), index.lookup(query))
+
+
+    def test_zones_cache(self):
+        cache_dir = os.path.join(self.directory, 'cache')
+        stdout = sys.stdout
+        sys.stdout = output = StringIO()
+        try:
+            for _ in range(2):
+                netgen.index.main(['-d', EXAMPLES_DIR, '-i', self.index_path,
+                                   '--zones-cache', cache_dir, '--json',
+                                   '192.0.2.34'])
+        finally:
+            sys.stdout = stdout
+        self.assertEqual(len([name for name in os.listdir(cache_dir)
+                              if name.startswith('zones-')]), 1)
+        self.assertEqual(output.getvalue().count('zone0-subnet1-host1'), 2)
+
+
+class TimingHooks(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = []
+        self.zones = []
+        netgen.timing.register(self.callback)
+
+    def tearDown(self):
+        netgen.timing.unregister(self.callback)
+
+    def callback(self, stage, elapsed, context):
+        self.calls.append((stage, context.get('topology')))
+        self.zones.append((stage, context.get('zone')))
+
+    def test_stages(self):
+        topology = netgen.Topology('zone0', 'vrf0', '10.0.0.0/24', 'basic',
+                                   loader=netgen.engine.FileSystemLoader(
+                                       os.path.join(EXAMPLES_DIR, 'topology')))
+        ngen = netgen.IPv4NetworkGenerator(topology)
+        ngen.stream('hosts', netgen.engine.FileSystemLoader(
+            netgen.engine.templates_dir), StringIO())
+        self.assertEqual(self.calls, [('load', 'basic.yaml'),
+                                      ('render', 'basic.yaml'),
+                                      ('parse', 'basic.yaml'),
+                                      ('validate', None),
+                                      ('allocate', None),
+                                      ('output', None)])
+        self.assertEqual([zone for stage, zone in self.zones
+                          if stage in ('load', 'validate', 'allocate')],
+                         ['zone0'] * 3)
+
+    def test_profile_output(self):
+        directory = tempfile.mkdtemp()
+        try:
+            profile = os.path.join(directory, 'profile.json')
+            stderr = sys.stderr
+            sys.stderr = StringIO()
+            try:
+                run_main('-z', 'zone0', '--profile-output', profile)
+                report = sys.stderr.getvalue()
+            finally:
+                sys.stderr = stderr
+            with open(profile) as profile_fd:
+                data = json.load(profile_fd)
+        finally:
+            shutil.rmtree(directory)
+        self.assertEqual(len(data['networks']), 3)
+        for network in data['networks']:
+            self.assertIn('output', network['stages'])
+        self.assertTrue(report.startswith('zone '))
+        self.assertEqual(len(report.splitlines()), 5)
+
+
+class StreamingStats(unittest.TestCase):
+
+    zones = [
+        {'zone': 'z', 'vrf': 'a', 'network': '10.0.0.0/24', 'subnets': [
+            {'network': '10.0.0.0/26', 'hosts': [{}, {}]},
+            {'network': '10.0.0.64/26'}]},
+        {'zone': 'z', 'vrf': 'b', 'network': '10.1.0.0/25', 'subnets': [
+            {'network': '10.1.0.0/26', 'hosts': [{}]}]},
+        {'zone': 'z', 'vrf': 'a', 'network': '2001:db8::/48', 'subnets': [
+            {'network': '2001:db8::/64', 'hosts': [{}]}]},
+    ]
+
+    def test_prefix_size(self):
+        self.assertEqual(prefix_size('10.0.0.0/24'), (4, 24, 256))
+        self.assertEqual(prefix_size('2001:db8::/64'), (6, 64, 2 ** 64))
+        self.assertEqual(prefix_size('10.0.0.1'), (4, 32, 1))
+        self.assertRaises(ValueError, prefix_size, '10.0.0.0/33')
+
+    def test_json_values(self):
+        for text in (json.dumps(self.zones),
+                     '\n'.join(json.dumps(zone) for zone in self.zones),
+                     ',\n'.join(json.dumps(zone, indent=2)
+                                 for zone in self.zones)):
+            self.assertEqual(list(iter_json_values(StringIO(text),
+                                                   chunk_size=7)),
+                             self.zones)
+
+    def test_mixed_versions(self):
+        analyzer = Analyzer(output_file=StringIO())
+        analyzer.analyze(self.zones)
+        self.assertEqual(analyzer.totals, {4: [2, 3, 128, 384],
+                                           6: [1, 1, 2 ** 64, 2 ** 80]})
+        self.assertEqual(analyzer.vrfs[(4, 'a')], [1, 2, 64, 256])
+        self.assertEqual(analyzer.prefixes[(4, 26)], [3, 3, 192])
+
+    def test_filter(self):
+        analyzer = Analyzer(6, output_file=StringIO())
+        analyzer.analyze(self.zones)
+        self.assertEqual(list(analyzer.totals), [6])
+
+
+class InProcessStats(unittest.TestCase):
+
+    def test_count_only(self):
+        subnet = netgen.IPv4Subnet('testsub', '192.168.10.0/24',
+                                   count_only=True)
+        for name in ('host0', '_', '_/30', '?host1'):
+            subnet.add_host(name)
+        self.assertEqual(subnet.host_count, 2)
+        self.assertEqual(len(subnet.hosts), 0)
+        self.assertEqual(subnet.cur_addr, IPv4Address('192.168.10.10'))
+
+    def test_same_as_analyzer(self):
+        import yaml
+        analyzer = Analyzer(output_file=StringIO())
+        analyzer.analyze(yaml.safe_load(run_main('-z', 'zone0',
+                                                 '-o', 'yaml')))
+        self.assertEqual(run_main('-z', 'zone0', '--stats'),
+                         analyzer.output_file.getvalue())
+
+
+class StreamingConverters(unittest.TestCase):
+
+    def convert(self, function, text, **options):
+        output = StringIO()
+        function(StringIO(text), output, **options)
+        return output.getvalue()
+
+    def test_yaml2json(self):
+        text = '- a: 1\n- b: [2, 3]\n'
+        self.assertEqual(self.convert(convert_yaml, text),
+                         '[{"a": 1}, {"b": [2, 3]}]')
+        self.assertEqual(self.convert(convert_yaml, 'a: 1\n'), '{"a": 1}')
+
+    def test_yaml2json_documents(self):
+        text = '- a: 1\n- b: 2\n---\nc: 3\n'
+        self.assertEqual(self.convert(convert_yaml, text),
+                         '[{"a": 1}, {"b": 2}]\n{"c": 3}')
+        self.assertEqual(self.convert(convert_yaml, text, lines=True),
+                         '{"a": 1}\n{"b": 2}\n{"c": 3}\n')
+
+    def test_json2yaml(self):
+        self.assertEqual(self.convert(convert_json, '[{"a": 1}, {"b": 2}]'),
+                         '- a: 1\n- b: 2\n')
+        self.assertEqual(self.convert(convert_json, '{"a": 1}\n{"b": 2}\n'),
+                         '- a: 1\n- b: 2\n')
+        self.assertEqual(self.convert(convert_json, '{"a": 1}'), 'a: 1\n')
+        self.assertEqual(self.convert(convert_json, '[]'), '[]\n')
+        self.assertEqual(self.convert(convert_json, '[{"a": 1}, {"b": 2}]',
+                                      documents=True),
+                         '---\na: 1\n---\nb: 2\n')
+
+    def test_json2yaml_scalars(self):
+        import yaml
+        # concatenated flow style dumps would give "[1]\n[a]\n[null]\n"
+        for text, expected in (('[1, "a", null]', [1, 'a', None]),
+                               ('1\n"a"\nnull\n', [1, 'a', None]),
+                               ('[[1, 2], [3]]', [[1, 2], [3]])):
+            self.assertEqual(yaml.safe_load(self.convert(convert_json, text)),
+                             expected)
+
+    def test_roundtrip(self):
+        import yaml
+        text = run_main('-z', 'zone0', '-o', 'yaml')
+        converted = self.convert(convert_json,
+                                 self.convert(convert_yaml, text,
+                                              lines=True))
+        self.assertEqual(yaml.safe_load(converted), yaml.safe_load(text))